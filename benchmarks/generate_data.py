@@ -0,0 +1,406 @@
+"""generate_data: Synthetic inputs for build_script.py benchmarks
+
+Writes a complete, self-consistent set of build inputs (FSES sample
+files, chemical/sample ID maps, MASV classes, endpoint mapping and
+legacy BMD/dose/fit tables) plus a srp_build_files.csv that points
+to them, so the pipeline can be run offline at any scale.
+"""
+
+# =========================================================
+# Imports
+# =========================================================
+import os
+import sys
+from argparse import ArgumentParser
+from dataclasses import asdict, dataclass
+
+import numpy as np
+import pandas as pd
+
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.params import MASV_CC, MASV_SOURCE, REQUIRED_SAMPLE_COLUMNS
+
+MODELS = ["logistic", "gamma", "weibull", "log logistic", "probit", "log probit"]
+CHEMICAL_CLASSES = ["PAH", "Industrial", "Flame Retardant", "Pesticide", "PFAS"]
+MATRICES = ["Water", "Sediment", "Wristband", "Air"]
+
+# First IDs of generated chemicals, samples and extracts; extracts
+# are sub-sampled like the real data (Sample_ID "{extract}-{n}")
+FIRST_CHEMICAL_ID = 1000
+FIRST_SAMPLE_ID = 100
+FIRST_EXTRACT_ID = 9000
+SAMPLES_PER_EXTRACT = 3
+
+
+# =========================================================
+# Functions
+# =========================================================
+@dataclass
+class SyntheticConfig:
+    """Size of a synthetic dataset.
+
+    Counts of chemicals, samples and extracts are multiplied by
+    `scale`; endpoints and curve points are not.
+
+    Parameters
+    ----------
+    chemicals : int, optional
+        Number of chemicals, by default 300
+    samples : int, optional
+        Number of environmental samples, by default 150
+    extracts : int, optional
+        Number of extracts; each is sub-sampled into
+        `SAMPLES_PER_EXTRACT` samples, by default 50
+    endpoints : int, optional
+        Number of zebrafish endpoints, by default 20
+    curve_points : int, optional
+        Points per fitted curve, by default 15
+    dose_points : int, optional
+        Doses per dose-response curve, by default 8
+    chemicals_per_sample : int, optional
+        Chemicals measured in each sample, by default 25
+    phases : int, optional
+        Number of legacy BMD/dose/fit phases; phases overlap, so
+        later phases repeat rows of earlier ones, by default 3
+    fses_files : int, optional
+        Number of FSES files the samples are split over, by default 2
+    scale : int, optional
+        Multiplier for chemicals, samples and extracts, by default 1
+    seed : int, optional
+        Random seed, by default 0
+    """
+
+    chemicals: int = 300
+    samples: int = 150
+    extracts: int = 50
+    endpoints: int = 20
+    curve_points: int = 15
+    dose_points: int = 8
+    chemicals_per_sample: int = 25
+    phases: int = 3
+    fses_files: int = 2
+    scale: int = 1
+    seed: int = 0
+
+
+def _cas_numbers(n: int) -> list[str]:
+    return [f"{100000 + i}-{10 + i % 90}-{i % 10}" for i in range(n)]
+
+
+def _endpoints(n: int) -> list[str]:
+    return [f"EP{i:02d}" for i in range(n)]
+
+
+def _write_excel(path: str, sheets: list[pd.DataFrame]):
+    with pd.ExcelWriter(path) as writer:
+        for i, sheet in enumerate(sheets):
+            sheet.to_excel(writer, sheet_name=f"Sheet{i + 1}", index=False)
+
+
+def make_chemicals(n: int, rng: np.random.Generator) -> pd.DataFrame:
+    """Chemical IDs, CAS numbers, classes and CompTox-like metadata."""
+    ids = np.arange(FIRST_CHEMICAL_ID, FIRST_CHEMICAL_ID + n)
+    return pd.DataFrame(
+        {
+            "cas_number": _cas_numbers(n),
+            "Chemical_ID": ids,
+            "chemical_class": rng.choice(CHEMICAL_CLASSES, n),
+            "preferredName": [f"Chemical {i}" for i in ids],
+            "smiles": "C" * 6,
+            "dtxsid": [f"DTXSID{i:07d}" for i in ids],
+            "dtxcid": [f"DTXCID{i:07d}" for i in ids],
+            "averageMass": rng.uniform(100, 500, n).round(3),
+            "inchikey": [f"SYNTHETIC{i:012d}-N" for i in ids],
+            "molFormula": "C6H6",
+        }
+    )
+
+
+def make_masv_classes(chemicals: pd.DataFrame, rng: np.random.Generator):
+    """MASV class/source workbook table (1.0 = member, blank = not)."""
+    n = len(chemicals)
+    df = pd.DataFrame(
+        {
+            "ParameterName": chemicals["preferredName"],
+            "CASNumber": chemicals["cas_number"],
+        }
+    )
+    for col in MASV_SOURCE + MASV_CC:
+        df[col] = np.where(rng.random(n) < 0.15, 1.0, np.nan)
+    return df
+
+
+def make_endpoints(endpoints: list[str]) -> pd.DataFrame:
+    """Endpoint mapping table (sheet 4 of the SuperEndpoint workbook)."""
+    return pd.DataFrame(
+        {
+            "IncludeInPortal": "Yes",
+            "Abbreviation": endpoints,
+            "Simple name (<20char)": [f"Endpoint {e}" for e in endpoints],
+            "Description": [f"Synthetic endpoint {e}" for e in endpoints],
+            "Ontology Link": "",
+        }
+    )
+
+
+def make_samples(
+    config: SyntheticConfig, chemicals: pd.DataFrame, rng: np.random.Generator
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """FSES measurements and the Sample_ID <-> SampleNumber map."""
+    n = config.samples * config.scale
+    n_sub = min(n, config.extracts * config.scale * SAMPLES_PER_EXTRACT)
+    sample_numbers = [f"S{i:07d}" for i in range(n)]
+    sample_ids = pd.DataFrame(
+        {
+            "Sample_ID": [
+                (
+                    f"{FIRST_EXTRACT_ID + i // SAMPLES_PER_EXTRACT}"
+                    f"-{i % SAMPLES_PER_EXTRACT + 1}"
+                    if i < n_sub
+                    else str(FIRST_SAMPLE_ID + i)
+                )
+                for i in range(n)
+            ],
+            "SampleNumber": sample_numbers,
+        }
+    )
+
+    per_sample = min(config.chemicals_per_sample, len(chemicals))
+    rows = n * per_sample
+    sample_idx = np.repeat(np.arange(n), per_sample)
+    chem_idx = np.concatenate(
+        [rng.choice(len(chemicals), per_sample, replace=False) for _ in range(n)]
+    )
+    values = rng.lognormal(0, 2, rows).round(4).astype(str)
+    values[rng.random(rows) < 0.1] = "BLOD"
+
+    project = sample_idx % 10
+    fses = pd.DataFrame(
+        {
+            "ClientName": "Synthetic",
+            "SampleNumber": np.asarray(sample_numbers)[sample_idx],
+            "date_sampled": "2024-01-01",
+            "sample_matrix": np.asarray(MATRICES)[sample_idx % len(MATRICES)],
+            "technology": "GC-MS",
+            "projectName": [f"Project {p}" for p in project],
+            "SampleName": [f"Sample {i % (n // 2 + 1)}" for i in sample_idx],
+            "LocationLat": (44 + sample_idx % 100 / 100).round(4),
+            "projectLink": "https://example.org/project",
+            "LocationLon": (-123 - sample_idx % 100 / 100).round(4),
+            "LocationName": [f"Location {i % 50}" for i in sample_idx],
+            "LocationAlternateDescription": "",
+            "AlternateName": "",
+            "cas_number": chemicals["cas_number"].to_numpy()[chem_idx],
+            "date_sample_start": "2023-12-25",
+            "measurement_value": values,
+            "measurement_value_qualifier": "",
+            "measurement_value_unit": "ng/g",
+            "measurement_value_molar": values,
+            "measurement_value_molar_unit": "pmol/g",
+            "environmental_concentration": values,
+            "environmental_concentration_qualifier": "",
+            "environmental_concentration_unit": "ng/g",
+            "environmental_concentration_molar": values,
+            "environmental_concentration_molar_unit": "pmol/g",
+        }
+    )
+    return fses[REQUIRED_SAMPLE_COLUMNS], sample_ids
+
+
+def make_curves(
+    ids: np.ndarray,
+    endpoints: list[str],
+    config: SyntheticConfig,
+    rng: np.random.Generator,
+) -> dict[str, pd.DataFrame]:
+    """Legacy BMD, dose-response and fit tables for the given IDs."""
+    n_ep = len(endpoints)
+    chem = np.repeat(ids, n_ep)
+    ep = np.tile(endpoints, len(ids))
+    n = len(chem)
+
+    modeled = rng.random(n) < 0.6
+    bmd10 = rng.uniform(0.1, 50, n).round(4)
+    qc = rng.choice([0, 1, 2, 3, 4, 5], n)
+    bmd = pd.DataFrame(
+        {
+            "Chemical_ID": chem,
+            "End_Point": ep,
+            "Model": np.where(modeled, rng.choice(MODELS, n), "NULL"),
+            "BMD10": np.where(modeled, bmd10, np.nan),
+            "BMD50": np.where(modeled, bmd10 * 3, np.nan),
+            "Min_Dose": 0.0,
+            "Max_Dose": 100.0,
+            "AUC_Norm": rng.random(n).round(6),
+            "DataQC_Flag": qc,
+            "BMD_Analysis_Flag": np.where(
+                modeled, rng.choice([0, 1, 2], n).astype(str), "NULL"
+            ),
+            "BMD10_Flag": np.where(modeled, "1", "NULL"),
+            "BMD50_Flag": np.where(modeled, "1", "NULL"),
+        }
+    )
+
+    doses = np.geomspace(0.1, 100, config.dose_points)
+    k = config.dose_points
+    response = rng.random(n * k).round(6)
+    dose = pd.DataFrame(
+        {
+            "Chemical_ID": np.repeat(chem, k),
+            "End_Point": np.repeat(ep, k),
+            "Dose": np.tile(doses, n).round(4),
+            "Response": response,
+            "CI_Lo": (response * 0.8).round(6),
+            "CI_Hi": np.minimum(response * 1.2, 1).round(6),
+        }
+    )
+
+    k = config.curve_points
+    x = np.tile(np.linspace(0, 100, k), n)
+    fit = pd.DataFrame(
+        {
+            "Chemical_ID": np.repeat(chem, k),
+            "End_Point": np.repeat(ep, k),
+            "X_vals": x.round(4),
+            "Y_vals": (1 / (1 + np.exp(-(x - 50) / 10))).round(6),
+        }
+    )
+    fit.loc[~np.repeat(modeled, k), ["X_vals", "Y_vals"]] = np.nan
+    return {"bmd": bmd, "dose": dose, "fit": fit}
+
+
+def generate_dataset(data_dir: str, config: SyntheticConfig) -> str:
+    """Write a synthetic dataset and its srp_build_files.csv.
+
+    Parameters
+    ----------
+    data_dir : str
+        Directory to write files to (created if missing)
+    config : SyntheticConfig
+        Dataset size
+
+    Returns
+    -------
+    str
+        /path/to/srp_build_files.csv
+    """
+    rng = np.random.default_rng(config.seed)
+    data_dir = os.path.abspath(data_dir)
+    os.makedirs(data_dir, exist_ok=True)
+    rows = list()
+
+    def add(name, data_type, sample_type, fname):
+        location = os.path.join(data_dir, fname)
+        rows.append(
+            {
+                "name": name,
+                "data_type": data_type,
+                "sample_type": sample_type,
+                "location": location,
+                "version": 1,
+            }
+        )
+        return location
+
+    # Chemicals
+    chemicals = make_chemicals(config.chemicals * config.scale, rng)
+    chemicals[["cas_number", "Chemical_ID", "chemical_class"]].assign(
+        **{"zf.cid": np.nan}
+    )[["cas_number", "zf.cid", "Chemical_ID", "chemical_class"]].to_csv(
+        add("chemId", "mapping", "chemical", "chemicalIdMapping.csv"), index=False
+    )
+    chemicals.to_csv(os.path.join(data_dir, "chem_metadata.tsv"), sep="\t", index=False)
+    _write_excel(
+        add("class1", "classification", "chemical", "masvClasses.xlsx"),
+        [make_masv_classes(chemicals, rng)],
+    )
+    _write_excel(
+        add("chemdesc", "classification", "chemical", "chemicalDescriptions.xlsx"),
+        [chemicals[["cas_number", "preferredName"]]],
+    )
+
+    # Endpoints
+    endpoints = _endpoints(config.endpoints)
+    _write_excel(
+        add("endpointMap", "mapping", "endpoint", "endpointMapping.xlsx"),
+        [pd.DataFrame()] * 3 + [make_endpoints(endpoints)],
+    )
+
+    # Samples
+    fses, sample_ids = make_samples(config, chemicals, rng)
+    sample_ids.to_csv(
+        add("sampId", "mapping", "sample", "sampleIdMapping.csv"), index=False
+    )
+    remap = sample_ids.sample(frac=0.2, random_state=config.seed).assign(
+        ProjectName="Remapped project",
+        NewSampleName=lambda df: "Remapped " + df["SampleNumber"],
+        NewLocationName="Remapped location",
+    )
+    _write_excel(add("sampMap", "mapping", "sample", "sampleMapping.xlsx"), [remap])
+    for i, part in enumerate(
+        np.array_split(np.arange(len(fses)), max(1, config.fses_files))
+    ):
+        fses.iloc[part].to_csv(
+            add(f"samp{i + 1}", "sample", "water", f"fses_{i + 1}.csv"), index=False
+        )
+
+    # Legacy BMD, dose and fit tables; each phase covers an
+    # overlapping window of chemicals (or extract samples)
+    extract_ids = (
+        sample_ids["Sample_ID"]
+        .str.extract(r"^(\d+)-", expand=False)
+        .dropna()
+        .astype(int)
+        .unique()
+    )
+    for sample_type, ids in [
+        ("chemical", chemicals["Chemical_ID"].to_numpy()),
+        ("extract", extract_ids),
+    ]:
+        window = int(np.ceil(len(ids) / config.phases * 1.5))
+        step = max(1, len(ids) // config.phases)
+        for phase in range(config.phases):
+            phase_ids = ids[phase * step : phase * step + window]
+            tables = make_curves(phase_ids, endpoints, config, rng)
+            for dt, table in tables.items():
+                fname = f"{sample_type}_{dt}_vals_phase{phase + 1}.csv"
+                table.to_csv(
+                    add(f"{dt}_{sample_type}{phase + 1}", dt, sample_type, fname),
+                    index=False,
+                )
+
+    # Files main() expects to be listed, but that --samps does not read
+    pd.DataFrame(columns=["gene"]).to_csv(
+        add("geneInfo", "mapping", "zebrafish", "geneInfo.csv"), index=False
+    )
+
+    manifest = os.path.join(data_dir, "srp_build_files.csv")
+    pd.DataFrame(rows).to_csv(manifest, index=False)
+    return manifest
+
+
+# =========================================================
+# Command Line Interface (CLI)
+# =========================================================
+def main():
+    defaults = SyntheticConfig()
+    parser = ArgumentParser("Generate synthetic build_script.py inputs")
+    parser.add_argument("data_dir", help="Directory to write the dataset to")
+    for field, value in asdict(defaults).items():
+        parser.add_argument(
+            f"--{field}",
+            dest=field,
+            type=int,
+            default=value,
+            help=f"(default: {value})",
+        )
+    args = parser.parse_args()
+
+    config = SyntheticConfig(
+        **{field: getattr(args, field) for field in asdict(defaults)}
+    )
+    print(generate_dataset(args.data_dir, config))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,233 @@
+"""run_benchmark: Time build_script.py on synthetic data at several scales
+
+For each scale, a synthetic dataset is generated (see
+`generate_data.py`) and `build_script.py` is run on it in a
+subprocess. Wall time and peak memory of the whole build come from
+the operating system; per-stage numbers come from the build's
+telemetry_build.json (see `src.telemetry`).
+
+Examples
+--------
+python benchmarks/run_benchmark.py --scales 1,10 --work_dir /tmp/srp_bench
+python benchmarks/run_benchmark.py -- --samps --stream
+"""
+
+# =========================================================
+# Imports
+# =========================================================
+import json
+import os
+import shutil
+import subprocess
+import sys
+import time
+from argparse import REMAINDER, ArgumentParser
+from dataclasses import asdict, replace
+from typing import Any
+
+import pandas as pd
+
+from generate_data import SyntheticConfig, generate_dataset
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Build stages to run if none are given
+DEFAULT_BUILD_ARGS = ["--samps"]
+
+# Telemetry fields reported per stage
+STAGE_FIELDS = [
+    "wall_s",
+    "cpu_s",
+    "children_cpu_s",
+    "peak_rss_bytes",
+    "read_bytes",
+    "write_bytes",
+    "rows_in",
+    "rows_out",
+]
+
+
+# =========================================================
+# Functions
+# =========================================================
+def _run(cmd: list[str], cwd: str, log_file: str) -> tuple[int, float, int]:
+    """Run a command; return its exit code, wall time and peak RSS."""
+    with open(log_file, "w") as log:
+        start = time.perf_counter()
+        proc = subprocess.Popen(cmd, cwd=cwd, stdout=log, stderr=log)
+        if hasattr(os, "wait4"):
+            _, status, usage = os.wait4(proc.pid, 0)
+            proc.returncode = os.waitstatus_to_exitcode(status)
+            # ru_maxrss is in kilobytes on Linux and bytes on macOS
+            peak_rss = usage.ru_maxrss * (1 if sys.platform == "darwin" else 1024)
+        else:
+            proc.wait()
+            peak_rss = 0
+        wall = time.perf_counter() - start
+    return proc.returncode, wall, peak_rss
+
+
+def run_scale(
+    scale: int,
+    work_dir: str,
+    build_args: list[str],
+    config: SyntheticConfig,
+) -> list[dict[str, Any]]:
+    """Generate data at `scale` and run build_script.py on it.
+
+    Parameters
+    ----------
+    scale : int
+        Dataset scale (see `SyntheticConfig`)
+    work_dir : str
+        Directory to hold data and outputs of every scale
+    build_args : list[str]
+        Arguments for build_script.py (e.g. ["--samps"])
+    config : SyntheticConfig
+        Dataset size at scale 1
+
+    Returns
+    -------
+    list[dict[str, Any]]
+        One row for the whole build, then one per telemetry stage
+    """
+    scale_dir = os.path.join(work_dir, f"scale_{scale}")
+    data_dir = os.path.join(scale_dir, "data")
+    output_dir = os.path.join(scale_dir, "output")
+    log_file = os.path.join(scale_dir, "build.log")
+    shutil.rmtree(output_dir, ignore_errors=True)
+    os.makedirs(output_dir)
+
+    print(f"[{scale}x] Generating data...")
+    start = time.perf_counter()
+    manifest = generate_dataset(data_dir, replace(config, scale=scale))
+    generate_s = time.perf_counter() - start
+
+    # Use the generated metadata instead of querying CompTox
+    shutil.copy(os.path.join(data_dir, "chem_metadata.tsv"), output_dir)
+
+    cmd = [
+        sys.executable,
+        os.path.join(REPO_DIR, "build_script.py"),
+        *build_args,
+        "--build_files",
+        manifest,
+        "--output_dir",
+        output_dir,
+        "--no_cache",
+    ]
+    print(f"[{scale}x] Running {' '.join(cmd[1:])}")
+    # Run from the scale's directory; some steps write to the working directory
+    returncode, wall, peak_rss = _run(cmd, scale_dir, log_file)
+    status = "ok" if returncode == 0 else "error"
+    print(f"[{scale}x] {status} in {wall:.1f}s (log: {log_file})")
+
+    rows = [
+        {
+            "scale": scale,
+            "stage": "build",
+            "parent": None,
+            "status": status,
+            "generate_s": round(generate_s, 3),
+            "wall_s": wall,
+            "peak_rss_bytes": peak_rss,
+        }
+    ]
+    telemetry_file = os.path.join(output_dir, "telemetry_build.json")
+    if os.path.exists(telemetry_file):
+        with open(telemetry_file) as f:
+            telemetry = json.load(f)
+        for rec in telemetry["stages"]:
+            rows.append(
+                {
+                    "scale": scale,
+                    "stage": rec["name"],
+                    "parent": rec["parent"],
+                    "status": rec["status"],
+                    **{k: rec[k] for k in STAGE_FIELDS},
+                }
+            )
+    return rows
+
+
+def summarize(results: pd.DataFrame) -> pd.DataFrame:
+    """Format benchmark results for display (seconds and MiB)."""
+    table = results[["scale", "stage", "status", "wall_s", "cpu_s"]].copy()
+    table["peak_rss_mib"] = results["peak_rss_bytes"] / 2**20
+    table["rows_out"] = results["rows_out"]
+    return table.round(2)
+
+
+# =========================================================
+# Command Line Interface (CLI)
+# =========================================================
+def main():
+    parser = ArgumentParser(
+        "Benchmark build_script.py on synthetic data; arguments after "
+        "'--' are passed to build_script.py (default: --samps)"
+    )
+    parser.add_argument(
+        "--scales",
+        dest="scales",
+        default="1,10,100",
+        help="Comma-separated dataset scales (default: 1,10,100)",
+    )
+    parser.add_argument(
+        "--work_dir",
+        dest="work_dir",
+        default="/tmp/srp_benchmark",
+        help="Directory for generated data and outputs (default: /tmp/srp_benchmark)",
+    )
+    parser.add_argument(
+        "--results",
+        dest="results",
+        default=None,
+        help="Path prefix of result files (default: {work_dir}/benchmark_results)",
+    )
+    for field, value in asdict(SyntheticConfig()).items():
+        if field != "scale":
+            parser.add_argument(
+                f"--{field}",
+                dest=field,
+                type=int,
+                default=value,
+                help=f"Dataset size at scale 1 (default: {value})",
+            )
+    parser.add_argument("build_args", nargs=REMAINDER)
+    args = parser.parse_args()
+
+    build_args = [a for a in args.build_args if a != "--"] or DEFAULT_BUILD_ARGS
+    config = SyntheticConfig(
+        **{f: getattr(args, f) for f in asdict(SyntheticConfig()) if f != "scale"}
+    )
+    os.makedirs(args.work_dir, exist_ok=True)
+
+    rows = list()
+    for scale in [int(s) for s in args.scales.split(",")]:
+        rows += run_scale(scale, args.work_dir, build_args, config)
+    results = pd.DataFrame(rows).reindex(
+        columns=["scale", "stage", "parent", "status", "generate_s"] + STAGE_FIELDS
+    )
+
+    prefix = args.results or os.path.join(args.work_dir, "benchmark_results")
+    results.to_csv(f"{prefix}.csv", index=False)
+    with open(f"{prefix}.json", "w") as f:
+        json.dump(
+            {
+                "build_args": build_args,
+                "config": asdict(config),
+                "results": results.astype(object)
+                .where(results.notna(), None)
+                .to_dict(orient="records"),
+            },
+            f,
+            indent=2,
+            default=str,
+        )
+
+    print(summarize(results).to_string(index=False))
+    print(f"Results saved to {prefix}.csv and {prefix}.json")
+
+
+if __name__ == "__main__":
+    main()
@@ -5,39 +5,201 @@ Build script moved to python for better extendability and interoperability.
 
 import argparse
 import os
-from typing import Optional
+import shutil
+import tempfile
+from glob import glob
+from typing import Optional, Union
 
 import pandas as pd
+from src.cache import StageCache
+from src.incremental import BuildState, manifest_signatures
 from src.mapping import get_mapping_file, load_mapping_reference
+from src.params import (
+    BMD_COLUMN_DTYPES,
+    OPTIONAL_BMD_COLUMNS,
+    REQUIRED_SAMPLE_COLUMNS,
+)
+from src.schema import ValidationReport, validate_files
+from src.stages import Stage, run_stages
+from src.tableio import (
+    OUTPUT_FORMATS,
+    output_path,
+    read_csv_files,
+    read_table,
+    write_unique_csv,
+)
+from src.telemetry import stage, write_telemetry
 from tqdm import tqdm
 
 # DEFINE OUTPUT DIRECTORY
 OUTPUT_DIR = "/tmp"  # "/tmp"
 
+# Source files whose edits invalidate cached stage outputs
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+CORE_CODE = [os.path.join(APP_DIR, "build_script.py")] + sorted(
+    glob(os.path.join(APP_DIR, "src", "*.py"))
+)
 
-# TODO: Write this function
-def fitCurveFiles(morpho_behavior_tuples):
+
+def fitOutputs(
+    morpho_behavior_tuples: list, output_dir: str = OUTPUT_DIR
+) -> pd.DataFrame:
+    """List the BMD, fit and dose files written by `fitCurveFiles`.
+
+    Parameters
+    ----------
+    morpho_behavior_tuples : list
+        List of (name, morphology file, behavior file or None) tuples
+    output_dir : str, optional
+        Directory where outputs are saved, by default OUTPUT_DIR (='/tmp')
+
+    Returns
+    -------
+    pd.DataFrame
+        Table formatted like srp_build_files.csv (name, data_type,
+        sample_type, location) listing the new files
     """
-    get new curve fits, list of tuples of morpho/behavior pairs
+    rows = [
+        {
+            "name": f"{name}_{dt}",
+            "data_type": dt,
+            "sample_type": "chemical",
+            "location": os.path.join(output_dir, "bmd", f"{name}_{dt}.csv"),
+        }
+        for name, _, _ in morpho_behavior_tuples
+        for dt in ["bmd", "fit", "dose"]
+    ]
+    return pd.DataFrame(rows, columns=["name", "data_type", "sample_type", "location"])
+
+
+def incrementalState(
+    df: pd.DataFrame, morpho_behavior_tuples: list, output_dir: str = OUTPUT_DIR
+) -> BuildState:
+    """Load the state of previous incremental builds.
+
+    Files are tracked by their srp_build_files.csv rows; the BMD, fit
+    and dose files written by `fitCurveFiles` are tracked by the rows
+    of the morphology and behavior files they were fit from.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Mapping file reference table (srp_build_files.csv)
+    morpho_behavior_tuples : list
+        List of (name, morphology file, behavior file or None) tuples
+    output_dir : str, optional
+        Directory where outputs are saved, by default OUTPUT_DIR (='/tmp')
+
+    Returns
+    -------
+    BuildState
+        Incremental build state
     """
+    signatures = manifest_signatures(df)
+    for t in morpho_behavior_tuples:
+        fit_signature = ",".join(signatures.get(loc, "") for loc in t[1:] if loc)
+        for loc in fitOutputs([t], output_dir).location:
+            signatures[loc] = fit_signature
+    return BuildState(output_dir, signatures)
+
 
+def fitCurveFiles(
+    morpho_behavior_tuples: list,
+    output_dir: str = OUTPUT_DIR,
+    max_workers: Optional[int] = None,
+    bootstrap: Optional[int] = None,
+) -> pd.DataFrame:
+    """Get new curve fits for morphology/behavior pairs.
+
+    Each morphology and behavior file is fit with the zfBmd pipeline
+    in its own process; results of each pair are then written as
+    BMD, fit and dose files that `combineFiles` can read.
+
+    Parameters
+    ----------
+    morpho_behavior_tuples : list
+        List of (name, morphology file, behavior file or None) tuples
+    output_dir : str, optional
+        Directory to save output, by default OUTPUT_DIR (='/tmp')
+    max_workers : Optional[int], optional
+        Number of processes, by default None (one per available core)
+    bootstrap : Optional[int], optional
+        If given, BMDL10/BMDU10 are estimated from this many bootstrap
+        resamples per curve, by default None (left NA)
+
+    Returns
+    -------
+    pd.DataFrame
+        Table of new files (see `fitOutputs`)
+    """
+    from concurrent.futures import ProcessPoolExecutor
 
-def combineFiles(location_list: pd.DataFrame, ftype: str) -> pd.DataFrame:
+    # Imported here so that containers without zfBmd can still import this script
+    from zfBmd.support_functions import fit_curve_files
+
+    jobs = [
+        (name, [loc], dt)
+        for name, morph, beh in morpho_behavior_tuples
+        for loc, dt in [(morph, "morphology"), (beh, "behavior")]
+        if loc is not None
+    ]
+    if max_workers is None:
+        # CPUs this process may use (sched_getaffinity is Linux-only)
+        if hasattr(os, "sched_getaffinity"):
+            max_workers = len(os.sched_getaffinity(0))
+        else:
+            max_workers = os.cpu_count() or 1
+    max_workers = max(1, min(max_workers, len(jobs)))
+
+    results = {name: list() for name, _, _ in morpho_behavior_tuples}
+    with ProcessPoolExecutor(max_workers=max_workers) as pool:
+        futures = {
+            pool.submit(fit_curve_files, paths, dt, bootstrap=bootstrap): (name, dt)
+            for name, paths, dt in jobs
+        }
+        for future, (name, dt) in futures.items():
+            results[name].append(future.result())
+            tqdm.write(f"Fit {dt} curves for {name}")
+
+    outputs = fitOutputs(morpho_behavior_tuples, output_dir)
+    os.makedirs(os.path.join(output_dir, "bmd"), exist_ok=True)
+    for row in outputs.itertuples():
+        name = row.name.rsplit("_", 1)[0]
+        tables = [res[row.data_type] for res in results[name]]
+        pd.concat(tables).to_csv(row.location, index=False)
+    return outputs
+
+
+def combineFiles(
+    location_list: pd.DataFrame,
+    ftype: str,
+    state: Optional[BuildState] = None,
+    stream_to: Optional[str] = None,
+) -> Union[pd.DataFrame, str]:
     """Combine files and account for duplicates and desired schema.
 
     Parameters
     ----------
     location_list : pd.DataFrame
-        _description_
+        Mapping file reference rows whose `location` column
+        lists the files to combine
     ftype : str
         File type, one of ["bmd", "fit", "dose"]
+    state : Optional[BuildState], optional
+        If given, only files that are new or changed since the
+        previous build are read, by default None
+    stream_to : Optional[str], optional
+        If given, files are streamed in chunks into this CSV file
+        (see `src.tableio.write_unique_csv`) so that memory is bound
+        by the number of unique rows; `state` is then ignored,
+            by default None
 
     Returns
     -------
-    pd.DataFrame
+    Union[pd.DataFrame, str]
         Table of concatenated files with duplicates removed
+        (or `stream_to`, when streaming)
     """
-    dflist = []
     required_cols = {
         "bmd": [
             "Chemical_ID",
@@ -50,36 +212,95 @@ def combineFiles(location_list: pd.DataFrame, ftype: str) -> pd.DataFrame:
             "AUC_Norm",
             "DataQC_Flag",
             "BMD_Analysis_Flag",
+            "BMDL10",
+            "BMDU10",
         ],  # ,"BMD10_Flag","BMD50_Flag{"),
         "dose": ["Chemical_ID", "End_Point", "Dose", "Response", "CI_Lo", "CI_Hi"],
         "fit": ["Chemical_ID", "End_Point", "X_vals", "Y_vals"],
     }
 
     tqdm.write(f"Concatenating {ftype}...")
-    for loc in location_list.location:
-        f = pd.read_csv(loc)[required_cols[ftype]]
-        dflist.append(f)
 
     # Check for empty list
-    if not dflist:
+    if location_list.empty:
         tqdm.write("Warning: No valid files found for concatenation")
         return pd.DataFrame(columns=required_cols[ftype])
 
-    df = pd.concat(dflist).drop_duplicates()
+    if stream_to is not None:
+        with stage(f"combine:{ftype}", streaming=True) as rec:
+            rows_in, rows_out = write_unique_csv(
+                location_list.location,
+                stream_to,
+                usecols=required_cols[ftype],
+                dtype=BMD_COLUMN_DTYPES,
+                optional=OPTIONAL_BMD_COLUMNS,
+            )
+            rec.add_rows_in(rows_in)
+            rec.add_rows_out(rows_out)
+        return stream_to
+
+    with stage(f"combine:{ftype}") as rec:
+        df = read_csv_files(
+            location_list.location,
+            usecols=required_cols[ftype],
+            dtype=BMD_COLUMN_DTYPES,
+            optional=OPTIONAL_BMD_COLUMNS,
+            state=state,
+        )
+        rec.add_rows_in(df)
+        df = df.drop_duplicates()
+        rec.add_rows_out(df)
     return df
 
 
+def loadSampMapInputs(
+    sid: str = "",
+    smap: str = "",
+    cid: str = "",
+    emap: str = "",
+    cclass: str = "",
+    fses: Union[str, pd.DataFrame] = "",
+    descfile: str = "",
+    output_dir: str = OUTPUT_DIR,
+):
+    """Load the inputs shared by every sample-to-chemical mapping run.
+
+    Takes the same file arguments as `runSampMap`; loading them once
+    lets the sample, chemical and core mapping runs share the parsed
+    chemical metadata, sample data and endpoint details. `fses` may
+    also be the already-read FSES sample table.
+
+    Returns
+    -------
+    sampleChemMapping.map_samples_to_chemicals.MappingInputs
+        Parsed mapping inputs
+    """
+    from sampleChemMapping.map_samples_to_chemicals import load_mapping_inputs
+
+    return load_mapping_inputs(
+        cclass,
+        fses if isinstance(fses, pd.DataFrame) else fses.split(","),
+        sid,
+        emap,
+        sample_map=smap,
+        output_dir=output_dir,
+    )
+
+
 def runSampMap(
     is_sample: bool = False,
-    drcfiles: list = [],
+    drcfiles: Union[list, dict] = [],
     sid: str = "",
     smap: str = "",
     cid: str = "",
     emap: str = "",
     cclass: str = "",
-    fses: str = "",
+    fses: Union[str, pd.DataFrame] = "",
     descfile: str = "",
     output_dir: str = OUTPUT_DIR,
+    inputs=None,
+    output_format: str = "csv",
+    partition: bool = False,
 ) -> list[str]:
     """Run sample-to-chemical mapping.
 
@@ -88,8 +309,9 @@ def runSampMap(
     is_sample : bool, optional
         If True, runs sample mapping mode; else, runs
         chemical mapping mode, by default False
-    drcfiles : list, optional
-        List of dose-response curve files to process, by default []
+    drcfiles : Union[list, dict], optional
+        List of dose-response curve files to process, or combined
+        tables keyed by type ("bmd", "fit", "dose"), by default []
     sid : str, optional
         Sample ID, by default ""
     smap : str, optional
@@ -100,12 +322,21 @@ def runSampMap(
         /path/to/endpoint_mapping_file, by default ""
     cclass : str, optional
         /path/to/chemical_class_file, by default ""
-    fses : str, optional
-        /path/to/sample_files, by default ""
+    fses : Union[str, pd.DataFrame], optional
+        Comma-separated /path/to/sample_files (or the already-read
+        FSES sample table), by default ""
     descfile : str, optional
         /path/to/chemical_description_file, by default ""
     output_dir : str, optional
         Directory to save output, by default OUTPUT_DIR (='/tmp')
+    inputs : Optional[MappingInputs], optional
+        Pre-loaded mapping inputs (see `loadSampMapInputs`); if None,
+        inputs are loaded from the files above, by default None
+    output_format : str, optional
+        One of ["csv", "parquet", "feather"], by default "csv"
+    partition : bool, optional
+        If True, large Parquet tables are partitioned by Chemical_ID,
+            by default False
 
     Returns
     -------
@@ -120,62 +351,67 @@ def runSampMap(
             - zebrafish{Samp,Chem}DoseResponse.csv
             - zebrafish{Samp,Chem}BMDs.csv)
     """
-    import subprocess
-
-    drc = ",".join(drcfiles)
-    args = (
-        f"--sample_id={sid} "
-        f"--sample_map={smap} "
-        f"--chem_id={cid} "
-        f"--ep_map={emap} "
-        f"--chem_class={cclass} "
-        f"--sample_files={fses} "
-        f"--chem_desc={descfile} "
-        f"--output_dir={output_dir} "
+    # Imported here so that containers without sampleChemMapping
+    # (e.g. exposome) can still import this script
+    from sampleChemMapping.map_samples_to_chemicals import (
+        map_dose_response,
+        write_core_tables,
     )
-    if is_sample:
-        cmd = f"python sampleChemMapping/map_samples_to_chemicals.py --sample --drc_files={drc} {args}"
-    elif len(drcfiles) > 0:
-        cmd = f"python sampleChemMapping/map_samples_to_chemicals.py --chemical --drc_files={drc} {args}"
-    else:
-        cmd = f"python sampleChemMapping/map_samples_to_chemicals.py {args}"
 
-    try:
-        process = subprocess.run(cmd, capture_output=True, text=True, shell=True)
-
-        # Verify successful command execution
-        if process.returncode != 0:
-            raise subprocess.CalledProcessError(
-                returncode=process.returncode,
-                cmd=cmd,
-                output=process.stdout,
-                stderr=process.stderr,
-            )
+    if inputs is None:
+        inputs = loadSampMapInputs(
+            sid=sid,
+            smap=smap,
+            cid=cid,
+            emap=emap,
+            cclass=cclass,
+            fses=fses,
+            descfile=descfile,
+            output_dir=output_dir,
+        )
 
-        # Show command line logging messages
-        for line in process.stdout.splitlines():
-            if line.strip():
-                tqdm.write(line)
-    except Exception as e:
-        tqdm.write(f"An error occurred while trying to run the command: {str(e)}")
-        raise e
+    output_args = {
+        "output_dir": output_dir,
+        "output_format": output_format,
+        "partition": partition,
+    }
+    if len(drcfiles) > 0 or is_sample:
+        map_dose_response(inputs, drcfiles, is_sample=is_sample, **output_args)
+    else:
+        write_core_tables(inputs, **output_args)
 
     ##now we validate the files that came out.
-    dblist = [
-        os.path.join(output_dir, "samples.csv"),
-        os.path.join(output_dir, "chemicals.csv"),
-        os.path.join(output_dir, "samplesToChemicals.csv"),
-    ]
-    for ftype in ["XYCoords.csv", "DoseResponse.csv", "BMDs.csv"]:
-        dblist.append(os.path.join(output_dir, f"zebrafishChem{ftype}"))
-        dblist.append(os.path.join(output_dir, f"zebrafishSamp{ftype}"))
-    return dblist
-    # runSchemaCheck(dblist)
+    return sampMapOutputs(output_dir, output_format)
+
+
+def sampMapOutputs(
+    output_dir: str = OUTPUT_DIR, output_format: str = "csv"
+) -> list[str]:
+    """List the files written by the sample-to-chemical mapping.
+
+    Parameters
+    ----------
+    output_dir : str, optional
+        Directory where outputs are saved, by default OUTPUT_DIR (='/tmp')
+    output_format : str, optional
+        One of ["csv", "parquet", "feather"], by default "csv"
+
+    Returns
+    -------
+    list[str]
+        Paths to samples, chemicals, samplesToChemicals and
+        zebrafish{Samp,Chem}{XYCoords,DoseResponse,BMDs} tables
+    """
+    names = ["samples", "chemicals", "samplesToChemicals"]
+    for ftype in ["XYCoords", "DoseResponse", "BMDs"]:
+        names.extend([f"zebrafishChem{ftype}", f"zebrafishSamp{ftype}"])
+    return [output_path(output_dir, name, output_format) for name in names]
 
 
 def runExposome(
     chem_id_file: str,
     output_dir: str = OUTPUT_DIR,
+    output_format: str = "csv",
 ) -> list[str]:
     """Pull exposome data.
 
@@ -184,16 +420,18 @@ def runExposome(
     chem_id_file : str
         Path to file containing chemical IDs for which to pull
         exposome data
+    output_format : str, optional
+        One of ["csv", "parquet", "feather"], by default "csv"
 
     Returns
     -------
     list[str]
-        List containing path to output exposomeGeneStats.csv file
+        List containing path to output exposomeGeneStats table
     """
-    cmd = f"python exposome/exposome_summary_stats.py {chem_id_file}"
+    cmd = f"python exposome/exposome_summary_stats.py {chem_id_file} {output_format}"
     tqdm.write(cmd)
     os.system(cmd)
-    return [os.path.join(output_dir, "exposomeGeneStats.csv")]
+    return [output_path(output_dir, "exposomeGeneStats", output_format)]
 
 
 def runExpression(
@@ -234,20 +472,208 @@ def runExpression(
     ]
 
 
-def runSchemaCheck(dbfiles: list[Optional[str]] = []):
-    """Validate database files against schema using LinkML.
+def runSchemaCheck(dbfiles: list[Optional[str]] = []) -> list[ValidationReport]:
+    """Validate database files against schema (srpAnalytics.yaml).
+
+    Each file is validated against the schema class named after
+    it (e.g. samples.csv -> samples); files are checked in parallel.
 
     Parameters
     ----------
     dbfiles : list[Optional[str]], optional
         List of database files, by default []
+
+    Returns
+    -------
+    list[ValidationReport]
+        One validation report per file
+    """
+    with stage("validate") as rec:
+        reports = validate_files([f for f in dbfiles if f])
+        rec.add_rows_in(sum(report.rows for report in reports))
+    for report in reports:
+        tqdm.write(report.summary())
+    return reports
+
+
+# =========================================================
+# Workflow stages (see src/stages.py)
+# =========================================================
+def runBmdStage(
+    morpho_behavior_tuples: list,
+    output_dir: str = OUTPUT_DIR,
+    max_workers: Optional[int] = None,
+    state: Optional[BuildState] = None,
+    bootstrap: Optional[int] = None,
+) -> list[str]:
+    """Stage: re-run benchmark dose collection."""
+    tqdm.write("Re-running benchmark dose collection...")
+    outputs = fitCurveFiles(morpho_behavior_tuples, output_dir, max_workers, bootstrap)
+    if state is not None:
+        for loc in outputs.location:
+            state.record(loc, "fit")
+    return list(outputs.location)
+
+
+def runSampsStage(
+    df: pd.DataFrame,
+    sampmap_args: dict,
+    state: Optional[BuildState] = None,
+    output_format: str = "csv",
+    partition: bool = False,
+    stream: bool = False,
+) -> list[str]:
+    """Stage: combine BMD/fit/dose files and run sample-chemical mapping.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Mapping file reference table (srp_build_files.csv)
+    sampmap_args : dict
+        Fixed keyword arguments for `runSampMap`
+    state : Optional[BuildState], optional
+        If given, only BMD/fit/dose and FSES files that are new or
+        changed since the previous build are read; all outputs are
+        then rebuilt from the saved and new tables, by default None
+    output_format : str, optional
+        One of ["csv", "parquet", "feather"], by default "csv"
+    partition : bool, optional
+        If True, large Parquet tables are partitioned by Chemical_ID,
+            by default False
+    stream : bool, optional
+        If True, BMD/fit/dose files are combined in chunks into
+        temporary files in `output_dir` instead of in memory (see
+        `combineFiles`), by default False
+
+    Returns
+    -------
+    list[str]
+        Paths to all validated output files
+    """
+    output_dir = sampmap_args["output_dir"]
+
+    # add chemical BMDS, fits, curves to existing data; the combined
+    # tables are handed to the sample mapping in memory (or, when
+    # streaming, as temporary files)
+    drc_tables = {"chemical": dict(), "extract": dict()}
+    stream_dir = None
+    if stream:
+        stream_dir = tempfile.mkdtemp(prefix=".combined_", dir=output_dir)
+
+    try:
+        # Define files and set progress bar incrementes for concatenating each
+        sample_type = ["chemical", "extract"]
+        data_type = ["bmd", "fit", "dose"]
+        total_iterations = len(sample_type) * len(data_type)
+        progress_bar = tqdm(total=total_iterations, desc="Combining files")
+
+        for st in sample_type:
+            tqdm.write(f"Processing {st} samples...")
+
+            for dt in data_type:
+                drc_tables[st][dt] = combineFiles(
+                    df.loc[df.sample_type == st].loc[df.data_type == dt],
+                    dt,
+                    state,
+                    stream_to=(
+                        os.path.join(stream_dir, f"{st}_{dt}.csv") if stream else None
+                    ),
+                )
+                progress_bar.update(1)
+
+        # Update progress bar after completion
+        progress_bar.set_description("Combining files... Done!")
+        progress_bar.close()
+
+        # Iterate through sampMap params
+        all_res = list()
+        sampmap_params = [
+            {"is_sample": True, "drcfiles": drc_tables["extract"]},
+            {"is_sample": False, "drcfiles": drc_tables["chemical"]},
+            {"is_sample": False, "drcfiles": []},
+        ]
+        progress_bar = tqdm(
+            range(len(sampmap_params)),
+            desc="Running sample mapping",
+        )
+
+        # Perform sample mapping; inputs are parsed once and shared
+        if state is not None:
+            sampmap_args = {
+                **sampmap_args,
+                "fses": read_csv_files(
+                    sampmap_args["fses"].split(","),
+                    usecols=REQUIRED_SAMPLE_COLUMNS,
+                    ignore_index=True,
+                    state=state,
+                ),
+            }
+        inputs = loadSampMapInputs(**sampmap_args)
+        for smp in sampmap_params:
+            smpargs = {
+                **smp,
+                **sampmap_args,
+                "inputs": inputs,
+                "output_format": output_format,
+                "partition": partition,
+            }
+            res = runSampMap(**smpargs)
+            all_res.extend(res)
+            progress_bar.update(1)
+    finally:
+        if stream_dir is not None:
+            shutil.rmtree(stream_dir, ignore_errors=True)
+
+    # Update progress bar after completion
+    progress_bar.set_description("Running sample mapping... Done!")
+    progress_bar.close()
+
+    # Collect all unique files
+    all_res = list(dict.fromkeys(all_res))
+
+    # Validate schema
+    runSchemaCheck(all_res)
+    return all_res
+
+
+def runExpoStage(
+    cid: str, output_dir: str = OUTPUT_DIR, output_format: str = "csv"
+) -> list[str]:
+    """Stage: pull exposome data and validate it."""
+    res = runExposome(cid, output_dir=output_dir, output_format=output_format)
+    runSchemaCheck(res)
+    return res
+
+
+def runGeneExStage(
+    gex: str, ginfo: str, sampmap_args: dict, output_format: str = "csv"
+) -> list[str]:
+    """Stage: parse gene expression data and validate it.
+
+    If no chemicals table exists yet (i.e. the sample mapping stage
+    was not requested), the core sample mapping is run first. The R
+    parser reads CSV, so binary chemicals tables are handed to it as
+    a temporary CSV file.
     """
-    ##TODO: make this work with internal calls
-    for filename in dbfiles:
-        classname = os.path.basename(filename).split(".")[0]
-        cmd = f"linkml-validate --schema srpAnalytics.yaml {filename} --target-class {classname}"
-        tqdm.write(cmd)
-        os.system(cmd)
+    output_dir = sampmap_args["output_dir"]
+    chem_file = output_path(output_dir, "chemicals", output_format)
+    if not os.path.exists(chem_file):
+        runSampMap(
+            is_sample=False, drcfiles=[], output_format=output_format, **sampmap_args
+        )
+
+    if output_format != "csv":
+        csv_file = os.path.join(output_dir, "chemicals.tmp.csv")
+        read_table(chem_file).to_csv(csv_file, index=False, quotechar='"')
+        chem_file = csv_file
+
+    try:
+        res = runExpression(gex, chem_file, ginfo, output_dir=output_dir)
+    finally:
+        if output_format != "csv":
+            os.remove(chem_file)
+    runSchemaCheck(res)
+    return res
 
 
 def main():
@@ -269,7 +695,8 @@ def main():
        - Retrieves various mapping files (sample IDs, chemical IDs, endpoints, etc.)
 
     2. Benchmark Dose (BMD) Analysis:
-       - Calculates dose-response curves and benchmark doses for chemical exposures
+       - Calculates dose-response curves and benchmark doses for chemical exposures,
+         fitting each morphology/behavior file in its own process
        - Combines results across different sample types (chemical, extract) and data types (BMD, fit, dose)
 
     3. Sample-Chemical Mapping:
@@ -289,10 +716,22 @@ def main():
     `--samps` : Re-run sample-chemical mapping
     `--expo` : Re-run exposome sample collection
     `--geneEx` : Re-run gene expression generation
+    `--build_files` : Path or URL of srp_build_files.csv (e.g. for local data)
+    `--output_format` : Format of output tables (csv, parquet or feather)
+    `--partition` : Partition large Parquet tables by Chemical_ID
+    `--workers` : Maximum number of workflows to run at once
+    `--bmd_workers` : Number of processes for benchmark dose fitting
+    `--bootstrap` : Add bootstrap BMDL10/BMDU10 estimates to new fits
+    `--stream` : Combine BMD/fit/dose files in chunks with bounded memory
+    `--incremental` : Only fit and read files that are new or changed since
+        the previous build (see `src.incremental`)
+    `--no_cache` : Recompute stages even if their inputs are unchanged
+    `--prometheus` : Also write stage telemetry as a Prometheus textfile
 
     Outputs:
     --------
-    Various CSV files stored in OUTPUT_DIR, including:
+    Various tables stored in OUTPUT_DIR (as CSV, unless `--output_format`
+    is given; gene expression results are always CSV), including:
     - Core data
         - samples.csv
         - chemicals.csv
@@ -303,39 +742,24 @@ def main():
         - zebrafish{Chem,Samp}XYCoords.csv
     - exposomeGeneStats.csv (exposome analysis)
     - srpDEGPathways.csv, srpDEGStats.csv, allGeneEx.csv (gene expression results)
+    - telemetry_build.json (wall/CPU time, memory, I/O and rows of each stage)
 
     Notes:
     ------
+    - Each workflow is a stage (see `src.stages`); stages that do not
+      depend on each other (e.g. exposome and sample mapping) run in parallel
+    - Stage outputs are cached under {output_dir}/.stage_cache, keyed by
+      a hash of the stage's input files, parameters and code; a stage
+      whose key is unchanged restores its outputs instead of re-running
+      (restored outputs are validated again)
+    - With `--incremental`, tables read from srp_build_files.csv rows are
+      kept under {output_dir}/.incremental; later builds only fit and read
+      new or changed rows, then rebuild every output from the kept and new
+      tables with the same duplicate removal as a full build
     - Intermediate files are created during processing and removed after use
     - All outputs are validated against the LinkML schema definitions
     - Progress is tracked using tqdm progress bars and informative messages
     """
-    df = load_mapping_reference()
-
-    ####
-    # file parsing - collects all files we might need for the tool below
-    ####
-    ##first find the morphology and behavior pairs for chemical sources
-    chemdf = df.loc[df.sample_type == "chemical"]
-    morph = chemdf.loc[chemdf.data_type == "morphology"]
-    beh = chemdf.loc[chemdf.data_type == "behavior"]
-    tupes = []
-    for n in morph.name:
-        tupes.append(
-            [morph.loc[morph.name == n].location, beh.loc[beh.name == n].location]
-        )
-
-    ##now map sample information
-    sid = get_mapping_file(df, "sampId")
-    cid = get_mapping_file(df, "chemId")
-    cclass = get_mapping_file(df, "class1")
-    emap = get_mapping_file(df, "endpointMap")
-    fses = get_mapping_file(df, "sample", return_first=False)
-    descfile = get_mapping_file(df, "chemdesc")
-    smap = get_mapping_file(df, "sampMap")
-    gex1 = get_mapping_file(df, "expression", return_first=False)
-    ginfo = get_mapping_file(df, "geneInfo")
-
     ###now we can call individiual commands
     parser = argparse.ArgumentParser(
         "Pull files from github list of files and call appropriate command"
@@ -368,139 +792,286 @@ def main():
         default=False,
         help="Re run gene expression generation",
     )
+    parser.add_argument(
+        "--build_files",
+        dest="build_files",
+        default=None,
+        help="Path or URL of srp_build_files.csv (default: the copy on GitHub)",
+    )
     parser.add_argument(
         "--output_dir",
         dest="output_dir",
         default=OUTPUT_DIR,
         help="Directory to store output files (default: '/tmp')",
     )
+    parser.add_argument(
+        "--output_format",
+        dest="output_format",
+        choices=list(OUTPUT_FORMATS),
+        default="csv",
+        help="Format of output tables; parquet and feather files have typed, "
+        "compressed columns (default: csv)",
+    )
+    parser.add_argument(
+        "--partition",
+        dest="partition",
+        action="store_true",
+        default=False,
+        help="Partition large Parquet tables by Chemical_ID",
+    )
+    parser.add_argument(
+        "--workers",
+        dest="workers",
+        type=int,
+        default=None,
+        help="Maximum number of workflows to run at once (default: one per workflow)",
+    )
+    parser.add_argument(
+        "--bmd_workers",
+        dest="bmd_workers",
+        type=int,
+        default=None,
+        help="Number of processes for benchmark dose fitting "
+        "(default: one per available core)",
+    )
+    parser.add_argument(
+        "--bootstrap",
+        dest="bootstrap",
+        type=int,
+        default=None,
+        help="With --bmd, estimate BMDL10/BMDU10 from this many bootstrap "
+        "resamples of each curve (e.g. 1000); otherwise these columns are NA",
+    )
+    parser.add_argument(
+        "--prometheus",
+        dest="prometheus",
+        action="store_true",
+        default=False,
+        help="Also write stage telemetry as a Prometheus textfile "
+        "({output_dir}/telemetry_build.prom)",
+    )
+    parser.add_argument(
+        "--stream",
+        dest="stream",
+        action="store_true",
+        default=False,
+        help="Combine BMD, fit and dose files in chunks so that memory is "
+        "bound by the number of unique rows rather than total rows",
+    )
+    parser.add_argument(
+        "--incremental",
+        dest="incremental",
+        action="store_true",
+        default=False,
+        help="Only fit and read files that are new or changed in "
+        "srp_build_files.csv since the previous build, and merge them "
+        "into the existing outputs",
+    )
+    parser.add_argument(
+        "--no_cache",
+        dest="use_cache",
+        action="store_false",
+        default=True,
+        help="Recompute every stage instead of restoring unchanged outputs "
+        "from {output_dir}/.stage_cache",
+    )
 
     args = parser.parse_args()
 
-    ##call bmdrc on all morphology/behavior pairs for sample sources
-    if args.bmd:
-        tqdm.write("Re-running benchmark dose collection...")
-        newbmds, newfits, newdoses = [], [], []
-        fitCurveFiles()
+    if args.build_files is None:
+        df = load_mapping_reference()
+    else:
+        df = pd.read_csv(args.build_files)
 
-    # ------------------------------------------------------------------------
-    # Benchmark Dose (BMD) Calculation / Sample-Chem Mapping (SAMPS) Workflows
-    # ------------------------------------------------------------------------
-    if args.bmd or args.samps:  ### need to rerun samples if we have created new bmds
-        # add chemical BMDS, fits, curves to existing data
-        chem_files, sample_files = [], []
+    ####
+    # file parsing - collects all files we might need for the tool below
+    ####
+    ##first find the morphology and behavior pairs for chemical sources
+    chemdf = df.loc[df.sample_type == "chemical"]
+    morph = chemdf.loc[chemdf.data_type == "morphology"]
+    beh = chemdf.loc[chemdf.data_type == "behavior"]
+    tupes = []
+    for n in morph.name:
+        beh_loc = list(beh.loc[beh.name == n].location)
+        tupes.append(
+            (n, list(morph.loc[morph.name == n].location)[0], next(iter(beh_loc), None))
+        )
 
-        # Define files and set progress bar incrementes for concatenating each
-        sample_type = ["chemical", "extract"]
-        data_type = ["bmd", "fit", "dose"]
-        total_iterations = len(sample_type) * len(data_type)
-        progress_bar = tqdm(total=total_iterations, desc="Combining files")
+    ##now map sample information
+    sid = get_mapping_file(df, "sampId")
+    cid = get_mapping_file(df, "chemId")
+    cclass = get_mapping_file(df, "class1")
+    emap = get_mapping_file(df, "endpointMap")
+    fses = get_mapping_file(df, "sample", return_first=False)
+    descfile = get_mapping_file(df, "chemdesc")
+    smap = get_mapping_file(df, "sampMap")
+    gex1 = get_mapping_file(df, "expression", return_first=False)
+    ginfo = get_mapping_file(df, "geneInfo")
 
-        for st in sample_type:
-            tqdm.write(f"Processing {st} samples...")
+    # ---------------------------------------------------------------------
+    # Assemble the requested workflows as stages; independent stages
+    # (e.g. exposome and sample mapping) run at the same time
+    # ---------------------------------------------------------------------
+    stages = []
+    sampmap_args = {
+        "sid": sid,
+        "smap": smap,
+        "cid": cid,
+        "emap": emap,
+        "cclass": cclass,
+        "fses": fses,
+        "descfile": descfile,
+        "output_dir": args.output_dir,
+    }
 
-            for dt in data_type:
-                fdf = combineFiles(
-                    df.loc[df.sample_type == st].loc[df.data_type == dt], dt
+    state = None
+    if args.incremental:
+        state = incrementalState(df, tupes, args.output_dir)
+
+    ##call bmdrc on all morphology/behavior pairs for sample sources
+    if args.bmd:
+        fit_tupes = tupes
+        if state is not None:
+            fit_tupes = [
+                t
+                for t in tupes
+                if not all(
+                    state.is_current(loc, "fit") and os.path.exists(loc)
+                    for loc in fitOutputs([t], args.output_dir).location
                 )
-                fname = os.path.join(args.output_dir, f"tmp_{st}_{dt}.csv")
-                fdf.to_csv(fname, index=False)
-                if st == "chemical":
-                    chem_files.append(fname)
-                else:
-                    sample_files.append(fname)
-                progress_bar.update(1)
+            ]
+            tqdm.write(
+                f"Fitting {len(fit_tupes)} of {len(tupes)} new or changed "
+                "morphology/behavior pairs"
+            )
 
-        # Update progress bar after completion
-        progress_bar.set_description("Combining files... Done!")
-        progress_bar.close()
+        if fit_tupes:
+            stages.append(
+                Stage(
+                    name="bmd",
+                    func=runBmdStage,
+                    inputs=[
+                        loc
+                        for _, m, b in fit_tupes
+                        for loc in [m, b]
+                        if loc is not None
+                    ],
+                    outputs=list(fitOutputs(fit_tupes, args.output_dir).location),
+                    kwargs={
+                        "morpho_behavior_tuples": fit_tupes,
+                        "output_dir": args.output_dir,
+                        "max_workers": args.bmd_workers,
+                        "state": state,
+                        "bootstrap": args.bootstrap,
+                    },
+                )
+            )
 
-        # Define fixed params for sample mapping
-        all_res = list()
-        sampmap_args = {
-            "sid": sid,
-            "smap": smap,
-            "cid": cid,
-            "emap": emap,
-            "cclass": cclass,
-            "fses": fses,
-            "descfile": descfile,
-            "output_dir": args.output_dir,
-        }
+        # New fits are added to the existing BMD, fit and dose files
+        df = pd.concat([df, fitOutputs(tupes, args.output_dir)], ignore_index=True)
 
-        # Iterate through sampMap params
-        sampmap_params = [
-            {"is_sample": True, "drcfiles": sample_files},
-            {"is_sample": False, "drcfiles": chem_files},
-            {"is_sample": False, "drcfiles": []},
-        ]
-        progress_bar = tqdm(
-            range(len(sampmap_params)),
-            desc="Running sample mapping",
+    # ------------------------------------------------------------------------
+    # Benchmark Dose (BMD) Calculation / Sample-Chem Mapping (SAMPS) Workflows
+    # ------------------------------------------------------------------------
+    if args.bmd or args.samps:  ### need to rerun samples if we have created new bmds
+        stages.append(
+            Stage(
+                name="samps",
+                func=runSampsStage,
+                inputs=[sid, smap, cid, emap, cclass, descfile]
+                + fses.split(",")
+                + list(df.loc[df.data_type.isin(["bmd", "fit", "dose"])].location),
+                outputs=sampMapOutputs(args.output_dir, args.output_format),
+                kwargs={
+                    "df": df,
+                    "sampmap_args": sampmap_args,
+                    "state": state,
+                    "output_format": args.output_format,
+                    "partition": args.partition,
+                    "stream": args.stream,
+                },
+                params={
+                    "output_format": args.output_format,
+                    "partition": args.partition,
+                    "stream": args.stream,
+                },
+                code=CORE_CODE
+                + [
+                    os.path.join(
+                        APP_DIR, "sampleChemMapping", "map_samples_to_chemicals.py"
+                    )
+                ],
+                # Incremental builds track their own inputs; fingerprinting
+                # every remote file would defeat the purpose
+                cache=state is None,
+                validate=runSchemaCheck,
+            )
         )
 
-        # Perform sample mapping
-        for smp in sampmap_params:
-            smpargs = {**smp, **sampmap_args}
-            # tqdm.write(
-            #     f"Performing sample mapping with the following parameters: {smpargs}"
-            # )
-            res = runSampMap(**smpargs)
-            all_res.extend(res)
-            progress_bar.update(1)
-
-        # Update progress bar after completion
-        progress_bar.set_description("Running sample mapping... Done!")
-        progress_bar.close()
-
-        # Collect all unique files and remove temp files
-        all_res = list(set(all_res))
-        for f in sample_files + chem_files:
-            # tqdm.write(f"Filename: {f}")
-            # os.system(f"head {f}")
-            os.system(f"rm {f}")
-
-        # Validate schema
-        runSchemaCheck(res)
-
     # -----------------
     # Exposome Workflow
     # -----------------
     if args.expo:
-        res = runExposome(cid, output_dir=args.output_dir)
-        # for f in res:
-        #     tqdm.write(f"Filename: {f}")
-        #     os.system(f"head {f}")
-        runSchemaCheck(res)
+        stages.append(
+            Stage(
+                name="expo",
+                func=runExpoStage,
+                inputs=[cid],
+                outputs=[
+                    output_path(
+                        args.output_dir, "exposomeGeneStats", args.output_format
+                    )
+                ],
+                kwargs={
+                    "cid": cid,
+                    "output_dir": args.output_dir,
+                    "output_format": args.output_format,
+                },
+            )
+        )
 
     # ------------------------
     # Gene Expression Workflow
     # ------------------------
     if args.geneEx:
-        if not os.path.exists(os.path.join(args.output_dir, "chemicals.csv")):
-            runSampMap(
-                is_sample=False,
-                drcfiles=[],
-                sid=sid,
-                smap=smap,
-                cid=cid,
-                emap=emap,
-                cclass=cclass,
-                fses=fses,
-                descfile=descfile,
-                output_dir=args.output_dir,
+        stages.append(
+            Stage(
+                name="geneEx",
+                func=runGeneExStage,
+                inputs=gex1.split(",")
+                + [
+                    ginfo,
+                    output_path(args.output_dir, "chemicals", args.output_format),
+                ],
+                outputs=[
+                    os.path.join(args.output_dir, f)
+                    for f in ["srpDEGPathways.csv", "srpDEGStats.csv", "allGeneEx.csv"]
+                ],
+                kwargs={
+                    "gex": gex1,
+                    "ginfo": ginfo,
+                    "sampmap_args": sampmap_args,
+                    "output_format": args.output_format,
+                },
+                # The chemicals table may be written in this format
+                # (see `runGeneExStage`)
+                params={"output_format": args.output_format},
+                code=CORE_CODE + [os.path.join(APP_DIR, "zfExp", "parseGexData.R")],
+                cache=True,
+                validate=runSchemaCheck,
             )
-
-        res = runExpression(
-            gex1,
-            os.path.join(args.output_dir, "chemicals.csv"),
-            ginfo,
-            output_dir=args.output_dir,
         )
-        # for f in res:
-        #     tqdm.write(f"Filename: {f}")
-        #     os.system(f"head {f}")
-        runSchemaCheck(res)
+
+    # Exposome data comes from a live API, so that stage is never cached
+    cache = None
+    if args.use_cache:
+        cache = StageCache(os.path.join(args.output_dir, ".stage_cache"))
+    try:
+        run_stages(stages, max_workers=args.workers, cache=cache)
+        if state is not None:
+            state.prune()
+    finally:
+        write_telemetry(args.output_dir, "build", prometheus=args.prometheus)
 
 
 if __name__ == "__main__":
@@ -6,11 +6,15 @@
 import json
 import re
 import sys
-from os.path import join
+from os.path import abspath, dirname
 
 import pandas as pd
 import requests
 
+sys.path.append(dirname(dirname(abspath(__file__))))
+from src.tableio import output_path, write_table
+from src.telemetry import stage, write_telemetry
+
 # ===============================================
 #  CONFIG
 # ===============================================
@@ -304,49 +308,69 @@ def getGenes(chemical_id, project):
 # ===============================================
 #  RUN SCRIPT
 # ===============================================
-if __name__ == "__main__":
-    check_args()
-
+def main():
+    """Pull exposome data for all chemicals and save summary statistics."""
     # Load all chemicals and projects
-    chems = pd.read_csv(sys.argv[1], encoding="utf-8-sig").dropna(
-        subset=["Chemical_ID"]
-    )
-    projects = _load_projects()
+    with stage("expo:load") as rec:
+        chems = pd.read_csv(sys.argv[1], encoding="utf-8-sig").dropna(
+            subset=["Chemical_ID"]
+        )
+        projects = _load_projects()
+        rec.add_rows_in(chems)
 
     genes, gos = list(), list()
-    for proj in projects:
-        c = _load_chemicals(proj)
-
-        # Check for empty data
-        if c is None or c.empty:
-            print(f"No chemicals found for project {proj}")
-            continue
-
-        overlap = set(chems["cas_number"]).intersection(set(c["CAS"]))
-        print(f"Found {len(overlap)} CAS ids in common in project {proj}")
-
-        gg = pd.concat([getGenes(chem, proj) for chem in overlap], ignore_index=True)
-        # gt = pd.concat([getGoTerms(chem, proj) for chem in overlap], ignore_index=True)
-        genes.append(gg)  # gos.append(gt)
-
-    # Combine all gene data and include friendly project names
-    genes = pd.concat(genes, ignore_index=True)
-    genes["project_id"] = genes["Project"]
-    genes["Project"] = [PROJ2NAME[p] for p in genes["project_id"]]
-    # gos = pd.concat(gos, ignore_index=True)
-
-    # Get significant genes
-    genes = genes.loc[genes["ModZScore"].abs() > 1.63].copy()
-    chems = chems[["cas_number", "Chemical_ID"]].drop_duplicates()
-
-    genes = (
-        genes.groupby(["Project", "cas_number", "Concentration", "Link", "Condition"])
-        .agg(nGenes=("Gene", "nunique"))
-        .reset_index()
-        .merge(chems, on="cas_number")
-    )
+    with stage("expo:genes") as rec:
+        for proj in projects:
+            c = _load_chemicals(proj)
+
+            # Check for empty data
+            if c is None or c.empty:
+                print(f"No chemicals found for project {proj}")
+                continue
+
+            overlap = set(chems["cas_number"]).intersection(set(c["CAS"]))
+            print(f"Found {len(overlap)} CAS ids in common in project {proj}")
+
+            gg = pd.concat(
+                [getGenes(chem, proj) for chem in overlap], ignore_index=True
+            )
+            # gt = pd.concat([getGoTerms(chem, proj) for chem in overlap], ignore_index=True)
+            genes.append(gg)  # gos.append(gt)
+            rec.add_rows_out(gg)
+
+    with stage("expo:summarize") as rec:
+        # Combine all gene data and include friendly project names
+        genes = pd.concat(genes, ignore_index=True)
+        genes["project_id"] = genes["Project"]
+        genes["Project"] = [PROJ2NAME[p] for p in genes["project_id"]]
+        # gos = pd.concat(gos, ignore_index=True)
+        rec.add_rows_in(genes)
+
+        # Get significant genes
+        genes = genes.loc[genes["ModZScore"].abs() > 1.63].copy()
+        chems = chems[["cas_number", "Chemical_ID"]].drop_duplicates()
+
+        genes = (
+            genes.groupby(
+                ["Project", "cas_number", "Concentration", "Link", "Condition"]
+            )
+            .agg(nGenes=("Gene", "nunique"))
+            .reset_index()
+            .merge(chems, on="cas_number")
+        )
+
+        # Enforce schema
+        genes = genes.rename(columns={"Concentration": "concentration"})
+
+        # Optional second argument sets the output format (e.g. parquet)
+        output_format = sys.argv[2] if len(sys.argv) > 2 else "csv"
+        write_table(genes, output_path(OUTPUT_DIR, "exposomeGeneStats", output_format))
+        rec.add_rows_out(genes)
 
-    # Enforce schema
-    genes = genes.rename(columns={"Concentration": "concentration"})
 
-    genes.to_csv(join(OUTPUT_DIR, "exposomeGeneStats.csv"), index=False)
+if __name__ == "__main__":
+    check_args()
+    try:
+        main()
+    finally:
+        write_telemetry(OUTPUT_DIR, "exposome")
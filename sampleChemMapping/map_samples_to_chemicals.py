@@ -9,7 +9,8 @@ Original rewrite using generative AI; modified by @christinehc
 import os
 import sys
 from argparse import ArgumentParser
-from typing import Optional
+from dataclasses import dataclass
+from typing import Optional, Union
 
 import numpy as np
 import pandas as pd
@@ -21,14 +22,18 @@ from src.format import rename_duplicates
 from src.mapping import rename_chemical_class
 from src.metadata import build_chem_metadata, get_endpoint_metadata
 from src.params import (
+    BMD_COLUMN_DTYPES,
     MASV_CC,
     MASV_SOURCE,
+    OPTIONAL_BMD_COLUMNS,
     QC_FLAGS,
     REQUIRED_BMD_COLUMNS,
     REQUIRED_SAMPLE_COLUMNS,
     SAMPLE_CHEM_COLUMNS,
     SAMPLE_COLUMNS,
 )
+from src.tableio import OUTPUT_FORMATS, output_path, read_csv_files, write_table
+from src.telemetry import stage, write_telemetry
 from src.tables import sample_id_master_table
 
 # These pathways refer to absolute pathways in the docker image
@@ -90,11 +95,9 @@ def get_new_chemical_class(data_dir: str) -> pd.DataFrame:
     return full_class
 
 
-def process_fses(filename: str) -> pd.DataFrame:
+def process_fses(fses: pd.DataFrame) -> pd.DataFrame:
     # Replace invalid values with nulls for filtering
-    fses = pd.read_csv(filename)[REQUIRED_SAMPLE_COLUMNS].replace(
-        {"BLOD": "0", "NULL": "0", "nc:BDL": "0"}
-    )
+    fses = fses.replace({"BLOD": "0", "NULL": "0", "nc:BDL": "0"})
 
     # Remove null and invalid entries
     fses = (
@@ -115,7 +118,7 @@ def process_fses(filename: str) -> pd.DataFrame:
 
 
 def build_sample_data(
-    fses_files: list[str],
+    fses_files: Union[list[str], pd.DataFrame],
     chem_metadata: pd.DataFrame,
     sample_id_file: str,
     sample_mapping: str = None,
@@ -124,8 +127,9 @@ def build_sample_data(
 
     Parameters
     ----------
-    fses_files : list[str]
-        List of FSES files from the Barton lab with sample info
+    fses_files : Union[list[str], pd.DataFrame]
+        List of FSES files from the Barton lab with sample info,
+        or their already-read (concatenated) table
     chem_metadata : pd.DataFrame
         Chemical metadata table containing identifier mapping
     sample_id_file : str
@@ -139,7 +143,11 @@ def build_sample_data(
         _description_
     """
     # Read and process all FSES files
-    data = pd.concat([process_fses(f) for f in fses_files])
+    if not isinstance(fses_files, pd.DataFrame):
+        fses_files = read_csv_files(
+            fses_files, usecols=REQUIRED_SAMPLE_COLUMNS, ignore_index=True
+        )
+    data = process_fses(fses_files)
 
     # Add chemical metadata and sample IDs
     chem_metadata = chem_metadata[
@@ -208,8 +216,57 @@ def build_sample_data(
     return data
 
 
+def _read_tables(
+    tables: list[Union[str, pd.DataFrame]], cols: list[str], errors: str = "raise"
+) -> pd.DataFrame:
+    """Select columns from tables given as paths or DataFrames.
+
+    Parameters
+    ----------
+    tables : list[Union[str, pd.DataFrame]]
+        List of /path/to/file or already-loaded tables
+    cols : list[str]
+        Columns to select; OPTIONAL_BMD_COLUMNS that a file lacks
+        are filled with NA
+    errors : str, optional
+        One of ["raise", "warn"]; see `src.tableio.read_csv_files`,
+            by default "raise"
+
+    Returns
+    -------
+    pd.DataFrame
+        Concatenated table with only the selected columns
+    """
+    tables = list(tables)
+    if not any(isinstance(t, pd.DataFrame) for t in tables):
+        return read_csv_files(
+            tables,
+            usecols=cols,
+            dtype=BMD_COLUMN_DTYPES,
+            errors=errors,
+            optional=OPTIONAL_BMD_COLUMNS,
+        )
+
+    return pd.concat(
+        [
+            (
+                t[cols]
+                if isinstance(t, pd.DataFrame)
+                else read_csv_files(
+                    [t],
+                    usecols=cols,
+                    dtype=BMD_COLUMN_DTYPES,
+                    errors=errors,
+                    optional=OPTIONAL_BMD_COLUMNS,
+                )
+            )
+            for t in tables
+        ]
+    )
+
+
 def combine_v2_chemical_endpoint_data(
-    bmd_files: list[str],
+    bmd_files: list[Union[str, pd.DataFrame]],
     is_extract: bool = False,
     chem_data: Optional[pd.DataFrame] = None,
     endpoint_details: Optional[pd.DataFrame] = None,
@@ -218,8 +275,8 @@ def combine_v2_chemical_endpoint_data(
 
     Parameters
     ----------
-    bmd_files : list[str]
-        List of BMD files
+    bmd_files : list[Union[str, pd.DataFrame]]
+        List of BMD files (or already-loaded BMD tables)
     is_extract : bool, optional
         True if data is for extracts, by default False
     chem_data : Optional[pd.DataFrame], optional
@@ -236,8 +293,7 @@ def combine_v2_chemical_endpoint_data(
 
     # Read and concatenate the specified columns from all BMD files
     cols = REQUIRED_BMD_COLUMNS["bmd"]
-    files = [pd.read_csv(file)[cols] for file in bmd_files]
-    df = pd.concat(files)
+    df = _read_tables(bmd_files, cols)
 
     # Remove duplicates
     df = df.drop_duplicates(subset=["Chemical_ID", "End_Point"])
@@ -316,7 +372,7 @@ def combine_v2_chemical_endpoint_data(
 
 
 def combine_chemical_data(
-    bmd_files: list[str],
+    bmd_files: list[Union[str, pd.DataFrame]],
     data_type: str = "fit",
     is_extract: bool = False,
     chem_data: Optional[pd.DataFrame] = None,
@@ -326,8 +382,8 @@ def combine_chemical_data(
 
     Parameters
     ----------
-    bmd_files : list[str]
-        _description_
+    bmd_files : list[Union[str, pd.DataFrame]]
+        List of fit or dose files (or already-loaded tables)
     data_type : str, optional
         _description_, by default "fit"
     is_extract : bool, optional
@@ -357,18 +413,12 @@ def combine_chemical_data(
 
     cols = REQUIRED_BMD_COLUMNS[col_type]
 
-    # Read all files into df (and throw error for invalid)
-    files = list()
-    for file in bmd_files:
-        try:
-            df = pd.read_csv(file)[cols]
-            files.append(df)
-        except Exception as e:
-            tqdm.write(f"Error reading {file}: {e}")
-    if not files:
+    # Read all files into df (and report invalid files)
+    df = _read_tables(bmd_files, cols, errors="warn")
+    if df.empty:
         tqdm.write("No valid files found")
         return pd.DataFrame()
-    df = pd.concat(files, ignore_index=True)
+    df = df.reset_index(drop=True)
 
     # Create combined identifier
     df["combined"] = df["Chemical_ID"].astype(str) + " " + df["End_Point"]
@@ -510,6 +560,260 @@ def masv_chem_class(
     return combined
 
 
+# =========================================================
+# Mapping API
+#
+# The sample, chemical and core outputs all depend on the same
+# inputs (MASV classes, chemical metadata, FSES sample data and
+# endpoint details). These are loaded once into `MappingInputs`
+# and then shared by every output set.
+# =========================================================
+METADATA_FILE = "https://raw.githubusercontent.com/PNNL-CompBio/srpAnalytics/main/data/srp_build_files.csv"
+
+
+@dataclass
+class MappingInputs:
+    """Shared inputs for sample-to-chemical mapping.
+
+    Parameters
+    ----------
+    chem_class : pd.DataFrame
+        MASV chemical class and source annotations
+    chem_metadata : pd.DataFrame
+        Chemical metadata (CompTox) with chemical IDs
+    chem_sample : pd.DataFrame
+        FSES sample measurements with sample and chemical IDs
+    endpoint_details : pd.DataFrame
+        Endpoint names and descriptions
+    """
+
+    chem_class: pd.DataFrame
+    chem_metadata: pd.DataFrame
+    chem_sample: pd.DataFrame
+    endpoint_details: pd.DataFrame
+
+
+def load_mapping_inputs(
+    chem_class_file: str,
+    sample_files: Union[list[str], pd.DataFrame],
+    sample_id_file: str,
+    endpoint_mapping_file: str,
+    sample_map: Optional[str] = None,
+    metadata: str = METADATA_FILE,
+    output_dir: str = OUTPUT_DIR,
+) -> MappingInputs:
+    """Load (and parse) every input shared by the mapping outputs.
+
+    Parameters
+    ----------
+    chem_class_file : str
+        /path/to/chemical_class_file (MASV Excel workbook)
+    sample_files : Union[list[str], pd.DataFrame]
+        List of FSES files to merge (or their already-read table)
+    sample_id_file : str
+        /path/to/sample_id_file (CSV file)
+    endpoint_mapping_file : str
+        /path/to/endpoint_mapping_file (SuperEndpoint Excel workbook)
+    sample_map : Optional[str], optional
+        /path/to/sample_mapping_file, by default None
+    metadata : str, optional
+        Metadata file location (i.e. srp_build_files.csv),
+            by default METADATA_FILE
+    output_dir : str, optional
+        Directory containing (or to contain) chem_metadata.tsv,
+            by default OUTPUT_DIR
+
+    Returns
+    -------
+    MappingInputs
+        Shared mapping inputs
+    """
+    with stage("map:load_inputs") as rec:
+        tqdm.write("Getting chemical metadata...")
+        chem_class = masv_chem_class(chem_class_file)
+        metadata_file = os.path.join(output_dir, "chem_metadata.tsv")
+        if not os.path.exists(metadata_file):
+            tqdm.write("No metadata found. Building metadata...")
+            chem_metadata = build_chem_metadata(metadata, save_to=metadata_file)
+        else:
+            tqdm.write("Metadata found! Reading from previous file...")
+            chem_metadata = pd.read_csv(metadata_file, sep="\t")
+        tqdm.write("Done!")
+
+        tqdm.write("Getting sample data...")
+        chem_sample = build_sample_data(
+            sample_files, chem_metadata, sample_id_file, sample_map or None
+        )
+        tqdm.write("Done!")
+
+        tqdm.write("Getting endpoint details...")
+        endpoint_details = get_endpoint_metadata(
+            endpoint_mapping_file
+        ).drop_duplicates()
+        tqdm.write("Done!")
+        rec.add_rows_out(chem_sample)
+
+    return MappingInputs(
+        chem_class=chem_class,
+        chem_metadata=chem_metadata,
+        chem_sample=chem_sample,
+        endpoint_details=endpoint_details,
+    )
+
+
+def map_dose_response(
+    inputs: MappingInputs,
+    drc_files: Union[list[str], dict[str, Union[str, pd.DataFrame]]],
+    is_sample: bool = False,
+    output_dir: str = OUTPUT_DIR,
+    output_format: str = "csv",
+    partition: bool = False,
+) -> list[str]:
+    """Map BMD, fit and dose-response data to samples or chemicals.
+
+    Parameters
+    ----------
+    inputs : MappingInputs
+        Shared mapping inputs (see `load_mapping_inputs`)
+    drc_files : Union[list[str], dict[str, Union[str, pd.DataFrame]]]
+        List of BMD/fit/dose files, where the file type is read from
+        the filename ("bmd", "fit" or "dose"); or, tables (or files)
+        keyed by type (e.g. {"bmd": df, "fit": df, "dose": df}) to map
+        them without writing intermediate files
+    is_sample : bool, optional
+        If True, maps extract data to samples (zebrafishSamp*.csv);
+        else, maps chemical data (zebrafishChem*.csv), by default False
+    output_dir : str, optional
+        Directory to save output, by default OUTPUT_DIR
+    output_format : str, optional
+        One of ["csv", "parquet", "feather"], by default "csv"
+    partition : bool, optional
+        If True, large Parquet tables are partitioned by Chemical_ID
+        (see `src.tableio.write_table`), by default False
+
+    Returns
+    -------
+    list[str]
+        Paths to the BMD, XY coordinate and dose response files
+    """
+    with stage("map:dose_response") as rec:
+        if isinstance(drc_files, dict):
+            bmd_files = [drc_files["bmd"]] if "bmd" in drc_files else []
+            dose_files = [drc_files["dose"]] if "dose" in drc_files else []
+            fit_files = [drc_files["fit"]] if "fit" in drc_files else []
+        else:
+            bmd_files = [file for file in drc_files if "bmd" in file]
+            dose_files = [file for file in drc_files if "dose" in file]
+            fit_files = [file for file in drc_files if "fit" in file]
+
+        chem_data = inputs.chem_sample if is_sample else inputs.chem_metadata
+
+        tqdm.write("Combining chemical endpoint data...")
+        bmds = (
+            combine_v2_chemical_endpoint_data(
+                bmd_files,
+                is_extract=is_sample,
+                chem_data=chem_data,
+                endpoint_details=inputs.endpoint_details,
+            )
+            .dropna(subset=["BMD_Analysis_Flag"])
+            .query("BMD_Analysis_Flag != 'NA'")
+        )
+        tqdm.write("Done!")
+
+        tqdm.write("Combining chemical fitness data...")
+        curves = combine_chemical_data(
+            fit_files,
+            data_type="fit",
+            is_extract=is_sample,
+            chem_data=chem_data,
+            endpoint_details=inputs.endpoint_details,
+        )
+        tqdm.write("Done!")
+
+        tqdm.write("Combining chemical dose response data...")
+        dose_reps = combine_chemical_data(
+            dose_files,
+            data_type="dose",
+            is_extract=is_sample,
+            chem_data=chem_data,
+            endpoint_details=inputs.endpoint_details,
+        ).dropna(subset=["Dose"])
+        tqdm.write("Done!")
+        rec.add_rows_in(len(bmds) + len(curves) + len(dose_reps))
+
+        if is_sample:
+            tqdm.write("Saving sample data to CSV...")
+            prefix = "zebrafishSamp"
+        else:
+            tqdm.write("Removing invalid chemical IDs...")
+            nas = bmds[bmds["Chemical_ID"].isna()]["Chemical_ID"]
+            to_remove = set(nas) - set(inputs.chem_sample["Chemical_ID"])
+            bmds = bmds[~bmds["Chemical_ID"].isin(to_remove)]
+            curves = curves[~curves["Chemical_ID"].isin(to_remove)]
+            dose_reps = dose_reps[~dose_reps["Chemical_ID"].isin(to_remove)]
+            tqdm.write("Done!")
+
+            tqdm.write("Saving chemical data to CSV...")
+            prefix = "zebrafishChem"
+
+        outputs = list()
+        for table, name in zip(
+            [bmds, curves, dose_reps], ["BMDs", "XYCoords", "DoseResponse"]
+        ):
+            fname = output_path(output_dir, f"{prefix}{name}", output_format)
+            write_table(table, fname, partition=partition)
+            rec.add_rows_out(table)
+            outputs.append(fname)
+        tqdm.write("Done!")
+
+    return outputs
+
+
+def write_core_tables(
+    inputs: MappingInputs,
+    output_dir: str = OUTPUT_DIR,
+    output_format: str = "csv",
+    partition: bool = False,
+) -> list[str]:
+    """Save the chemical, sample and sample-to-chemical tables.
+
+    Parameters
+    ----------
+    inputs : MappingInputs
+        Shared mapping inputs (see `load_mapping_inputs`)
+    output_dir : str, optional
+        Directory to save output, by default OUTPUT_DIR
+    output_format : str, optional
+        One of ["csv", "parquet", "feather"], by default "csv"
+    partition : bool, optional
+        If True, large Parquet tables are partitioned by Chemical_ID
+        (see `src.tableio.write_table`), by default False
+
+    Returns
+    -------
+    list[str]
+        Paths to chemicals.csv, samples.csv and samplesToChemicals.csv
+    """
+    with stage("map:core_tables") as rec:
+        tqdm.write("Saving data...")
+        outputs = [
+            output_path(output_dir, name, output_format)
+            for name in ["chemicals", "samples", "samplesToChemicals"]
+        ]
+        tables = [
+            inputs.chem_metadata,
+            inputs.chem_sample[SAMPLE_COLUMNS].drop_duplicates(),
+            inputs.chem_sample[SAMPLE_CHEM_COLUMNS].drop_duplicates(),
+        ]
+        for table, fname in zip(tables, outputs):
+            write_table(table, fname, partition=partition)
+            rec.add_rows_out(table)
+        tqdm.write("Done!")
+
+    return outputs
+
+
 # =========================================================
 # Command Line Interface (CLI)
 # =========================================================
@@ -590,7 +894,7 @@ def main():
     parser.add_argument(
         "--metadata",
         dest="metadata",
-        default="https://raw.githubusercontent.com/PNNL-CompBio/srpAnalytics/main/data/srp_build_files.csv",
+        default=METADATA_FILE,
         help="Metadata file location (i.e. srp_build_files.csv)",
     )
     parser.add_argument(
@@ -600,137 +904,75 @@ def main():
         default=OUTPUT_DIR,
         help="File that maps sample locations",
     )
+    parser.add_argument(
+        "--output_format",
+        dest="output_format",
+        choices=list(OUTPUT_FORMATS),
+        default="csv",
+        help="Format of output tables (default: csv)",
+    )
+    parser.add_argument(
+        "--partition",
+        dest="partition",
+        action="store_true",
+        default=False,
+        help="Partition large Parquet tables by Chemical_ID",
+    )
+    parser.add_argument(
+        "--prometheus",
+        dest="prometheus",
+        action="store_true",
+        default=False,
+        help="Also write stage telemetry as a Prometheus textfile",
+    )
 
     args = parser.parse_args()
 
-    tqdm.write("Getting chemical metadata...")
-    chem_class = masv_chem_class(args.chem_class_file)
-    if not os.path.exists(os.path.join(args.output_dir, "chem_metadata.tsv")):
-        tqdm.write("No metadata found. Building metadata...")
-        chem_metadata = build_chem_metadata(
-            args.metadata, save_to=os.path.join(args.output_dir, "chem_metadata.tsv")
-        )
-    else:
-        tqdm.write("Metadata found! Reading from previous file...")
-        chem_metadata = pd.read_csv(
-            os.path.join(args.output_dir, "chem_metadata.tsv"), sep="\t"
-        )
-    tqdm.write("Done!")
-
-    tqdm.write("Getting sample data...")
-    sample_files_list = args.sample_files.split(",")
-    chem_sample = build_sample_data(
-        sample_files_list, chem_metadata, args.sample_id_file, args.sample_map
+    try:
+        run_mapping(args)
+    finally:
+        write_telemetry(args.output_dir, "map_samples", prometheus=args.prometheus)
+
+
+def run_mapping(args):
+    """Run the mapping selected by the parsed command line arguments."""
+    inputs = load_mapping_inputs(
+        args.chem_class_file,
+        args.sample_files.split(","),
+        args.sample_id_file,
+        args.endpoint_mapping_file,
+        sample_map=args.sample_map,
+        metadata=args.metadata,
+        output_dir=args.output_dir,
     )
-    tqdm.write("Done!")
-
-    tqdm.write("Getting endpoint details...")
-    endpoint_details = get_endpoint_metadata(
-        args.endpoint_mapping_file
-    ).drop_duplicates()
-    tqdm.write("Done!")
 
     if args.is_sample or args.is_chem:
         all_files = args.dose_response.split(",")
-        bmd_files = [file for file in all_files if "bmd" in file]
-        dose_files = [file for file in all_files if "dose" in file]
-        fit_files = [file for file in all_files if "fit" in file]
-
-        chem_data = chem_sample if args.is_sample else chem_metadata
-
-        tqdm.write("Combining chemical endpoint data...")
-        bmds = (
-            combine_v2_chemical_endpoint_data(
-                bmd_files,
-                is_extract=args.is_sample,
-                chem_data=chem_data,
-                endpoint_details=endpoint_details,
-            )
-            .dropna(subset=["BMD_Analysis_Flag"])
-            .query("BMD_Analysis_Flag != 'NA'")
-        )
-        tqdm.write("Done!")
-
-        tqdm.write("Combining chemical fitness data...")
-        curves = combine_chemical_data(
-            fit_files,
-            data_type="fit",
-            is_extract=args.is_sample,
-            chem_data=chem_data,
-            endpoint_details=endpoint_details,
-        )
-        tqdm.write("Done!")
-
-        tqdm.write("Combining chemical dose response data...")
-        dose_reps = combine_chemical_data(
-            dose_files,
-            data_type="dose",
-            is_extract=args.is_sample,
-            chem_data=chem_data,
-            endpoint_details=endpoint_details,
-        ).dropna(subset=["Dose"])
-        tqdm.write("Done!")
-
         if args.is_sample:
-            tqdm.write("Saving sample data to CSV...")
-            bmds.to_csv(
-                os.path.join(args.output_dir, "zebrafishSampBMDs.csv"),
-                index=False,
-                quotechar='"',
-            )
-            curves.to_csv(
-                os.path.join(args.output_dir, "zebrafishSampXYCoords.csv"),
-                index=False,
-                quotechar='"',
+            map_dose_response(
+                inputs,
+                all_files,
+                is_sample=True,
+                output_dir=args.output_dir,
+                output_format=args.output_format,
+                partition=args.partition,
             )
-            dose_reps.to_csv(
-                os.path.join(args.output_dir, "zebrafishSampDoseResponse.csv"),
-                index=False,
-                quotechar='"',
-            )
-            tqdm.write("Done!")
-
         if args.is_chem:
-            tqdm.write("Removing invalid chemical IDs...")
-            nas = bmds[bmds["Chemical_ID"].isna()]["Chemical_ID"]
-            to_remove = set(nas) - set(chem_sample["Chemical_ID"])
-            bmds = bmds[~bmds["Chemical_ID"].isin(to_remove)]
-            curves = curves[~curves["Chemical_ID"].isin(to_remove)]
-            dose_reps = dose_reps[~dose_reps["Chemical_ID"].isin(to_remove)]
-            tqdm.write("Done!")
-
-            tqdm.write("Saving chemical data to CSV...")
-            bmds.to_csv(
-                os.path.join(args.output_dir, "zebrafishChemBMDs.csv"),
-                index=False,
-                quotechar='"',
+            map_dose_response(
+                inputs,
+                all_files,
+                is_sample=False,
+                output_dir=args.output_dir,
+                output_format=args.output_format,
+                partition=args.partition,
             )
-            curves.to_csv(
-                os.path.join(args.output_dir, "zebrafishChemXYCoords.csv"),
-                index=False,
-                quotechar='"',
-            )
-            dose_reps.to_csv(
-                os.path.join(args.output_dir, "zebrafishChemDoseResponse.csv"),
-                index=False,
-                quotechar='"',
-            )
-            tqdm.write("Done!")
-
     else:
-        tqdm.write("Saving data...")
-        chem_metadata.to_csv(
-            os.path.join(args.output_dir, "chemicals.csv"), index=False, quotechar='"'
-        )
-        chem_sample[SAMPLE_COLUMNS].drop_duplicates().to_csv(
-            os.path.join(args.output_dir, "samples.csv"), index=False, quotechar='"'
+        write_core_tables(
+            inputs,
+            output_dir=args.output_dir,
+            output_format=args.output_format,
+            partition=args.partition,
         )
-        chem_sample[SAMPLE_CHEM_COLUMNS].drop_duplicates().to_csv(
-            os.path.join(args.output_dir, "samplesToChemicals.csv"),
-            index=False,
-            quotechar='"',
-        )
-        tqdm.write("Done!")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,248 @@
+# =========================================================
+# Imports
+# =========================================================
+import hashlib
+import json
+import os
+import shutil
+from typing import Any, Optional
+from urllib.request import Request, urlopen
+
+from tqdm import tqdm
+
+from .stages import Stage
+
+# Bump to invalidate every cache entry written by older layouts
+CACHE_VERSION = "1"
+
+# Read files in 1 MiB blocks when hashing
+BLOCK_SIZE = 1 << 20
+
+
+# =========================================================
+# Functions
+# =========================================================
+def _copy(src: str, dst: str):
+    # Outputs may be directories (e.g. partitioned Parquet tables)
+    if os.path.isdir(dst):
+        shutil.rmtree(dst)
+    if os.path.isdir(src):
+        shutil.copytree(src, dst)
+    else:
+        shutil.copyfile(src, dst)
+
+
+def _is_url(location: str) -> bool:
+    return location.startswith(("http://", "https://"))
+
+
+def fingerprint(location: str) -> str:
+    """Get a content fingerprint for a local file or remote URL.
+
+    Local files are hashed in full. For URLs, the server's validators
+    (ETag, or Last-Modified + Content-Length) are used when available
+    so that unchanged remote files are not downloaded; otherwise the
+    response body is hashed.
+
+    Parameters
+    ----------
+    location : str
+        /path/to/file or URL
+
+    Returns
+    -------
+    str
+        Fingerprint string (e.g. "sha256:..." or "etag:...")
+    """
+    if not location:
+        return "none"
+
+    if not _is_url(location):
+        if not os.path.exists(location):
+            return "missing"
+        files = [location]
+        if os.path.isdir(location):
+            files = sorted(
+                os.path.join(root, f)
+                for root, _, names in os.walk(location)
+                for f in names
+            )
+        sha = hashlib.sha256()
+        for file in files:
+            if file != location:
+                sha.update(os.path.relpath(file, location).encode())
+            with open(file, "rb") as f:
+                for block in iter(lambda: f.read(BLOCK_SIZE), b""):
+                    sha.update(block)
+        return f"sha256:{sha.hexdigest()}"
+
+    try:
+        with urlopen(Request(location, method="HEAD"), timeout=30) as res:
+            etag = res.headers.get("ETag")
+            modified = res.headers.get("Last-Modified")
+            length = res.headers.get("Content-Length")
+        if etag:
+            return f"etag:{etag}"
+        if modified:
+            return f"modified:{modified}:{length}"
+    except OSError:
+        pass  # Fall back to hashing the response body
+
+    sha = hashlib.sha256()
+    with urlopen(location, timeout=300) as res:
+        for block in iter(lambda: res.read(BLOCK_SIZE), b""):
+            sha.update(block)
+    return f"sha256:{sha.hexdigest()}"
+
+
+class StageCache:
+    """Content-addressed cache of stage outputs.
+
+    A stage's key is the hash of its name, its parameters, the
+    source code it runs and the fingerprint of each of its inputs.
+    Outputs are stored under `{cache_dir}/{stage}/{key}/`; a later
+    run with the same key copies them back instead of recomputing.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory holding cached outputs (e.g. {output_dir}/.stage_cache)
+    keep : int, optional
+        Number of entries to keep per stage, by default 2
+    """
+
+    def __init__(self, cache_dir: str, keep: int = 2):
+        self.cache_dir = cache_dir
+        self.keep = keep
+        self._fingerprints = dict()
+
+    def _fingerprint(self, location: str) -> str:
+        # Inputs are shared between stages (e.g. chemicalIdMapping.csv),
+        # so only fingerprint each of them once per build
+        if location not in self._fingerprints:
+            self._fingerprints[location] = fingerprint(location)
+        return self._fingerprints[location]
+
+    def key(self, stage: Stage) -> str:
+        """Compute the cache key of a stage.
+
+        Parameters
+        ----------
+        stage : Stage
+            Stage to compute key for
+
+        Returns
+        -------
+        str
+            Hex digest identifying the stage's inputs, parameters and code
+        """
+        desc = {
+            "version": CACHE_VERSION,
+            "stage": stage.name,
+            "params": stage.params,
+            "code": {f: self._fingerprint(f) for f in sorted(stage.code)},
+            "inputs": [self._fingerprint(f) for f in stage.inputs],
+            "outputs": [os.path.basename(f) for f in stage.outputs],
+        }
+        blob = json.dumps(desc, sort_keys=True, default=str).encode()
+        return hashlib.sha256(blob).hexdigest()
+
+    def restore(self, stage: Stage, key: str) -> Optional[dict[str, Any]]:
+        """Copy cached outputs back into place.
+
+        Returns
+        -------
+        Optional[dict[str, Any]]
+            Cache entry metadata if restored, otherwise None
+        """
+        entry_dir = os.path.join(self.cache_dir, stage.name, key)
+        meta_file = os.path.join(entry_dir, "entry.json")
+        if not os.path.exists(meta_file):
+            return None
+
+        with open(meta_file) as f:
+            meta = json.load(f)
+        cached = [os.path.join(entry_dir, c) for c in meta["files"]]
+        if len(cached) != len(stage.outputs) or not all(map(os.path.exists, cached)):
+            return None
+
+        for out, src in zip(stage.outputs, cached):
+            os.makedirs(os.path.dirname(os.path.abspath(out)), exist_ok=True)
+            _copy(src, out)
+        return meta
+
+    def store(self, stage: Stage, key: str, result: Any = None):
+        """Save a stage's outputs under its key.
+
+        The entry is only written if every declared output exists.
+        """
+        if not all(os.path.exists(out) for out in stage.outputs):
+            tqdm.write(f"Not caching stage '{stage.name}': missing outputs")
+            return
+
+        entry_dir = os.path.join(self.cache_dir, stage.name, key)
+        tmp_dir = f"{entry_dir}.tmp"
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+        os.makedirs(tmp_dir)
+
+        files = list()
+        for i, out in enumerate(stage.outputs):
+            cached = f"{i:03d}_{os.path.basename(out)}"
+            _copy(out, os.path.join(tmp_dir, cached))
+            files.append(cached)
+
+        try:
+            json.dumps(result)
+        except TypeError:
+            result = None
+        with open(os.path.join(tmp_dir, "entry.json"), "w") as f:
+            json.dump({"key": key, "files": files, "result": result}, f)
+
+        # Swap in the new entry, then drop the oldest ones
+        shutil.rmtree(entry_dir, ignore_errors=True)
+        os.replace(tmp_dir, entry_dir)
+        self._prune(stage)
+
+    def _prune(self, stage: Stage):
+        stage_dir = os.path.join(self.cache_dir, stage.name)
+        entries = sorted(
+            (os.path.join(stage_dir, d) for d in os.listdir(stage_dir)),
+            key=os.path.getmtime,
+            reverse=True,
+        )
+        for old in entries[self.keep :]:
+            shutil.rmtree(old, ignore_errors=True)
+
+    def run(self, stage: Stage) -> Any:
+        """Restore a stage from cache, or run it and cache its outputs.
+
+        Restored outputs are checked with `stage.validate`, if given.
+
+        Parameters
+        ----------
+        stage : Stage
+            Stage to run
+
+        Returns
+        -------
+        Any
+            Return value of the stage (or the cached value on a hit)
+        """
+        try:
+            key = self.key(stage)
+        except OSError as e:
+            tqdm.write(
+                f"Could not fingerprint inputs of stage '{stage.name}' ({e}); running uncached."
+            )
+            return stage.func(**stage.kwargs)
+
+        meta = self.restore(stage, key)
+        if meta is not None:
+            tqdm.write(f"Stage '{stage.name}' unchanged; restored cached outputs.")
+            if stage.validate is not None:
+                stage.validate(stage.outputs)
+            return meta["result"]
+
+        result = stage.func(**stage.kwargs)
+        self.store(stage, key, result)
+        return result
@@ -0,0 +1,156 @@
+# =========================================================
+# Imports
+# =========================================================
+import hashlib
+import json
+import os
+import threading
+from typing import Any, Optional
+
+import pandas as pd
+
+# Columns of srp_build_files.csv that identify a version of a file
+MANIFEST_COLUMNS = ["name", "data_type", "sample_type", "location", "version"]
+
+
+# =========================================================
+# Functions
+# =========================================================
+def _digest(*parts: Any) -> str:
+    blob = json.dumps(parts, sort_keys=True, default=str).encode()
+    return hashlib.sha256(blob).hexdigest()
+
+
+def manifest_signatures(manifest: pd.DataFrame) -> dict[str, str]:
+    """Get a signature for each file listed in srp_build_files.csv.
+
+    A file's signature changes whenever any manifest row pointing
+    to it is added, removed or edited (e.g. a new `version`).
+
+    Parameters
+    ----------
+    manifest : pd.DataFrame
+        Mapping file reference table (srp_build_files.csv)
+
+    Returns
+    -------
+    dict[str, str]
+        File location -> signature
+    """
+    cols = [c for c in MANIFEST_COLUMNS if c in manifest.columns]
+    rows = dict()
+    for row in manifest[cols].astype(str).itertuples(index=False):
+        rows.setdefault(row.location, list()).append(list(row))
+    return {loc: _digest(*sorted(r)) for loc, r in rows.items()}
+
+
+class BuildState:
+    """Tables read by previous builds, kept for incremental rebuilds.
+
+    Every CSV file read through the state (see
+    `src.tableio.read_csv_files`) is saved under
+    `{output_dir}/.incremental/` together with the signature of the
+    srp_build_files.csv rows it came from. A later build loads the
+    saved table instead of re-reading the file as long as the
+    signature is unchanged, so only new or changed rows are read;
+    outputs are then rebuilt from the saved and new tables with the
+    usual duplicate removal.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory where build outputs are saved
+    signatures : dict[str, str]
+        File location -> signature of the current build
+        (see `manifest_signatures`)
+    """
+
+    def __init__(self, output_dir: str, signatures: dict[str, str]):
+        self.state_dir = os.path.join(output_dir, ".incremental")
+        self.signatures = dict(signatures)
+        self._lock = threading.Lock()
+
+        self._index_file = os.path.join(self.state_dir, "index.json")
+        self._index = dict()
+        if os.path.exists(self._index_file):
+            with open(self._index_file) as f:
+                self._index = json.load(f)
+
+    def _entry_id(self, location: str, key: str) -> str:
+        return _digest(location, key)[:24]
+
+    def _table_file(self, entry_id: str) -> str:
+        return os.path.join(self.state_dir, "tables", f"{entry_id}.pkl")
+
+    def _save_index(self):
+        os.makedirs(self.state_dir, exist_ok=True)
+        with open(f"{self._index_file}.tmp", "w") as f:
+            json.dump(self._index, f, indent=1)
+        os.replace(f"{self._index_file}.tmp", self._index_file)
+
+    def is_current(self, location: str, key: str = "") -> bool:
+        """Check whether `location` was processed (as `key`) with
+        its current signature."""
+        signature = self.signatures.get(location)
+        entry = self._index.get(self._entry_id(location, key))
+        return (
+            signature is not None
+            and entry is not None
+            and entry["signature"] == signature
+        )
+
+    def record(self, location: str, key: str = ""):
+        """Mark `location` as processed (as `key`) with its current signature."""
+        if location not in self.signatures:
+            return
+        with self._lock:
+            self._index[self._entry_id(location, key)] = {
+                "location": location,
+                "key": key,
+                "signature": self.signatures[location],
+            }
+            self._save_index()
+
+    def load(self, location: str, **read_args) -> Optional[pd.DataFrame]:
+        """Load the table saved for a file, if it is still current.
+
+        Parameters
+        ----------
+        location : str
+            /path/to/file or URL
+        **read_args
+            Arguments the file is read with (e.g. usecols, dtype)
+
+        Returns
+        -------
+        Optional[pd.DataFrame]
+            Saved table, or None if the file must be read
+        """
+        key = _digest(read_args)
+        table_file = self._table_file(self._entry_id(location, key))
+        if not self.is_current(location, key) or not os.path.exists(table_file):
+            return None
+        return pd.read_pickle(table_file)
+
+    def save(self, location: str, df: pd.DataFrame, **read_args):
+        """Save the table read from a file (see `load`)."""
+        if location not in self.signatures:
+            return
+        key = _digest(read_args)
+        table_file = self._table_file(self._entry_id(location, key))
+        os.makedirs(os.path.dirname(table_file), exist_ok=True)
+        df.to_pickle(f"{table_file}.tmp")
+        os.replace(f"{table_file}.tmp", table_file)
+        self.record(location, key)
+
+    def prune(self):
+        """Drop saved tables of files no longer in the build."""
+        with self._lock:
+            for entry_id, entry in list(self._index.items()):
+                if entry["location"] in self.signatures:
+                    continue
+                del self._index[entry_id]
+                table_file = self._table_file(entry_id)
+                if os.path.exists(table_file):
+                    os.remove(table_file)
+            self._save_index()
@@ -120,11 +120,43 @@ REQUIRED_BMD_COLUMNS = {
         "AUC_Norm",
         "DataQC_Flag",
         "BMD_Analysis_Flag",
+        "BMDL10",
+        "BMDU10",
     ],
     "doseRep": ["Chemical_ID", "End_Point", "Dose", "Response", "CI_Lo", "CI_Hi"],
     "fitVals": ["Chemical_ID", "End_Point", "X_vals", "Y_vals"],
 }
 
+# BMD columns that only some files have (bootstrap BMD10 limits, see
+# zfBmd --bootstrap); they are NA for files without them
+OPTIONAL_BMD_COLUMNS = ["BMDL10", "BMDU10"]
+
+# Known types of BMD columns (passed to the CSV parser so that
+# these columns are not type-inferred). Every column of
+# REQUIRED_BMD_COLUMNS has one, so streamed combines need not scan
+# files for types first (see `src.tableio.write_unique_csv`); IDs
+# are nullable integers and flags floats, as they may be missing
+BMD_COLUMN_DTYPES = {
+    "Chemical_ID": "Int64",
+    "End_Point": str,
+    "Model": str,
+    "BMD10": float,
+    "BMD50": float,
+    "Min_Dose": float,
+    "Max_Dose": float,
+    "AUC_Norm": float,
+    "DataQC_Flag": float,
+    "BMD_Analysis_Flag": float,
+    "BMDL10": float,
+    "BMDU10": float,
+    "Dose": float,
+    "Response": float,
+    "CI_Lo": float,
+    "CI_Hi": float,
+    "X_vals": float,
+    "Y_vals": float,
+}
+
 # Define MASV mapping params
 MASV_SOURCE = [
     "pharmacological",
@@ -0,0 +1,466 @@
+# =========================================================
+# Imports
+# =========================================================
+import os
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from functools import lru_cache
+from typing import Any, Optional, Union
+
+import numpy as np
+import pandas as pd
+import yaml
+
+from .tableio import read_table
+
+SCHEMA_FILE = os.path.join(
+    os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "srpAnalytics.yaml"
+)
+
+# Map LinkML types to the checks run on each column
+TYPE_CHECKS = {
+    "string": "string",
+    "str": "string",
+    "uri": "string",
+    "uriorcurie": "string",
+    "ncname": "string",
+    "date": "string",
+    "datetime": "string",
+    "integer": "integer",
+    "int": "integer",
+    "float": "float",
+    "double": "float",
+    "decimal": "float",
+    "boolean": "boolean",
+    "bool": "boolean",
+}
+BOOLEAN_VALUES = {"true", "false", "True", "False", "TRUE", "FALSE", "1", "0"}
+
+# Number of example rows listed for each issue
+MAX_EXAMPLES = 5
+
+# #################################
+# Schema validation
+#
+# The LinkML schema (srpAnalytics.yaml) is compiled once into
+# per-column checks for each class, which are then run on
+# whole columns of a table instead of row by row.
+# #################################
+
+
+@dataclass
+class SlotCheck:
+    """Checks for a single column of a schema class.
+
+    Parameters
+    ----------
+    name : str
+        Slot (column) name
+    check : str
+        One of ["any", "string", "integer", "float", "boolean", "enum"]
+    required : bool, optional
+        If True, every row must have a value, by default False
+    minimum : Optional[float], optional
+        Minimum allowed value, by default None
+    maximum : Optional[float], optional
+        Maximum allowed value, by default None
+    values : Optional[list[str]], optional
+        Permissible values (for enums), by default None
+    """
+
+    name: str
+    check: str
+    required: bool = False
+    minimum: Optional[float] = None
+    maximum: Optional[float] = None
+    values: Optional[list[str]] = None
+
+
+@dataclass
+class ValidationIssue:
+    """Single failed check.
+
+    Parameters
+    ----------
+    column : str
+        Column that failed (empty for table-level issues)
+    check : str
+        Name of the failed check (e.g. "required", "integer")
+    count : int
+        Number of failing rows (0 for column-level issues)
+    message : str
+        Description of the issue
+    examples : list[int], optional
+        File line numbers of up to MAX_EXAMPLES failing rows, by default []
+    """
+
+    column: str
+    check: str
+    count: int
+    message: str
+    examples: list[int] = field(default_factory=list)
+
+
+@dataclass
+class ValidationReport:
+    """Validation results for one file.
+
+    Parameters
+    ----------
+    file : str
+        /path/to/validated/file
+    target_class : str
+        Schema class the file was validated against
+    rows : int, optional
+        Number of rows validated, by default 0
+    issues : list[ValidationIssue], optional
+        Failed checks, by default []
+    """
+
+    file: str
+    target_class: str
+    rows: int = 0
+    issues: list[ValidationIssue] = field(default_factory=list)
+
+    @property
+    def ok(self) -> bool:
+        return not self.issues
+
+    def to_dict(self) -> dict[str, Any]:
+        return {**asdict(self), "ok": self.ok}
+
+    def summary(self) -> str:
+        status = "OK" if self.ok else f"{len(self.issues)} issue(s)"
+        lines = [f"{self.file} [{self.target_class}, {self.rows} rows]: {status}"]
+        for issue in self.issues:
+            lines.append(f"  - {issue.message}")
+        return "\n".join(lines)
+
+
+def _slot_check(
+    name: str, definition: Optional[dict], default_range: str, enums: dict
+) -> SlotCheck:
+    definition = definition or dict()
+    rng = definition.get("range") or default_range
+    rng = rng.split(":")[-1]  # e.g. linkml:Any -> Any
+
+    values = None
+    if rng in enums:
+        check = "enum"
+        values = [str(v) for v in (enums[rng] or {}).get("permissible_values", {})]
+    else:
+        check = TYPE_CHECKS.get(rng.lower(), "any")
+
+    return SlotCheck(
+        name=name,
+        check=check,
+        required=bool(definition.get("required") or definition.get("identifier")),
+        minimum=definition.get("minimum_value"),
+        maximum=definition.get("maximum_value"),
+        values=values,
+    )
+
+
+@lru_cache(maxsize=None)
+def compile_schema(schema_file: str = SCHEMA_FILE) -> dict[str, list[SlotCheck]]:
+    """Compile a LinkML schema into column checks for each class.
+
+    Supports class slots, attributes, slot_usage and is_a
+    inheritance; slot ranges may be LinkML types or enums.
+
+    Parameters
+    ----------
+    schema_file : str, optional
+        /path/to/schema.yaml, by default SCHEMA_FILE
+
+    Returns
+    -------
+    dict[str, list[SlotCheck]]
+        Class name -> list of column checks
+    """
+    with open(schema_file) as f:
+        schema = yaml.safe_load(f)
+
+    default_range = schema.get("default_range", "string")
+    slots = schema.get("slots") or dict()
+    classes = schema.get("classes") or dict()
+    enums = schema.get("enums") or dict()
+
+    def class_slots(name: str) -> dict[str, dict]:
+        cls = classes.get(name) or dict()
+        defs = class_slots(cls["is_a"]) if cls.get("is_a") else dict()
+        for slot in cls.get("slots") or []:
+            defs[slot] = dict(slots.get(slot) or {})
+        for slot, definition in (cls.get("attributes") or {}).items():
+            defs[slot] = dict(definition or {})
+        for slot, usage in (cls.get("slot_usage") or {}).items():
+            defs[slot] = {**defs.get(slot, {}), **(usage or {})}
+        return defs
+
+    return {
+        name: [
+            _slot_check(slot, definition, default_range, enums)
+            for slot, definition in class_slots(name).items()
+        ]
+        for name in classes
+    }
+
+
+def _failures(
+    issues: list[ValidationIssue],
+    col: pd.Series,
+    mask: pd.Series,
+    check: str,
+    message: str,
+):
+    count = int(mask.sum())
+    if count:
+        rows = np.flatnonzero(mask.to_numpy())[:MAX_EXAMPLES]
+        example = col.iloc[rows[0]]
+        if pd.notna(example):
+            message = f"{message} (e.g. {example!r})"
+        issues.append(
+            ValidationIssue(
+                column=col.name,
+                check=check,
+                count=count,
+                message=f"{col.name}: {count} {message}",
+                examples=(rows + 2).tolist(),  # header is line 1
+            )
+        )
+
+
+def validate_table(
+    df: pd.DataFrame, target_class: str, schema_file: str = SCHEMA_FILE
+) -> list[ValidationIssue]:
+    """Validate a table against a schema class.
+
+    Values are checked as they appear in CSV files: empty cells
+    are missing, and integer columns accept integral floats
+    (e.g. "2.0") since pandas writes integers with missing
+    values that way.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Table to validate; best read with `dtype=str`
+    target_class : str
+        Name of class in schema (e.g. "zfBMDS")
+    schema_file : str, optional
+        /path/to/schema.yaml, by default SCHEMA_FILE
+
+    Returns
+    -------
+    list[ValidationIssue]
+        Failed checks (empty if valid)
+
+    Raises
+    ------
+    ValueError
+        If `target_class` is not in the schema
+    """
+    checks = compile_schema(schema_file)
+    if target_class not in checks:
+        raise ValueError(f"Class '{target_class}' not found in {schema_file}")
+    checks = {c.name: c for c in checks[target_class]}
+
+    issues = list()
+    unknown = [col for col in df.columns if col not in checks]
+    if unknown:
+        issues.append(
+            ValidationIssue(
+                "", "columns", 0, f"Columns not in class {target_class}: {unknown}"
+            )
+        )
+
+    for name, check in checks.items():
+        if name not in df.columns:
+            if check.required:
+                issues.append(
+                    ValidationIssue(name, "required", 0, f"{name}: missing column")
+                )
+            continue
+
+        col = df[name]
+        present = col.notna()
+        if check.required:
+            _failures(issues, col, ~present, "required", "rows missing a value")
+
+        numeric = check.minimum is not None or check.maximum is not None
+        if check.check in ["integer", "float"] or numeric:
+            nums = pd.to_numeric(col, errors="coerce")
+            _failures(
+                issues, col, present & nums.isna(), check.check, "non-numeric values"
+            )
+            if check.check == "integer":
+                _failures(
+                    issues,
+                    col,
+                    nums.notna() & (nums % 1 != 0),
+                    "integer",
+                    "non-integer values",
+                )
+            if check.minimum is not None:
+                _failures(
+                    issues,
+                    col,
+                    nums < check.minimum,
+                    "minimum_value",
+                    f"values below {check.minimum}",
+                )
+            if check.maximum is not None:
+                _failures(
+                    issues,
+                    col,
+                    nums > check.maximum,
+                    "maximum_value",
+                    f"values above {check.maximum}",
+                )
+        elif check.check == "boolean":
+            _failures(
+                issues,
+                col,
+                present & ~col.astype(str).isin(BOOLEAN_VALUES),
+                "boolean",
+                "non-boolean values",
+            )
+        elif check.check == "enum":
+            _failures(
+                issues,
+                col,
+                present & ~col.astype(str).isin(check.values),
+                "enum",
+                f"values not in {check.values}",
+            )
+
+    return issues
+
+
+def apply_schema_types(
+    df: pd.DataFrame, target_class: Optional[str], schema_file: str = SCHEMA_FILE
+) -> pd.DataFrame:
+    """Give a table typed columns for binary (Parquet/Feather) output.
+
+    Columns the schema class declares as integer or float are
+    converted when every value converts losslessly (integers with
+    missing values become nullable "Int64"); other columns keep
+    their type. Object columns mixing types (e.g. numbers and
+    strings) are stored as strings.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Table to convert
+    target_class : Optional[str]
+        Name of class in schema (e.g. "chemicals"); if None or not
+        in the schema, only mixed object columns are converted
+    schema_file : str, optional
+        /path/to/schema.yaml, by default SCHEMA_FILE
+
+    Returns
+    -------
+    pd.DataFrame
+        Table with typed columns
+    """
+    checks = {
+        c.name: c.check for c in compile_schema(schema_file).get(target_class, [])
+    }
+
+    df = df.copy()
+    for name in df.columns:
+        col = df[name]
+        if checks.get(name) in ["integer", "float"]:
+            nums = pd.to_numeric(col, errors="coerce")
+            if not (nums.isna() & col.notna()).any():
+                if checks[name] == "integer" and (nums.dropna() % 1 == 0).all():
+                    nums = nums.astype("Int64")
+                df[name] = col = nums
+
+        if col.dtype == object and pd.api.types.infer_dtype(col) not in [
+            "string",
+            "empty",
+            "boolean",
+            "integer",
+            "floating",
+            "mixed-integer-float",
+        ]:
+            df[name] = col.where(col.isna(), col.astype(str))
+    return df
+
+
+def validate_file(
+    filename: str, target_class: Optional[str] = None, schema_file: str = SCHEMA_FILE
+) -> ValidationReport:
+    """Validate an output table against a schema class.
+
+    Parameters
+    ----------
+    filename : str
+        /path/to/file (.csv, .parquet or .feather)
+    target_class : Optional[str], optional
+        Name of class in schema; if None, the file basename
+        (e.g. "samples" for samples.csv) is used, by default None
+    schema_file : str, optional
+        /path/to/schema.yaml, by default SCHEMA_FILE
+
+    Returns
+    -------
+    ValidationReport
+        Validation results
+    """
+    if target_class is None:
+        target_class = os.path.basename(filename).split(".")[0]
+    report = ValidationReport(file=filename, target_class=target_class)
+
+    try:
+        if filename.endswith(".csv"):
+            df = pd.read_csv(filename, dtype=str, keep_default_na=False, na_values=[""])
+        else:
+            # Binary tables are already typed; categoricals come from
+            # partition columns
+            df = read_table(filename)
+            df = df.apply(
+                lambda c: (
+                    c.astype(object) if isinstance(c.dtype, pd.CategoricalDtype) else c
+                )
+            )
+        report.rows = len(df)
+        report.issues = validate_table(df, target_class, schema_file)
+    except Exception as e:
+        report.issues = [ValidationIssue("", "read", 0, f"Could not validate: {e}")]
+    return report
+
+
+def validate_files(
+    files: Union[list[str], dict[str, str]],
+    schema_file: str = SCHEMA_FILE,
+    max_workers: Optional[int] = None,
+) -> list[ValidationReport]:
+    """Validate several CSV files in parallel.
+
+    Parameters
+    ----------
+    files : Union[list[str], dict[str, str]]
+        List of files (validated against the class named after
+        each file), or file -> target class
+    schema_file : str, optional
+        /path/to/schema.yaml, by default SCHEMA_FILE
+    max_workers : Optional[int], optional
+        Number of files to validate at once, by default None
+        (see concurrent.futures.ThreadPoolExecutor)
+
+    Returns
+    -------
+    list[ValidationReport]
+        One report per file, in input order
+    """
+    if not isinstance(files, dict):
+        files = {f: None for f in files}
+    compile_schema(schema_file)  # compile once before fanning out
+
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        futures = [
+            pool.submit(validate_file, f, target, schema_file)
+            for f, target in files.items()
+        ]
+        return [future.result() for future in futures]
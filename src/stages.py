@@ -0,0 +1,194 @@
+# =========================================================
+# Imports
+# =========================================================
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from dataclasses import dataclass, field
+from typing import Any, Callable, Optional
+
+from tqdm import tqdm
+
+from .telemetry import stage as telemetry_stage
+
+# #################################
+# Build stages
+#
+# Each workflow in build_script.py is modeled as a stage with
+# declared inputs and outputs. A stage depends on every other
+# stage that produces one of its inputs (or that it lists in
+# `depends_on`), and independent stages run at the same time.
+# #################################
+
+
+@dataclass
+class Stage:
+    """Single unit of work in the build pipeline.
+
+    Parameters
+    ----------
+    name : str
+        Unique stage name (e.g. "samps", "expo")
+    func : Callable
+        Function that runs the stage; called as `func(**kwargs)`
+    inputs : list[str], optional
+        Files (or URLs) the stage reads, by default []
+    outputs : list[str], optional
+        Files the stage writes, by default []
+    depends_on : list[str], optional
+        Names of stages that must finish first regardless of
+        inputs/outputs, by default []
+    kwargs : dict, optional
+        Keyword arguments passed to `func`, by default {}
+    params : dict, optional
+        JSON-serializable parameters that change the stage's outputs;
+        used with `code` and `inputs` to build its cache key, by default {}
+    code : list[str], optional
+        Source files the stage runs; edits invalidate cached
+        outputs, by default []
+    cache : bool, optional
+        If True, outputs may be restored from a `StageCache` when
+        nothing changed, by default False
+    validate : Optional[Callable], optional
+        Called with `outputs` after they are restored from a
+        `StageCache` (e.g. a schema check), since `func`, which
+        validates fresh outputs, is then not run, by default None
+    """
+
+    name: str
+    func: Callable
+    inputs: list[str] = field(default_factory=list)
+    outputs: list[str] = field(default_factory=list)
+    depends_on: list[str] = field(default_factory=list)
+    kwargs: dict[str, Any] = field(default_factory=dict)
+    params: dict[str, Any] = field(default_factory=dict)
+    code: list[str] = field(default_factory=list)
+    cache: bool = False
+    validate: Optional[Callable] = None
+
+
+def resolve_dependencies(stages: list[Stage]) -> dict[str, set[str]]:
+    """Map each stage to the names of the stages it must wait for.
+
+    Parameters
+    ----------
+    stages : list[Stage]
+        Stages to schedule
+
+    Returns
+    -------
+    dict[str, set[str]]
+        Stage name -> set of upstream stage names
+
+    Raises
+    ------
+    ValueError
+        If stage names are duplicated, a dependency is unknown,
+        or the dependencies contain a cycle.
+    """
+    names = [s.name for s in stages]
+    if len(names) != len(set(names)):
+        raise ValueError(f"Duplicate stage names: {names}")
+
+    producers = dict()
+    for s in stages:
+        for out in s.outputs:
+            producers.setdefault(out, set()).add(s.name)
+
+    deps = dict()
+    for s in stages:
+        upstream = set(s.depends_on)
+        for inp in s.inputs:
+            upstream |= producers.get(inp, set())
+        upstream.discard(s.name)
+
+        unknown = upstream - set(names)
+        if unknown:
+            raise ValueError(f"Stage '{s.name}' depends on unknown stages {unknown}")
+        deps[s.name] = upstream
+
+    # Check for cycles (Kahn's algorithm)
+    remaining = {k: set(v) for k, v in deps.items()}
+    while remaining:
+        ready = [k for k, v in remaining.items() if not v]
+        if not ready:
+            raise ValueError(f"Cyclic stage dependencies: {sorted(remaining)}")
+        for k in ready:
+            del remaining[k]
+        for v in remaining.values():
+            v.difference_update(ready)
+
+    return deps
+
+
+def _run_stage(stage: Stage, cache=None) -> Any:
+    with telemetry_stage(stage.name, cache=cache is not None and stage.cache):
+        if cache is not None and stage.cache:
+            return cache.run(stage)
+        return stage.func(**stage.kwargs)
+
+
+def run_stages(
+    stages: list[Stage], max_workers: Optional[int] = None, cache=None
+) -> dict[str, Any]:
+    """Run stages in dependency order, with independent stages in parallel.
+
+    Stages run on a bounded thread pool; the heavy lifting in each
+    stage happens in subprocesses, external tools or pandas, so
+    threads are sufficient to overlap them. If a stage raises, no
+    new stages are started and the error is re-raised once running
+    stages finish. Each stage is measured with `src.telemetry`.
+
+    Parameters
+    ----------
+    stages : list[Stage]
+        Stages to run
+    max_workers : Optional[int], optional
+        Maximum number of stages to run at once,
+            by default len(stages) (i.e. no limit)
+    cache : Optional[src.cache.StageCache], optional
+        If given, stages with `cache=True` are restored from it
+        when their inputs are unchanged, by default None
+
+    Returns
+    -------
+    dict[str, Any]
+        Stage name -> return value of its function
+    """
+    if not stages:
+        return dict()
+
+    deps = resolve_dependencies(stages)
+    by_name = {s.name: s for s in stages}
+    if max_workers is None:
+        max_workers = len(stages)
+
+    results, running = dict(), dict()
+    pending = [s.name for s in stages]
+    error = None
+
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as pool:
+        while pending or running:
+            # Submit every stage whose upstream stages have finished
+            if error is None:
+                for name in [n for n in pending if deps[n] <= results.keys()]:
+                    stage = by_name[name]
+                    tqdm.write(f"Starting stage '{name}'...")
+                    future = pool.submit(_run_stage, stage, cache)
+                    running[future] = name
+                    pending.remove(name)
+
+            if not running:
+                break
+
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                name = running.pop(future)
+                try:
+                    results[name] = future.result()
+                    tqdm.write(f"Stage '{name}' done!")
+                except Exception as e:
+                    tqdm.write(f"Stage '{name}' failed: {e}")
+                    error = error or e
+
+    if error is not None:
+        raise error
+    return results
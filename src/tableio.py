@@ -0,0 +1,439 @@
+# =========================================================
+# Imports
+# =========================================================
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+
+import numpy as np
+import pandas as pd
+from pandas.api.types import is_bool_dtype, is_numeric_dtype
+from tqdm import tqdm
+
+# Output format -> file extension
+OUTPUT_FORMATS = {"csv": ".csv", "parquet": ".parquet", "feather": ".feather"}
+
+# Compression codec of binary outputs
+COMPRESSION = "zstd"
+
+# Partitioned Parquet outputs are split on this column, if they
+# have at least PARTITION_MIN_ROWS rows
+PARTITION_COLUMN = "Chemical_ID"
+PARTITION_MIN_ROWS = 1_000_000
+
+# Rows per chunk when streaming files (see `write_unique_csv`)
+CHUNK_ROWS = 500_000
+
+# Second key of the 128-bit row hashes of `write_unique_csv`
+# (the first is pandas' default)
+HASH_KEY = "srpanalytics0128"
+
+# #################################
+# Multi-file readers
+#
+# Build inputs are spread over many CSV files (see
+# srp_build_files.csv), most of which hold far more columns
+# than are used. Files are read concurrently, and only the
+# required columns are parsed.
+# #################################
+
+
+def _parsed_columns(usecols: Optional[list[str]], optional: list[str]):
+    # `usecols` for `pd.read_csv`; with optional columns, a callable, so
+    # that files without them are read in one pass instead of rejected
+    # (files are not probed for their header first: for URLs that would
+    # download them twice)
+    if usecols is None or not optional:
+        return usecols
+    wanted = set(usecols)
+    return lambda col: col in wanted
+
+
+def _select_columns(
+    df: pd.DataFrame, usecols: Optional[list[str]], optional: list[str] = []
+) -> pd.DataFrame:
+    # Columns in requested order; missing optional columns are all NA
+    if usecols is None:
+        return df
+    missing = [col for col in usecols if col not in df and col not in optional]
+    if missing:
+        raise ValueError(f"Missing required columns: {missing}")
+    return df.reindex(columns=list(usecols))
+
+
+def _read_csv(
+    path: str,
+    usecols: Optional[list[str]] = None,
+    dtype: Optional[dict] = None,
+    optional: list[str] = [],
+    **kwargs,
+) -> pd.DataFrame:
+    if dtype is not None and usecols is not None:
+        dtype = {col: t for col, t in dtype.items() if col in usecols}
+    df = pd.read_csv(
+        path, usecols=_parsed_columns(usecols, optional), dtype=dtype, **kwargs
+    )
+
+    # `usecols` keeps file order; return columns in requested order
+    return _select_columns(df, usecols, optional)
+
+
+def _union_categories(tables: list[pd.DataFrame]) -> list[pd.DataFrame]:
+    # Concatenating categoricals with different categories gives
+    # object columns; give each column the union of categories first
+    for col in tables[0].columns:
+        dtypes = [t[col].dtype if col in t else None for t in tables]
+        if not all(isinstance(d, pd.CategoricalDtype) for d in dtypes):
+            continue
+        categories = pd.Index(
+            pd.concat([d.categories.to_series() for d in dtypes]).unique()
+        )
+        for t in tables:
+            t[col] = t[col].cat.set_categories(categories)
+    return tables
+
+
+def read_csv_files(
+    paths: list[str],
+    usecols: Optional[list[str]] = None,
+    dtype: Optional[dict] = None,
+    max_workers: Optional[int] = None,
+    ignore_index: bool = False,
+    errors: str = "raise",
+    state=None,
+    optional: list[str] = [],
+    **kwargs,
+) -> pd.DataFrame:
+    """Read and concatenate CSV files in parallel.
+
+    Parameters
+    ----------
+    paths : list[str]
+        List of /path/to/file or URLs
+    usecols : Optional[list[str]], optional
+        Columns to parse; other columns are skipped by the
+        parser, by default None (all columns)
+    dtype : Optional[dict], optional
+        Column -> dtype for columns with known types, by default None
+    max_workers : Optional[int], optional
+        Number of files to read at once, by default None
+        (see concurrent.futures.ThreadPoolExecutor)
+    ignore_index : bool, optional
+        Passed to `pd.concat`, by default False
+    errors : str, optional
+        One of ["raise", "warn"]; if "warn", unreadable files are
+        reported and skipped, by default "raise"
+    state : Optional[src.incremental.BuildState], optional
+        If given, files unchanged since a previous build are loaded
+        from it instead of parsed, and newly read files are saved
+        to it, by default None
+    optional : list[str], optional
+        Columns of `usecols` that files may lack; they are filled
+        with NA instead of raising an error, by default []
+    **kwargs
+        Additional keyword arguments for `pd.read_csv`
+
+    Returns
+    -------
+    pd.DataFrame
+        Concatenated table, in the order of `paths`; categorical
+        columns stay categorical
+
+    Raises
+    ------
+    ValueError
+        If `errors` is not one of ["raise", "warn"]
+    """
+    if errors not in ["raise", "warn"]:
+        raise ValueError("Invalid errors. Must be 'raise' or 'warn'.")
+
+    read_args = {"usecols": usecols, "dtype": dtype, **kwargs}
+    if optional:
+        read_args["optional"] = list(optional)
+
+    def read(path):
+        if state is not None:
+            df = state.load(path, **read_args)
+            if df is not None:
+                return df
+        try:
+            df = _read_csv(path, **read_args)
+        except Exception as e:
+            if errors == "raise":
+                raise
+            tqdm.write(f"Error reading {path}: {e}")
+            return None
+        if state is not None:
+            state.save(path, df, **read_args)
+        return df
+
+    paths = list(paths)
+    if len(paths) > 1 and max_workers != 1:
+        with ThreadPoolExecutor(max_workers=max_workers) as pool:
+            tables = list(pool.map(read, paths))
+    else:
+        tables = [read(p) for p in paths]
+
+    tables = [t for t in tables if t is not None]
+    if not tables:
+        return pd.DataFrame(columns=usecols)
+    return pd.concat(_union_categories(tables), ignore_index=ignore_index)
+
+
+def _infer_dtypes(
+    path: str,
+    usecols,
+    declared: dict,
+    chunksize: int = CHUNK_ROWS,
+    **kwargs,
+) -> dict:
+    # Types `pd.read_csv` infers for the parsed columns without a
+    # `declared` type when reading the whole file, found chunk by chunk:
+    # chunks of one numeric kind combine to the wider type (int with
+    # NA -> float), any text gives strings
+    dtypes = dict()
+    for chunk in pd.read_csv(path, usecols=usecols, chunksize=chunksize, **kwargs):
+        for col in chunk.columns.difference(list(declared), sort=False):
+            t = chunk[col].dtype
+            if col not in dtypes:
+                dtypes[col] = t
+            elif dtypes[col] != t:
+                if is_numeric_dtype(dtypes[col]) and is_numeric_dtype(t):
+                    dtypes[col] = np.result_type(dtypes[col], t)
+                else:
+                    dtypes[col] = np.dtype(object)
+    return {col: str if t == object else t for col, t in dtypes.items()}
+
+
+def _row_hashes(chunk: pd.DataFrame) -> pd.Series:
+    # 128-bit row hashes, from two 64-bit hashes with different keys.
+    # Numbers are hashed as floats, so 1 and 1.0 are equal, as they
+    # are once int and float columns are concatenated in memory
+    chunk = chunk.apply(
+        lambda col: (
+            col.astype(float)
+            if is_numeric_dtype(col) and not is_bool_dtype(col)
+            else col
+        )
+    )
+    lo = pd.util.hash_pandas_object(chunk, index=False)
+    hi = pd.util.hash_pandas_object(chunk, index=False, hash_key=HASH_KEY)
+    return pd.Series(
+        [(h << 64) | l for h, l in zip(hi.tolist(), lo.tolist())],
+        index=chunk.index,
+    )
+
+
+def write_unique_csv(
+    paths: list[str],
+    output: str,
+    usecols: Optional[list[str]] = None,
+    dtype: Optional[dict] = None,
+    chunksize: int = CHUNK_ROWS,
+    optional: list[str] = [],
+    **kwargs,
+) -> tuple[int, int]:
+    """Stream CSV files into one CSV file without duplicate rows.
+
+    Files are read in chunks and rows are compared by a 128-bit hash
+    of their values, so memory grows with the number of unique rows
+    (one hash each, plus set overhead) rather than with the size of
+    the inputs. The first occurrence of each row is kept, as in
+    `read_csv_files(...).drop_duplicates()` with the same `dtype`:
+    columns without a given dtype are first scanned to find the type
+    `pd.read_csv` would infer for the whole file (an extra read of
+    it), and every chunk of that file is then parsed with it. A hash
+    collision would drop a
+    unique row; at 128 bits this is not expected to happen (about
+    1e-21 for a billion unique rows).
+
+    Parameters
+    ----------
+    paths : list[str]
+        List of /path/to/file or URLs
+    output : str
+        /path/to/output.csv
+    usecols : Optional[list[str]], optional
+        Columns to parse, by default None (all columns)
+    dtype : Optional[dict], optional
+        Column -> dtype for columns with known types, by default None
+    chunksize : int, optional
+        Rows per chunk, by default CHUNK_ROWS
+    optional : list[str], optional
+        Columns of `usecols` that files may lack; they are filled
+        with NA instead of raising an error, by default []
+    **kwargs
+        Additional keyword arguments for `pd.read_csv`
+
+    Returns
+    -------
+    tuple[int, int]
+        Number of rows read and written
+    """
+    dtype = dtype or dict()
+    if usecols is not None:
+        dtype = {col: t for col, t in dtype.items() if col in usecols}
+    seen = set()
+    rows_in, rows_out = 0, 0
+    header = True
+
+    with open(output, "w", newline="") as f:
+        for path in paths:
+            columns = _parsed_columns(usecols, optional)
+            file_dtype = dtype
+            if usecols is None or any(col not in dtype for col in usecols):
+                file_dtype = {
+                    **dtype,
+                    **_infer_dtypes(path, columns, dtype, chunksize, **kwargs),
+                }
+
+            reader = pd.read_csv(
+                path,
+                usecols=columns,
+                dtype=file_dtype,
+                chunksize=chunksize,
+                **kwargs,
+            )
+            for chunk in reader:
+                chunk = _select_columns(chunk, usecols, optional)
+                rows_in += len(chunk)
+
+                hashes = _row_hashes(chunk)
+                keep = ~hashes.duplicated().to_numpy()
+                keep &= [h not in seen for h in hashes.tolist()]
+                chunk = chunk[keep]
+                seen.update(hashes[keep].tolist())
+
+                chunk.to_csv(f, index=False, header=header)
+                rows_out += len(chunk)
+                header = False
+
+        if header:
+            pd.DataFrame(columns=usecols).to_csv(f, index=False)
+
+    return rows_in, rows_out
+
+
+# #################################
+# Output tables
+#
+# Portal tables are written as CSV by default, or as typed,
+# compressed Parquet/Feather files. The format is taken from the
+# file extension (see `output_path`).
+# #################################
+
+
+def output_path(output_dir: str, name: str, output_format: str = "csv") -> str:
+    """Get the path of an output table.
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory to save output
+    name : str
+        Table name (e.g. "chemicals")
+    output_format : str, optional
+        One of ["csv", "parquet", "feather"], by default "csv"
+
+    Returns
+    -------
+    str
+        {output_dir}/{name}.{ext}
+
+    Raises
+    ------
+    ValueError
+        If `output_format` is not supported
+    """
+    if output_format not in OUTPUT_FORMATS:
+        raise ValueError(
+            f"Invalid output_format. Must be one of {list(OUTPUT_FORMATS)}."
+        )
+    return os.path.join(output_dir, f"{name}{OUTPUT_FORMATS[output_format]}")
+
+
+def write_table(
+    df: pd.DataFrame,
+    path: str,
+    target_class: Optional[str] = None,
+    partition: bool = False,
+) -> str:
+    """Write an output table in the format given by its extension.
+
+    CSV files are written as before (quoted with '"'). Parquet and
+    Feather files get typed columns (see
+    `src.schema.apply_schema_types`) and zstd compression.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Table to write
+    path : str
+        /path/to/table.{csv,parquet,feather}
+    target_class : Optional[str], optional
+        Schema class used to type columns, by default None
+        (the file basename, e.g. "chemicals")
+    partition : bool, optional
+        If True, Parquet tables with a PARTITION_COLUMN and at
+        least PARTITION_MIN_ROWS rows are written as a directory
+        partitioned by that column, by default False
+
+    Returns
+    -------
+    str
+        `path`
+    """
+    if path.endswith(".csv"):
+        df.to_csv(path, index=False, quotechar='"')
+        return path
+
+    from .schema import apply_schema_types
+
+    if target_class is None:
+        target_class = os.path.basename(path).split(".")[0]
+    df = apply_schema_types(df, target_class).reset_index(drop=True)
+
+    # Replace previous outputs (a file, or a partitioned directory)
+    if os.path.isdir(path):
+        shutil.rmtree(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+    if path.endswith(".parquet"):
+        if partition and PARTITION_COLUMN in df and len(df) >= PARTITION_MIN_ROWS:
+            df.to_parquet(
+                path,
+                index=False,
+                compression=COMPRESSION,
+                partition_cols=[PARTITION_COLUMN],
+            )
+        else:
+            df.to_parquet(path, index=False, compression=COMPRESSION)
+    elif path.endswith(".feather"):
+        df.to_feather(path, compression=COMPRESSION)
+    else:
+        raise ValueError(f"Unsupported output table: {path}")
+    return path
+
+
+def read_table(path: str, **kwargs) -> pd.DataFrame:
+    """Read an output table written by `write_table`.
+
+    Parameters
+    ----------
+    path : str
+        /path/to/table.{csv,parquet,feather}
+    **kwargs
+        Additional keyword arguments for the pandas reader
+
+    Returns
+    -------
+    pd.DataFrame
+        Table
+    """
+    if path.endswith(".parquet"):
+        return pd.read_parquet(path, **kwargs)
+    if path.endswith(".feather"):
+        return pd.read_feather(path, **kwargs)
+    return pd.read_csv(path, **kwargs)
@@ -0,0 +1,353 @@
+# =========================================================
+# Imports
+# =========================================================
+import json
+import os
+import platform
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from datetime import datetime, timezone
+from typing import Any, Optional
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+# Interval (seconds) between memory samples while a stage runs
+SAMPLE_INTERVAL = 0.05
+
+# Prefix of Prometheus metric names
+METRIC_PREFIX = "srp_stage"
+
+# #################################
+# Stage telemetry
+#
+# Each instrumented step of the build (e.g. a build stage, or
+# loading the mapping inputs) is timed and measured with
+# `stage(...)`. Stages may be nested and may run at the same
+# time in different threads; process-wide counters (I/O, CPU
+# of child processes) then overlap between concurrent stages.
+# #################################
+
+
+@dataclass
+class StageRecord:
+    """Measurements of a single stage.
+
+    Parameters
+    ----------
+    name : str
+        Stage name (e.g. "samps", "map:load_inputs")
+    parent : Optional[str], optional
+        Name of the enclosing stage, by default None
+    started : str, optional
+        Start time (ISO 8601, UTC), by default ""
+    status : str, optional
+        One of ["running", "ok", "error"], by default "running"
+    wall_s : float, optional
+        Wall time in seconds, by default 0.0
+    cpu_s : float, optional
+        CPU time of the stage's thread in seconds, by default 0.0
+    children_cpu_s : float, optional
+        CPU time of child processes (e.g. process pools,
+        subprocesses) that finished during the stage, by default 0.0
+    peak_rss_bytes : int, optional
+        Peak resident memory of the process while the stage
+        ran, by default 0
+    children_peak_rss_bytes : int, optional
+        Peak resident memory of the largest child process that
+        finished so far, by default 0
+    read_bytes : int, optional
+        Bytes read by the process (files and network), by default 0
+    write_bytes : int, optional
+        Bytes written by the process, by default 0
+    rows_in : int, optional
+        Rows read by the stage, by default 0
+    rows_out : int, optional
+        Rows written by the stage, by default 0
+    extra : dict[str, Any], optional
+        Other stage-specific values, by default {}
+    """
+
+    name: str
+    parent: Optional[str] = None
+    started: str = ""
+    status: str = "running"
+    wall_s: float = 0.0
+    cpu_s: float = 0.0
+    children_cpu_s: float = 0.0
+    peak_rss_bytes: int = 0
+    children_peak_rss_bytes: int = 0
+    read_bytes: int = 0
+    write_bytes: int = 0
+    rows_in: int = 0
+    rows_out: int = 0
+    extra: dict[str, Any] = field(default_factory=dict)
+
+    def add_rows_in(self, data: Any):
+        """Count input rows (a number or anything with a length)."""
+        self.rows_in += data if isinstance(data, int) else len(data)
+
+    def add_rows_out(self, data: Any):
+        """Count output rows (a number or anything with a length)."""
+        self.rows_out += data if isinstance(data, int) else len(data)
+
+
+def _rss_bytes() -> int:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, IndexError):
+        return _maxrss_bytes()
+
+
+def _maxrss_bytes(who: Optional[int] = None) -> int:
+    if resource is None:
+        return 0
+    usage = resource.getrusage(resource.RUSAGE_SELF if who is None else who)
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    scale = 1 if sys.platform == "darwin" else 1024
+    return usage.ru_maxrss * scale
+
+
+def _children_cpu_s() -> float:
+    if resource is None:
+        return 0.0
+    usage = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return usage.ru_utime + usage.ru_stime
+
+
+def _io_bytes() -> tuple[int, int]:
+    try:
+        with open("/proc/self/io") as f:
+            io = dict(line.split(": ") for line in f.read().splitlines())
+        return int(io["rchar"]), int(io["wchar"])
+    except (OSError, KeyError, ValueError):
+        return 0, 0
+
+
+class Telemetry:
+    """Collects stage records for one run (e.g. a build).
+
+    Parameters
+    ----------
+    name : str, optional
+        Run name, used in output filenames and metric labels,
+            by default "build"
+    """
+
+    def __init__(self, name: str = "build"):
+        self.name = name
+        self.records = list()
+        self._lock = threading.Lock()
+        self._active = dict()  # record id -> record
+        self._local = threading.local()
+        self._sampler = None
+
+    # -----------------
+    # Memory sampling
+    # -----------------
+    def _sample(self):
+        while True:
+            with self._lock:
+                if not self._active:
+                    self._sampler = None
+                    return
+                rss = _rss_bytes()
+                for rec in self._active.values():
+                    rec.peak_rss_bytes = max(rec.peak_rss_bytes, rss)
+            time.sleep(SAMPLE_INTERVAL)
+
+    def _activate(self, rec: StageRecord):
+        with self._lock:
+            self._active[id(rec)] = rec
+            rec.peak_rss_bytes = _rss_bytes()
+            if self._sampler is None:
+                self._sampler = threading.Thread(target=self._sample, daemon=True)
+                self._sampler.start()
+
+    def _deactivate(self, rec: StageRecord):
+        with self._lock:
+            self._active.pop(id(rec), None)
+            rec.peak_rss_bytes = max(rec.peak_rss_bytes, _rss_bytes())
+
+    # -----------------
+    # Recording
+    # -----------------
+    @contextmanager
+    def stage(self, name: str, **extra):
+        """Measure the enclosed block as a stage.
+
+        Parameters
+        ----------
+        name : str
+            Stage name
+        **extra
+            Stage-specific values to record
+
+        Yields
+        ------
+        StageRecord
+            Record to add row counts (or other values) to
+        """
+        stack = getattr(self._local, "stack", None)
+        if stack is None:
+            stack = self._local.stack = list()
+
+        rec = StageRecord(
+            name=name,
+            parent=stack[-1].name if stack else None,
+            started=datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            extra=dict(extra),
+        )
+        with self._lock:
+            self.records.append(rec)
+
+        stack.append(rec)
+        self._activate(rec)
+        wall, cpu, child_cpu = (
+            time.perf_counter(),
+            time.thread_time(),
+            _children_cpu_s(),
+        )
+        rchar, wchar = _io_bytes()
+        try:
+            yield rec
+            rec.status = "ok"
+        except BaseException:
+            rec.status = "error"
+            raise
+        finally:
+            rec.wall_s = time.perf_counter() - wall
+            rec.cpu_s = time.thread_time() - cpu
+            rec.children_cpu_s = _children_cpu_s() - child_cpu
+            rec.children_peak_rss_bytes = _maxrss_bytes(
+                resource.RUSAGE_CHILDREN if resource else None
+            )
+            end_rchar, end_wchar = _io_bytes()
+            rec.read_bytes, rec.write_bytes = end_rchar - rchar, end_wchar - wchar
+            self._deactivate(rec)
+            stack.pop()
+
+    def add_records(self, records: list[StageRecord]):
+        """Add stage records measured elsewhere (e.g. in a worker process)."""
+        with self._lock:
+            self.records.extend(records)
+
+    # -----------------
+    # Output
+    # -----------------
+    def to_dict(self) -> dict[str, Any]:
+        with self._lock:
+            stages = [asdict(rec) for rec in self.records]
+        return {
+            "run": self.name,
+            "created": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+            "host": platform.node(),
+            "python": platform.python_version(),
+            "argv": sys.argv,
+            "cpu_count": os.cpu_count(),
+            "peak_rss_bytes": _maxrss_bytes(),
+            "stages": stages,
+        }
+
+    def to_prometheus(self) -> str:
+        """Format stage records as Prometheus text exposition."""
+        metrics = {
+            "wall_seconds": ("wall_s", "Wall time of stage"),
+            "cpu_seconds": ("cpu_s", "CPU time of stage thread"),
+            "children_cpu_seconds": (
+                "children_cpu_s",
+                "CPU time of child processes during stage",
+            ),
+            "peak_rss_bytes": ("peak_rss_bytes", "Peak resident memory during stage"),
+            "read_bytes": ("read_bytes", "Bytes read during stage"),
+            "write_bytes": ("write_bytes", "Bytes written during stage"),
+            "rows_in": ("rows_in", "Rows read by stage"),
+            "rows_out": ("rows_out", "Rows written by stage"),
+        }
+        with self._lock:
+            records = list(self.records)
+
+        lines = list()
+        for metric, (attr, desc) in metrics.items():
+            lines.append(f"# HELP {METRIC_PREFIX}_{metric} {desc}")
+            lines.append(f"# TYPE {METRIC_PREFIX}_{metric} gauge")
+            for rec in records:
+                labels = f'run="{self.name}",stage="{rec.name}",status="{rec.status}"'
+                lines.append(
+                    f"{METRIC_PREFIX}_{metric}{{{labels}}} {getattr(rec, attr)}"
+                )
+        return "\n".join(lines) + "\n"
+
+    def write(self, output_dir: str, prometheus: bool = False) -> list[str]:
+        """Write records to {output_dir}/telemetry_{name}.json
+        (and telemetry_{name}.prom, if requested).
+
+        Parameters
+        ----------
+        output_dir : str
+            Directory to save output
+        prometheus : bool, optional
+            If True, also write a Prometheus textfile, by default False
+
+        Returns
+        -------
+        list[str]
+            Paths to the written files
+        """
+        os.makedirs(output_dir, exist_ok=True)
+        outputs = [
+            (f"telemetry_{self.name}.json", json.dumps(self.to_dict(), indent=2))
+        ]
+        if prometheus:
+            outputs.append((f"telemetry_{self.name}.prom", self.to_prometheus()))
+
+        paths = list()
+        for fname, content in outputs:
+            path = os.path.join(output_dir, fname)
+            # Textfile collectors need atomic writes
+            with open(f"{path}.tmp", "w") as f:
+                f.write(content)
+            os.replace(f"{path}.tmp", path)
+            paths.append(path)
+        return paths
+
+
+# Records of the current process; library code records into
+# this so that in-process callers (e.g. build_script.py running
+# the sample mapping) get one combined report
+TELEMETRY = Telemetry()
+
+
+def stage(name: str, **extra):
+    """Measure a stage of the current process (see `Telemetry.stage`)."""
+    return TELEMETRY.stage(name, **extra)
+
+
+def write_telemetry(
+    output_dir: str, name: Optional[str] = None, prometheus: bool = False
+) -> list[str]:
+    """Write the current process's stage records (see `Telemetry.write`).
+
+    Parameters
+    ----------
+    output_dir : str
+        Directory to save output
+    name : Optional[str], optional
+        Run name; if given, replaces the default ("build"), by default None
+    prometheus : bool, optional
+        If True, also write a Prometheus textfile, by default False
+
+    Returns
+    -------
+    list[str]
+        Paths to the written files
+    """
+    if name is not None:
+        TELEMETRY.name = name
+    return TELEMETRY.write(output_dir, prometheus=prometheus)
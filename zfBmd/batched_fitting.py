@@ -0,0 +1,1344 @@
+#############
+## IMPORTS ##
+#############
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass
+from typing import Callable
+
+import numpy as np
+import pandas as pd
+from bmdrc import model_fitting
+from bmdrc.model_fitting import _removed_endpoints_stats
+from scipy import special
+
+# Fit the same models, with the same start values, bounds, goodness of fit
+# test and model selection as bmdrc (see bmdrc.model_fitting), but fit every
+# curve with the same number of concentrations at once. Each model's
+# likelihood is maximized for a whole batch of curves with numpy array
+# operations, so the Python overhead is paid per batch rather than per curve.
+# Curves whose fits or BMDLs do not converge are refit with bmdrc, which is used
+# instead where it gives other results.
+
+# Benchmark responses
+BMR = 0.1
+BMR_50 = 0.5
+
+# The BMDL is where the profile log-likelihood drops by chi2.ppf(0.9, 1) / 2
+BMDL_LLF_DROP = special.chdtri(1, 0.1) / 2
+
+# BMDL bisection settings (as in bmdrc.model_fitting.Calculate_BMDL)
+BMDL_MAX_ITERATIONS = 100
+BMDL_TOLERANCE = 1e-4
+
+# Maximum likelihood settings: at most MAX_STEPS damped Fisher scoring steps,
+# stopping once a step improves the negative log-likelihood by less than
+# FTOL (relative). Fits that stop otherwise (e.g. when no damped step
+# improves it, at the precision of its finite differences) converged if a
+# full scoring step is expected to improve it by at most STALL_TOL (relative)
+MAX_STEPS = 200
+FTOL = 1e-12
+STALL_TOL = 1e-8
+
+# Relative step of the finite differences of response probabilities
+DIFF_STEP = 1e-6
+
+# Fits whose Fisher information has a larger condition number stopped on a
+# flat ridge of the likelihood (e.g. a sigmoid moved outside the doses),
+# where the optimum is not determined, and count as not converged
+MAX_CONDITION = 1e12
+
+# Curves with a fit or BMDL that did not converge are refit with bmdrc (see
+# `_bmdrc_select`); bmdrc's fits are used where it selects another model, or
+# a BMD10, BMD50 or BMDL that differs by more than BMD_RTOL (relative)
+BMD_RTOL = 1e-3
+
+# Bootstrap settings: replicates per curve, percentiles of the replicate
+# BMD10s reported as BMDL10 and BMDU10 (a two-sided 90% interval, as the
+# BMDL is a one-sided 95% limit), and the number of replicate curves fit
+# at once (which bounds memory)
+BOOTSTRAP_REPLICATES = 1000
+BOOTSTRAP_PERCENTILES = [5, 95]
+BOOTSTRAP_BATCH_ROWS = 50_000
+
+
+##########################
+## MODELS & LIKELIHOODS ##
+##########################
+
+
+def _cols(theta: np.ndarray) -> list[np.ndarray]:
+    # Columns of a (curves, parameters) array, shaped to broadcast with doses
+    return [theta[:, [i]] for i in range(theta.shape[1])]
+
+
+def _log_dose(dose: np.ndarray) -> np.ndarray:
+    return np.log(np.where(dose == 0, 1e-9, dose))
+
+
+def _ols(x: np.ndarray, y: np.ndarray, intercept: bool) -> tuple:
+    # Least squares fit of y ~ [1, x] or y ~ [x, x^2] per curve (row).
+    # As in bmdrc, inv(X'X) X' is applied to y last, so that a single
+    # infinite y gives infinite (not NA) start values
+    if intercept:
+        x1, x2 = np.ones_like(x), x
+    else:
+        x1, x2 = x, x**2
+    s11, s12, s22 = (x1 * x1).sum(1), (x1 * x2).sum(1), (x2 * x2).sum(1)
+    det = (s11 * s22 - s12**2)[:, None]
+    c1 = (s22[:, None] * x1 - s12[:, None] * x2) / det
+    c2 = (s11[:, None] * x2 - s12[:, None] * x1) / det
+    return (c1 * y).sum(1), (c2 * y).sum(1)
+
+
+@dataclass(frozen=True)
+class BatchedModel:
+    """A dose-response model, evaluated for a batch of curves.
+
+    Parameters
+    ----------
+    prob : Callable
+        (doses, params) -> response probabilities, where doses are a
+        (curves, concentrations) array and params a (curves,
+        parameters) array
+    start : Callable
+        (doses, fractions affected) -> start params
+    lower : list[float]
+        Lower bound of each parameter
+    upper : list[float]
+        Upper bound of each parameter
+    bmd : Callable
+        (params, benchmark response) -> benchmark doses
+    profile_prob : Callable
+        (doses, free params, BMDs) -> response probabilities of the
+        model parameterized by its BMD (for the BMDL)
+    profile_start : list[int]
+        Parameters the profile likelihood fit starts from
+    profile_bounds : Callable
+        params -> lower and upper bounds of the free profile params
+    """
+
+    prob: Callable
+    start: Callable
+    lower: list[float]
+    upper: list[float]
+    bmd: Callable
+    profile_prob: Callable
+    profile_start: list[int]
+    profile_bounds: Callable
+
+
+def _fixed_bounds(lower: list[float], upper: list[float]) -> Callable:
+    return lambda theta: (
+        np.broadcast_to(np.array(lower, dtype=float), (len(theta), len(lower))),
+        np.broadcast_to(np.array(upper, dtype=float), (len(theta), len(upper))),
+    )
+
+
+## LOGISTIC ##
+
+
+def _logistic(dose, theta):
+    alpha, beta = _cols(theta)
+    return 1 / (1 + np.exp(-alpha - beta * dose))
+
+
+def _logistic_start(dose, frac):
+    mu = dose.mean(1)
+    s = np.sqrt(3) * dose.std(1) / np.pi
+    return np.stack([-mu / s, 1 / s], 1)
+
+
+def _logistic_bmd(theta, bmr):
+    alpha, beta = theta.T
+    return np.log((1 + np.exp(-alpha) * bmr) / (1 - bmr)) / beta
+
+
+def _logistic_profile(dose, free, bmdl):
+    (alpha,) = _cols(free)
+    p_0 = 1 / (1 + np.exp(-alpha))
+    chi = (1 - p_0) * BMR + p_0
+    beta = -(alpha + np.log((1 - chi) / chi)) / bmdl[:, None]
+    return 1 / (1 + np.exp(-alpha - beta * dose))
+
+
+## GAMMA ##
+
+
+def _gamma(dose, theta):
+    g, alpha, beta = _cols(theta)
+    return g + (1 - g) * special.gammainc(alpha, beta * dose)
+
+
+def _gamma_start(dose, frac):
+    beta = dose.mean(1) / dose.var(1)
+    alpha = dose.mean(1) * beta
+    return np.stack([np.full(len(dose), 0.1), alpha, beta], 1)
+
+
+def _gamma_bmd(theta, bmr):
+    g, alpha, beta = theta.T
+    return special.gammaincinv(alpha, bmr) / beta
+
+
+def _gamma_profile(dose, free, bmdl):
+    g, alpha = _cols(free)
+    beta = special.gammaincinv(alpha, BMR) / bmdl[:, None]
+    return g + (1 - g) * special.gammainc(alpha, beta * dose)
+
+
+## WEIBULL ##
+
+
+def _weibull(dose, theta):
+    g, alpha, beta = _cols(theta)
+    return g + (1 - g) * (1 - np.exp(-beta * dose**alpha))
+
+
+def _weibull_start(dose, frac):
+    b0, b1 = _ols(np.log(dose[:, 1:]), np.log(-np.log(1 - frac[:, 1:])), True)
+    return np.stack([np.full(len(dose), 0.1), b1, np.exp(b0)], 1)
+
+
+def _weibull_bmd(theta, bmr):
+    g, alpha, beta = theta.T
+    return (-np.log(1 - bmr) / beta) ** (1 / alpha)
+
+
+def _weibull_profile(dose, free, bmdl):
+    g, alpha = _cols(free)
+    beta = -np.log(1 - BMR) / (bmdl[:, None] ** alpha)
+    return g + (1 - g) * (1 - np.exp(-beta * dose**alpha))
+
+
+## LOG-LOGISTIC ##
+
+
+def _log_logistic(dose, theta):
+    g, alpha, beta = _cols(theta)
+    return g + (1 - g) / (1 + np.exp(-alpha - beta * _log_dose(dose)))
+
+
+def _log_logistic_start(dose, frac):
+    log_dose = np.log(dose[:, 1:])
+    mu = log_dose.mean(1)
+    s = np.sqrt(3) * log_dose.std(1) / np.pi
+    return np.stack([np.full(len(dose), 0.1), -mu / s, 1 / s], 1)
+
+
+def _log_logistic_bmd(theta, bmr):
+    g, alpha, beta = theta.T
+    return np.exp((np.log(bmr / (1 - bmr)) - alpha) / beta)
+
+
+def _log_logistic_profile(dose, free, bmdl):
+    g, beta = _cols(free)
+    alpha = np.log(BMR / (1 - BMR)) - beta * np.log(bmdl[:, None])
+    return g + (1 - g) / (1 + np.exp(-alpha - beta * _log_dose(dose)))
+
+
+def _log_logistic_profile_bounds(theta):
+    # The slope may change by at most a factor of two
+    g_bounds = np.broadcast_to([1e-5, 0.99], (len(theta), 2))
+    beta = theta[:, 2]
+    return (
+        np.stack([g_bounds[:, 0], beta / 2], 1),
+        np.stack([g_bounds[:, 1], beta * 2], 1),
+    )
+
+
+## PROBIT ##
+
+
+def _probit(dose, theta):
+    alpha, beta = _cols(theta)
+    return special.ndtr(alpha + beta * dose)
+
+
+def _probit_start(dose, frac):
+    alpha = special.ndtri(frac[:, 0])
+    beta = (special.ndtri(frac[:, -1]) - alpha) / dose[:, -1]
+    return np.stack([alpha, beta], 1)
+
+
+def _probit_bmd(theta, bmr):
+    alpha, beta = theta.T
+    p_0 = special.ndtr(alpha)
+    return (special.ndtri(p_0 + (1 - p_0) * bmr) - alpha) / beta
+
+
+def _probit_profile(dose, free, bmdl):
+    (alpha,) = _cols(free)
+    p_0 = special.ndtr(alpha)
+    beta = (special.ndtri((1 - p_0) * BMR + p_0) - alpha) / bmdl[:, None]
+    return special.ndtr(alpha + beta * dose)
+
+
+## LOG PROBIT ##
+
+
+def _log_probit(dose, theta):
+    g, alpha, beta = _cols(theta)
+    return g + (1 - g) * special.ndtr(alpha + beta * _log_dose(dose))
+
+
+def _log_probit_start(dose, frac):
+    # As in bmdrc, a line through the second and last doses (not log doses)
+    y_1, y_n = special.ndtri(1 - frac[:, 1]), special.ndtri(1 - frac[:, -1])
+    beta = (y_n - y_1) / (dose[:, -1] - dose[:, 1])
+    alpha = y_1 - beta * dose[:, 1]
+    beta = np.where(beta > 1e-5, beta, 1e-5)
+    return np.stack([np.full(len(dose), 0.1), alpha, beta], 1)
+
+
+def _log_probit_bmd(theta, bmr):
+    g, alpha, beta = theta.T
+    return np.exp((special.ndtri(bmr) - alpha) / beta)
+
+
+def _log_probit_profile(dose, free, bmdl):
+    g, alpha = _cols(free)
+    beta = (special.ndtri(BMR) - alpha) / np.log(bmdl[:, None])
+    return g + (1 - g) * special.ndtr(alpha + beta * _log_dose(dose))
+
+
+## MULTISTAGE 2 ##
+
+
+def _multistage_2(dose, theta):
+    g, beta1, beta2 = _cols(theta)
+    return g + (1 - g) * (1 - np.exp(-(beta1 * dose) - (beta2 * dose**2)))
+
+
+def _multistage_2_start(dose, frac):
+    beta1, beta2 = _ols(dose[:, 1:], -np.log(1 - frac[:, 1:]), False)
+    return np.stack([np.full(len(dose), 0.05), beta1, beta2], 1)
+
+
+def _multistage_2_bmd(theta, bmr):
+    g, beta1, beta2 = theta.T
+    return (-beta1 + np.sqrt(beta1**2 - 4 * beta2 * np.log(1 - bmr))) / (2 * beta2)
+
+
+def _multistage_2_profile(dose, free, bmdl):
+    g, beta1 = _cols(free)
+    bmdl = bmdl[:, None]
+    beta2 = -(np.log(1 - BMR) + beta1 * bmdl) / bmdl**2
+    return g + (1 - g) * (1 - np.exp(-(beta1 * dose) - (beta2 * dose**2)))
+
+
+## QUANTAL LINEAR ##
+
+
+def _quantal_linear(dose, theta):
+    g, beta = _cols(theta)
+    return g + (1 - g) * (1 - np.exp(-beta * dose))
+
+
+def _quantal_linear_start(dose, frac):
+    return np.stack([np.full(len(dose), 0.1), 1 / dose.mean(1) / np.log(2)], 1)
+
+
+def _quantal_linear_bmd(theta, bmr):
+    g, beta = theta.T
+    return -np.log(1 - bmr) / beta
+
+
+def _quantal_linear_profile(dose, free, bmdl):
+    (g,) = _cols(free)
+    beta = -np.log(1 - BMR) / bmdl[:, None]
+    return g + (1 - g) * (1 - np.exp(-beta * dose))
+
+
+# Models in bmdrc's order, which breaks ties in model selection
+MODELS = {
+    "Logistic": BatchedModel(
+        _logistic,
+        _logistic_start,
+        [-np.inf, 1e-5],
+        [np.inf, np.inf],
+        _logistic_bmd,
+        _logistic_profile,
+        [0],
+        _fixed_bounds([-np.inf], [np.inf]),
+    ),
+    "Gamma": BatchedModel(
+        _gamma,
+        _gamma_start,
+        [1e-5, 0.2, 1e-5],
+        [0.99, 18, np.inf],
+        _gamma_bmd,
+        _gamma_profile,
+        [0, 1],
+        _fixed_bounds([1e-5, 0.2], [0.99, 18]),
+    ),
+    "Weibull": BatchedModel(
+        _weibull,
+        _weibull_start,
+        [1e-5, 1e-5, 1e-9],
+        [0.99, np.inf, np.inf],
+        _weibull_bmd,
+        _weibull_profile,
+        [0, 1],
+        _fixed_bounds([1e-5, 1e-5], [0.99, np.inf]),
+    ),
+    "Log Logistic": BatchedModel(
+        _log_logistic,
+        _log_logistic_start,
+        [1e-5, -np.inf, -np.inf],
+        [0.99, np.inf, np.inf],
+        _log_logistic_bmd,
+        _log_logistic_profile,
+        [0, 2],
+        _log_logistic_profile_bounds,
+    ),
+    "Probit": BatchedModel(
+        _probit,
+        _probit_start,
+        [-np.inf, 1e-5],
+        [np.inf, np.inf],
+        _probit_bmd,
+        _probit_profile,
+        [0],
+        _fixed_bounds([-np.inf], [np.inf]),
+    ),
+    "Log Probit": BatchedModel(
+        _log_probit,
+        _log_probit_start,
+        [1e-5, -np.inf, 1e-5],
+        [0.99, np.inf, np.inf],
+        _log_probit_bmd,
+        _log_probit_profile,
+        [0, 1],
+        _fixed_bounds([1e-9, -np.inf], [0.99, np.inf]),
+    ),
+    "Multistage2": BatchedModel(
+        _multistage_2,
+        _multistage_2_start,
+        [1e-9, 1e-9, 1e-9],
+        [0.99, np.inf, np.inf],
+        _multistage_2_bmd,
+        _multistage_2_profile,
+        [0, 1],
+        _fixed_bounds([1e-9, 1e-9], [0.99, np.inf]),
+    ),
+    "Quantal Linear": BatchedModel(
+        _quantal_linear,
+        _quantal_linear_start,
+        [1e-5, 1e-5],
+        [0.99, np.inf],
+        _quantal_linear_bmd,
+        _quantal_linear_profile,
+        [0],
+        _fixed_bounds([1e-5], [0.99]),
+    ),
+}
+
+
+def _nll(probs: np.ndarray, affected: np.ndarray, total: np.ndarray) -> np.ndarray:
+    # Binomial negative log-likelihood of each curve (without the constant)
+    log_lhood = affected * np.log(probs) + (total - affected) * np.log(1 - probs)
+    return -log_lhood.sum(1)
+
+
+def _score_and_information(
+    prob: Callable,
+    theta: np.ndarray,
+    dose: np.ndarray,
+    affected: np.ndarray,
+    total: np.ndarray,
+    *args,
+) -> tuple[np.ndarray, np.ndarray]:
+    # Gradient and Fisher information of the negative log-likelihood of
+    # each curve, from central differences of the response probabilities
+    n_params = theta.shape[1]
+    p = np.clip(prob(dose, theta, *args), 1e-12, 1 - 1e-12)
+    step = DIFF_STEP * np.maximum(np.abs(theta), 1)
+    jac = np.empty(dose.shape + (n_params,))
+    for j in range(n_params):
+        e = np.zeros_like(theta)
+        e[:, j] = step[:, j]
+        jac[:, :, j] = (prob(dose, theta + e, *args) - prob(dose, theta - e, *args)) / (
+            2 * step[:, [j]]
+        )
+    grad = np.einsum("bi,bij->bj", (total - affected) / (1 - p) - affected / p, jac)
+    info = np.einsum("bi,bij,bik->bjk", total / (p * (1 - p)), jac, jac)
+    return grad, info
+
+
+def _expected_improvement(
+    prob: Callable,
+    theta: np.ndarray,
+    lower: np.ndarray,
+    upper: np.ndarray,
+    dose: np.ndarray,
+    affected: np.ndarray,
+    total: np.ndarray,
+    *args,
+) -> np.ndarray:
+    # Decrease of each curve's negative log-likelihood that a full scoring
+    # step is expected to give (half the squared Newton decrement), with
+    # parameters on bounds held as in `_maximize_likelihood`; inf if the
+    # derivatives are not finite
+    n_params = theta.shape[1]
+    grad, info = _score_and_information(prob, theta, dose, affected, total, *args)
+    free = ~(((theta <= lower) & (grad > 0)) | ((theta >= upper) & (grad < 0)))
+    grad = np.where(free, grad, 0)
+    info *= free[:, :, None] & free[:, None, :]
+    info += np.eye(n_params) * (1e-12 + ~free)[:, None, :]
+
+    improvement = np.full(len(theta), np.inf)
+    finite = np.isfinite(info).all((1, 2)) & np.isfinite(grad).all(1)
+    if finite.any():
+        step = np.linalg.solve(info[finite], grad[finite][..., None])[..., 0]
+        improvement[finite] = (grad[finite] * step).sum(1) / 2
+    return improvement
+
+
+def _condition_numbers(info: np.ndarray) -> np.ndarray:
+    # Condition number of each curve's information matrix (inf if singular
+    # or not finite)
+    cond = np.full(len(info), np.inf)
+    finite = np.isfinite(info).all((1, 2))
+    if finite.any():
+        with np.errstate(all="ignore"):
+            cond[finite] = np.linalg.cond(info[finite])
+    return np.nan_to_num(cond, nan=np.inf)
+
+
+def _maximize_likelihood(
+    prob: Callable,
+    theta: np.ndarray,
+    lower: np.ndarray,
+    upper: np.ndarray,
+    dose: np.ndarray,
+    affected: np.ndarray,
+    total: np.ndarray,
+    *args,
+) -> tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """Maximize the likelihood of a batch of curves within bounds.
+
+    Each curve takes damped Fisher scoring (Levenberg-Marquardt)
+    steps, projected onto the bounds; parameters on a bound that
+    the gradient points past are held. Curves stop independently:
+    they converge once a step improves the likelihood by less than
+    FTOL (relative) or the projected step is zero. Curves that stop
+    otherwise (at MAX_STEPS, when no damped step improves the
+    likelihood, or where its derivatives are not finite) converged
+    only if a full step is expected to improve the likelihood by at
+    most STALL_TOL (relative). Start values are clipped to the
+    bounds, and curves that start with a non-finite likelihood keep
+    their start values (and do not converge).
+
+    Parameters
+    ----------
+    prob : Callable
+        (doses, params, *args) -> response probabilities
+    theta : np.ndarray
+        Start params, (curves, parameters)
+    lower : np.ndarray
+        Lower bounds, broadcastable to `theta`
+    upper : np.ndarray
+        Upper bounds, broadcastable to `theta`
+    dose : np.ndarray
+        Concentrations, (curves, concentrations)
+    affected : np.ndarray
+        Number affected at each concentration
+    total : np.ndarray
+        Number of non-NA samples at each concentration
+    *args
+        Additional per-curve arrays passed to `prob`
+
+    Returns
+    -------
+    tuple[np.ndarray, np.ndarray, np.ndarray]
+        Fitted params, the maximum log-likelihood and its shortfall
+        of each curve: 0 if the fit converged, otherwise the expected
+        improvement of a full step (inf if not finite)
+    """
+    lower = np.broadcast_to(lower, theta.shape)
+    upper = np.broadcast_to(upper, theta.shape)
+    theta = np.clip(theta, lower, upper)
+    n_params = theta.shape[1]
+
+    with np.errstate(all="ignore"):
+        nll = _nll(prob(dose, theta, *args), affected, total)
+        damping = np.full(len(theta), 1e-3)
+        active = np.isfinite(nll) & np.isfinite(theta).all(1)
+        converged = np.zeros(len(theta), dtype=bool)
+        shortfall = np.full(len(theta), np.inf)
+
+        for _ in range(MAX_STEPS):
+            idx = np.flatnonzero(active)
+            if not len(idx):
+                break
+            t, lo, hi = theta[idx], lower[idx], upper[idx]
+            d, y, n = dose[idx], affected[idx], total[idx]
+            a = [arg[idx] for arg in args]
+
+            # Gradient and Fisher information of the negative log-likelihood
+            grad, info = _score_and_information(prob, t, d, y, n, *a)
+            free = ~(((t <= lo) & (grad > 0)) | ((t >= hi) & (grad < 0)))
+            grad = np.where(free, grad, 0)
+            info *= free[:, :, None] & free[:, None, :]
+            diag = np.diagonal(info, axis1=1, axis2=2)
+            info += (
+                np.eye(n_params)
+                * (damping[idx, None] * diag + 1e-12 + ~free)[:, None, :]
+            )
+
+            invalid = ~(np.isfinite(info).all((1, 2)) & np.isfinite(grad).all(1))
+            info[invalid], grad[invalid] = np.eye(n_params), 0
+            delta = np.linalg.solve(info, -grad[..., None])[..., 0]
+
+            # Take steps that lower the negative log-likelihood
+            candidate = np.clip(t + delta, lo, hi)
+            nll_candidate = _nll(prob(d, candidate, *a), y, n)
+            better = nll_candidate < nll[idx]
+            done = (
+                better
+                & (nll[idx] - nll_candidate <= FTOL * (1 + np.abs(nll_candidate)))
+                & (damping[idx] < 1)
+            ) | ((candidate == t).all(1) & ~invalid)
+            theta[idx[better]] = candidate[better]
+            nll[idx[better]] = nll_candidate[better]
+            damping[idx] = np.where(better, damping[idx] / 10, damping[idx] * 10)
+
+            stuck = invalid | (damping[idx] > 1e10)
+            converged[idx[done]] = True
+            active[idx[done | stuck]] = False
+
+        stalled = np.flatnonzero(~converged & np.isfinite(nll))
+        if len(stalled):
+            improvement = _expected_improvement(
+                prob,
+                theta[stalled],
+                lower[stalled],
+                upper[stalled],
+                dose[stalled],
+                affected[stalled],
+                total[stalled],
+                *[arg[stalled] for arg in args],
+            )
+            shortfall[stalled] = improvement
+            converged[stalled] = improvement <= STALL_TOL * (1 + np.abs(nll[stalled]))
+        shortfall[converged] = 0
+
+    return theta, -nll, shortfall
+
+
+###########################
+## BATCHED MODEL FITTING ##
+###########################
+
+
+def _bmdl(
+    model: BatchedModel,
+    theta: np.ndarray,
+    llf: np.ndarray,
+    bmd10: np.ndarray,
+    dose: np.ndarray,
+    affected: np.ndarray,
+    total: np.ndarray,
+) -> tuple[np.ndarray, np.ndarray]:
+    """Benchmark dose lower confidence limits of a batch of curves.
+
+    As in bmdrc.model_fitting.Calculate_BMDL, the BMDL is found by
+    bisection between BMD10 / 10 and BMD10, fitting the model
+    parameterized by the BMD at each step, for all curves at once.
+    Also returns whether each curve's bisection converged: whether
+    no profile fit that fell short of the likelihood threshold could
+    still reach it (see the shortfall of `_maximize_likelihood`).
+    """
+    with np.errstate(all="ignore"):
+        threshold = llf - BMDL_LLF_DROP
+        low, high = bmd10 / 10, bmd10.copy()
+        lower, upper = model.profile_bounds(theta)
+        start = theta[:, model.profile_start]
+
+    # bmdrc returns NA where the fit raises, i.e. for invalid bounds
+    bmdl = np.full(len(theta), np.nan)
+    active = ~(lower > upper).any(1)
+    converged = np.ones(len(theta), dtype=bool)
+
+    for iteration in range(1, BMDL_MAX_ITERATIONS + 1):
+        idx = np.flatnonzero(active)
+        if not len(idx):
+            break
+        if iteration == BMDL_MAX_ITERATIONS:
+            bmdl[idx] = np.nan
+            break
+        bmdl[idx] = (low[idx] + high[idx]) / 2
+        _, profile_llf, shortfall = _maximize_likelihood(
+            model.profile_prob,
+            start[idx].copy(),
+            lower[idx],
+            upper[idx],
+            dose[idx],
+            affected[idx],
+            total[idx],
+            bmdl[idx],
+        )
+        with np.errstate(invalid="ignore"):
+            above = profile_llf - threshold[idx] > 0
+            converged[idx] &= above | (profile_llf + shortfall < threshold[idx])
+            high[idx[above]] = bmdl[idx[above]]
+            low[idx[~above]] = bmdl[idx[~above]]
+            active[idx] = np.abs(profile_llf - threshold[idx]) > BMDL_TOLERANCE
+    return bmdl, converged
+
+
+def _fit_batch(
+    dose: np.ndarray, affected: np.ndarray, total: np.ndarray
+) -> dict[str, dict]:
+    """Fit every model to a batch of curves with the same number of doses.
+
+    Parameters
+    ----------
+    dose : np.ndarray
+        Concentrations, in increasing order, (curves, concentrations)
+    affected : np.ndarray
+        Number affected at each concentration, summed over plates
+    total : np.ndarray
+        Number of non-NA samples at each concentration, summed over plates
+
+    Returns
+    -------
+    dict[str, dict]
+        Model name -> params, fitted values, p-values, AICs, BMD10s,
+        BMDLs and whether the fit (and BMDL) of each curve converged
+    """
+    with np.errstate(all="ignore"):
+        frac = affected / total
+
+    fits = dict()
+    for name, model in MODELS.items():
+        with np.errstate(all="ignore"):
+            start = model.start(dose, frac)
+        theta, llf, shortfall = _maximize_likelihood(
+            model.prob,
+            start,
+            np.array(model.lower, dtype=float),
+            np.array(model.upper, dtype=float),
+            dose,
+            affected,
+            total,
+        )
+        with np.errstate(all="ignore"):
+            _, info = _score_and_information(model.prob, theta, dose, affected, total)
+            converged = (shortfall == 0) & (_condition_numbers(info) <= MAX_CONDITION)
+            bmd10 = model.bmd(theta, BMR)
+        bmdl, bmdl_converged = _bmdl(model, theta, llf, bmd10, dose, affected, total)
+
+        # Fits that start at a non-finite likelihood keep their start
+        # values, as bmdrc's do, and are never selected
+        converged = (converged & bmdl_converged) | ~np.isfinite(llf)
+
+        with np.errstate(all="ignore"):
+            fitted = model.prob(dose, theta)
+            chi_squared = (
+                (total / (fitted * (1 - fitted))) * (frac - fitted) ** 2
+            ).sum(1)
+            p_value = special.chdtrc(dose.shape[1] - theta.shape[1], chi_squared)
+            p_value[p_value == 0] = np.nan
+        fits[name] = {
+            "params": theta,
+            "fitted": fitted,
+            "p_value": p_value,
+            "aic": -2 * llf + 2 * theta.shape[1],
+            "bmd10": bmd10,
+            "bmdl": bmdl,
+            "converged": converged,
+        }
+    return fits
+
+
+def _potential_models(
+    p_values: np.ndarray,
+    aics: np.ndarray,
+    gof_threshold: float,
+    aic_threshold: float,
+) -> tuple[np.ndarray, np.ndarray]:
+    # Models that pass the goodness of fit test and have an AIC, and those
+    # of them within `aic_threshold` of the lowest AIC, as (curves, models)
+    # masks
+    with np.errstate(invalid="ignore"):
+        passed = ~np.isnan(p_values) & (p_values >= gof_threshold)
+        has_aic = passed & ~np.isnan(aics)
+        min_aic = np.where(has_aic, aics, np.inf).min(1, keepdims=True)
+        potential = has_aic & (np.abs(aics - min_aic) < aic_threshold)
+    return has_aic, potential
+
+
+def _select_models(
+    p_values: np.ndarray,
+    aics: np.ndarray,
+    bmdls: np.ndarray,
+    gof_threshold: float,
+    aic_threshold: float,
+) -> np.ndarray:
+    """Select a model for each curve, as bmdrc does for "lowest BMDL".
+
+    Models must pass the goodness of fit test and be within
+    `aic_threshold` of the lowest AIC of those that pass; of these,
+    the model with the lowest BMDL (or, if no BMDL is available,
+    the lowest AIC) is selected.
+
+    Parameters
+    ----------
+    p_values, aics, bmdls : np.ndarray
+        (curves, models) arrays, models in the order of MODELS
+
+    Returns
+    -------
+    np.ndarray
+        Position of the selected model of each curve, -1 if none
+        passed
+    """
+    has_aic, potential = _potential_models(p_values, aics, gof_threshold, aic_threshold)
+
+    has_bmdl = potential & ~np.isnan(bmdls)
+    selected = np.where(
+        has_bmdl.any(1),
+        np.where(has_bmdl, bmdls, np.inf).argmin(1),
+        np.where(has_aic, aics, np.inf).argmin(1),
+    )
+    only = potential.sum(1) == 1
+    selected = np.where(only, potential.argmax(1), selected)
+    return np.where(potential.any(1), selected, -1)
+
+
+def _curve_arrays(data: pd.DataFrame, conc: str, ids: list) -> dict:
+    # Counts summed by concentration, grouped into (curves, concentrations)
+    # arrays by number of concentrations
+    summed = (
+        data[["bmdrc.Endpoint.ID", conc, "bmdrc.num.affected", "bmdrc.num.nonna"]]
+        .groupby(["bmdrc.Endpoint.ID", conc])
+        .sum()
+        .reset_index()
+    )
+    values = summed[[conc, "bmdrc.num.affected", "bmdrc.num.nonna"]].to_numpy(
+        dtype=float
+    )
+    positions = summed.groupby("bmdrc.Endpoint.ID", sort=False).indices
+    batches = dict()
+    for endpoint_id in ids:
+        batches.setdefault(len(positions[endpoint_id]), []).append(endpoint_id)
+    return {
+        n_doses: (
+            batch_ids,
+            *values[np.stack([positions[i] for i in batch_ids])].transpose(2, 0, 1),
+        )
+        for n_doses, batch_ids in batches.items()
+    }
+
+
+# bmdrc's model classes and response functions, in the order of MODELS
+BMDRC_MODELS = {
+    "Logistic": (model_fitting.Logistic, model_fitting.logistic_fun),
+    "Gamma": (model_fitting.Gamma, model_fitting.gamma_fun),
+    "Weibull": (model_fitting.Weibull, model_fitting.weibull_fun),
+    "Log Logistic": (model_fitting.Log_Logistic, model_fitting.log_logistic_fun),
+    "Probit": (model_fitting.Probit, model_fitting.probit_fun),
+    "Log Probit": (model_fitting.Log_Probit, model_fitting.log_probit_fun),
+    "Multistage2": (model_fitting.Multistage_2, model_fitting.multistage_2_fun),
+    "Quantal Linear": (
+        model_fitting.Quantal_Linear,
+        model_fitting.quantal_linear_fun,
+    ),
+}
+
+
+def _bmdrc_fits(
+    conc: str, dose: np.ndarray, affected: np.ndarray, total: np.ndarray
+) -> tuple[pd.DataFrame, list[list]]:
+    """Fit every model to one curve with bmdrc.
+
+    Parameters
+    ----------
+    conc : str
+        Name of the concentration column
+    dose, affected, total : np.ndarray
+        Concentrations, number affected and number of non-NA samples
+        of the curve, summed over plates
+
+    Returns
+    -------
+    tuple[pd.DataFrame, list[list]]
+        The curve's data, and for each model (in the order of MODELS)
+        the list bmdrc.model_fitting._select_and_run_models keeps:
+        model object, params, fitted values, p-value, AIC, name, BMD10
+        and BMDL. BMDLs, which take most of bmdrc's fitting time, are
+        None until computed with `_bmdrc_bmdls`.
+    """
+    data = pd.DataFrame(
+        {conc: dose, "bmdrc.num.affected": affected, "bmdrc.num.nonna": total}
+    )
+    fits = list()
+    with np.errstate(all="ignore"):
+        frac = affected / total
+        for name, (model_class, fun) in BMDRC_MODELS.items():
+            model = model_class(data.copy())
+            result = model.fit()
+            fitted = fun(data[conc], result.params)
+            chi_squared = (
+                (total / (fitted * (1 - fitted))) * (frac - fitted) ** 2
+            ).sum()
+            p_value = special.chdtrc(len(dose) - len(result.params), chi_squared)
+            fits.append(
+                [
+                    model,
+                    result.params,
+                    fitted,
+                    np.nan if p_value == 0 else p_value,
+                    -2 * result.llf + 2 * len(result.params),
+                    name,
+                    model_fitting.Calculate_BMD(name, result.params),
+                    None,
+                ]
+            )
+    return data, fits
+
+
+def _bmdrc_bmdls(conc: str, data: pd.DataFrame, fits: list[list], models):
+    # Compute the BMDLs of the given models (positions in `fits`) with bmdrc
+    for k in models:
+        if fits[k][7] is None:
+            model, params, _, _, _, name, bmd10, _ = fits[k]
+            fits[k][7] = model_fitting.Calculate_BMDL(
+                conc,
+                Model=name,
+                FittedModelObj=model,
+                Data=data,
+                BMD10=bmd10,
+                params=params,
+            )
+
+
+def _bmdrc_select(
+    conc: str,
+    data: pd.DataFrame,
+    fits: list[list],
+    gof_threshold: float,
+    aic_threshold: float,
+) -> int:
+    """Select a model of one curve fit with bmdrc, as bmdrc does.
+
+    Only the BMDLs of the models that selection compares are
+    computed.
+
+    Returns
+    -------
+    int
+        Position of the selected model in `fits`, -1 if none passed
+    """
+    p_values = np.array([[fit[3] for fit in fits]])
+    aics = np.array([[fit[4] for fit in fits]])
+    _, potential = _potential_models(p_values, aics, gof_threshold, aic_threshold)
+    _bmdrc_bmdls(conc, data, fits, np.flatnonzero(potential[0]))
+    bmdls = np.array([[np.nan if fit[7] is None else fit[7] for fit in fits]])
+    return _select_models(p_values, aics, bmdls, gof_threshold, aic_threshold)[0]
+
+
+def _bmds(name: str, params: np.ndarray) -> tuple[float, float]:
+    # BMD10 and BMD50 of one curve
+    theta = np.asarray(params, dtype=float)[None, :]
+    with np.errstate(all="ignore"):
+        return MODELS[name].bmd(theta, BMR)[0], MODELS[name].bmd(theta, BMR_50)[0]
+
+
+def _same_fit(fit: list, bmdrc_fit: list) -> bool:
+    # Whether a batched and a bmdrc fit (as in `model_fits[id][1]`) select
+    # the same model, with BMD10, BMD50 and BMDL within BMD_RTOL
+    if fit[5] != bmdrc_fit[5]:
+        return False
+    estimates = [*_bmds(fit[5], fit[1]), fit[7]]
+    bmdrc_estimates = [*_bmds(bmdrc_fit[5], bmdrc_fit[1]), bmdrc_fit[7]]
+    return bool(
+        np.isclose(
+            estimates, bmdrc_estimates, rtol=BMD_RTOL, atol=0, equal_nan=True
+        ).all()
+    )
+
+
+def fit_batched(
+    obj,
+    gof_threshold: float,
+    aic_threshold: float,
+    model_selection: str,
+):
+    """Fit models to filtered data, a batch of curves at a time.
+
+    A replacement for bmdrc's `fit_models` that sets the same
+    attributes. Curves (endpoint IDs) with the same number of
+    concentrations are stacked into arrays and each model is fit
+    to all of them at once, with the same start values, bounds,
+    goodness of fit test, BMDL bisection and model selection as
+    bmdrc. Curves with a fit or BMDL that did not converge (see
+    `_maximize_likelihood` and `_bmdl`), or a fit that stopped on
+    a flat ridge of the likelihood (see MAX_CONDITION), are refit
+    with bmdrc, whose fits are kept where it selects another
+    model, or a BMD10, BMD50 or BMDL that differs by more than
+    BMD_RTOL. Other
+    curves are not refit: where bmdrc's optimizer stops short of
+    the maximum likelihood, their estimates (and selected models)
+    can differ from bmdrc's (see check_fit_engines.py). The
+    fitted statsmodels objects of batched fits are not kept
+    (`model_fits[id][1][0]` is None).
+
+    Parameters
+    ----------
+    obj : BmdrcDataClass
+        Filtered `bmdrc.BinaryClass.BinaryClass` or
+        `bmdrc.LPRClass.LPRClass`
+    gof_threshold : float
+        Minimum goodness of fit p-value
+    aic_threshold : float
+        Models within this AIC of the lowest AIC are compared by BMDL
+    model_selection : str
+        Only "lowest BMDL" is supported
+
+    Raises
+    ------
+    ValueError
+        If `model_selection` is not "lowest BMDL"
+    """
+    if model_selection != "lowest BMDL":
+        raise ValueError("Invalid model_selection. Must be 'lowest BMDL'.")
+
+    ## 1. Summarize filtered endpoints-----------------------------------------------------------
+
+    _removed_endpoints_stats(obj)
+    obj.model_fitting_gof_threshold = gof_threshold
+    obj.model_fitting_aic_threshold = aic_threshold
+    obj.model_fitting_model_selection = model_selection
+
+    plate_groups = obj.plate_groups
+    plate_groups["bmdrc.frac.affected"] = (
+        plate_groups["bmdrc.num.affected"] / plate_groups["bmdrc.num.nonna"]
+    )
+    keep = plate_groups[plate_groups["bmdrc.filter"] == "Keep"]
+    to_fit = keep["bmdrc.Endpoint.ID"].unique().tolist()
+
+    ## 2. Fit and select models, a batch at a time-----------------------------------------------
+
+    names = list(MODELS)
+    model_fits, failed, unconverged = dict(), set(), list()
+    batches = _curve_arrays(keep, obj.concentration, to_fit)
+    for n_doses, (ids, dose, affected, total) in batches.items():
+        print(f"......fitting models for {len(ids)} curves with {n_doses} doses")
+        fits = _fit_batch(dose, affected, total)
+        table = {
+            stat: np.stack([fits[name][stat] for name in names], 1)
+            for stat in ["p_value", "aic", "bmd10", "bmdl", "converged"]
+        }
+        selected = _select_models(
+            table["p_value"], table["aic"], table["bmdl"], gof_threshold, aic_threshold
+        )
+        for i, endpoint_id in enumerate(ids):
+            if not table["converged"][i].all():
+                unconverged.append((endpoint_id, dose[i], affected[i], total[i]))
+            if selected[i] < 0:
+                failed.add(endpoint_id)
+                continue
+            name = names[selected[i]]
+            fit = fits[name]
+            stats = {
+                stat: dict(zip(names, table[stat][i]))
+                for stat in ["p_value", "aic", "bmd10", "bmdl"]
+            }
+            model_fits[endpoint_id] = [
+                stats["p_value"],
+                [
+                    None,
+                    fit["params"][i],
+                    fit["fitted"][i],
+                    fit["p_value"][i],
+                    fit["aic"][i],
+                    name,
+                    fit["bmd10"][i],
+                    fit["bmdl"][i],
+                ],
+                name,
+                stats["aic"],
+                stats["bmd10"],
+                stats["bmdl"],
+            ]
+
+    ## 3. Refit curves that did not converge with bmdrc------------------------------------------
+
+    if unconverged:
+        print(f"......refitting {len(unconverged)} unconverged curves with bmdrc")
+    bmdrc_models = dict()
+    for endpoint_id, dose, affected, total in unconverged:
+        data, fits = _bmdrc_fits(obj.concentration, dose, affected, total)
+        selected = _bmdrc_select(
+            obj.concentration, data, fits, gof_threshold, aic_threshold
+        )
+        fit = model_fits.get(endpoint_id)
+        if selected < 0:
+            if fit is not None:
+                model_fits.pop(endpoint_id)
+                failed.add(endpoint_id)
+            continue
+        if fit is not None and _same_fit(fit[1], fits[selected]):
+            continue
+
+        failed.discard(endpoint_id)
+        _bmdrc_bmdls(obj.concentration, data, fits, range(len(fits)))
+        model_fits[endpoint_id] = [
+            {fit[5]: fit[3] for fit in fits},
+            fits[selected],
+            names[selected],
+            {fit[5]: fit[4] for fit in fits},
+            {fit[5]: fit[6] for fit in fits},
+            {fit[5]: fit[7] for fit in fits},
+        ]
+        bmdrc_models[endpoint_id] = fits[selected][0]
+    if bmdrc_models:
+        print(f"......using bmdrc's fits of {len(bmdrc_models)} curves")
+    obj.model_fits = {i: model_fits[i] for i in to_fit if i in model_fits}
+    if failed:
+        obj.failed_pvalue_test = [i for i in to_fit if i in failed]
+
+    ## 4. Calculate fit statistics--------------------------------------------------------------
+
+    for attr, stat in [("p_value_df", 0), ("aic_df", 3), ("bmdls_df", 5)]:
+        rows = list()
+        for endpoint_id, fit in obj.model_fits.items():
+            fit[stat]["bmdrc.Endpoint.ID"] = endpoint_id
+            rows.append(fit[stat])
+        setattr(obj, attr, pd.DataFrame(rows))
+
+    # bmdrc computes the BMDL of the selected model again from all plate
+    # groups of the endpoint, which only differ from the fitted data if
+    # some of them were removed by filters (for bmdrc's fits, see below)
+    fitted = plate_groups[plate_groups["bmdrc.Endpoint.ID"].isin(obj.model_fits)]
+    refit = set(
+        fitted.loc[fitted["bmdrc.filter"] != "Keep", "bmdrc.Endpoint.ID"].unique()
+    ).difference(bmdrc_models)
+    bmdls = {i: fit[1][7] for i, fit in obj.model_fits.items()}
+    for n_doses, (ids, dose, affected, total) in _curve_arrays(
+        fitted[fitted["bmdrc.Endpoint.ID"].isin(refit)], obj.concentration, list(refit)
+    ).items():
+        for name, model in MODELS.items():
+            rows = [k for k, i in enumerate(ids) if obj.model_fits[i][2] == name]
+            if not rows:
+                continue
+            theta = np.stack([obj.model_fits[ids[k]][1][1] for k in rows])
+            with np.errstate(all="ignore"):
+                llf = -_nll(model.prob(dose[rows], theta), affected[rows], total[rows])
+                bmd10 = model.bmd(theta, BMR)
+            bmdl, _ = _bmdl(
+                model, theta, llf, bmd10, dose[rows], affected[rows], total[rows]
+            )
+            bmdls.update(zip([ids[k] for k in rows], bmdl))
+
+    conc = fitted[obj.concentration].to_numpy(dtype=float)
+    frac = fitted["bmdrc.frac.affected"].to_numpy(dtype=float)
+    positions = fitted.groupby("bmdrc.Endpoint.ID", sort=False).indices
+    rows = list()
+    for endpoint_id, fit in obj.model_fits.items():
+        name, params = fit[2], fit[1][1]
+        pos = positions[endpoint_id]
+        bmdl = bmdls[endpoint_id]
+        if endpoint_id in bmdrc_models:
+            # As in bmdrc, with its model object of the selected model
+            bmdl = model_fitting.Calculate_BMDL(
+                obj.concentration,
+                name,
+                bmdrc_models[endpoint_id],
+                fitted.iloc[pos],
+                model_fitting.Calculate_BMD(name, params),
+                params,
+            )
+        bmd10, bmd50 = _bmds(name, params)
+        auc = np.trapezoid(frac[pos], x=conc[pos])
+        min_dose, max_dose = round(conc[pos].min(), 4), round(conc[pos].max(), 4)
+        rows.append(
+            {
+                "bmdrc.Endpoint.ID": endpoint_id,
+                "Model": name,
+                "BMD10": bmd10,
+                "BMDL": bmdl,
+                "BMD50": bmd50,
+                "AUC": auc,
+                "Min_Dose": min_dose,
+                "Max_Dose": max_dose,
+                "AUC_Norm": auc / (max_dose - min_dose),
+            }
+        )
+    obj.bmds = pd.DataFrame(rows)
+    obj.report_model_fits = True
+
+
+###############
+## BOOTSTRAP ##
+###############
+
+
+def _bootstrap_batch(
+    name: str,
+    ids: list,
+    dose: np.ndarray,
+    affected: np.ndarray,
+    total: np.ndarray,
+    replicates: int,
+    seed: int,
+) -> np.ndarray:
+    """Bootstrap BMD10 percentiles of a batch of curves for one model.
+
+    Wells are resampled with replacement within each concentration,
+    so the number affected at a concentration of a replicate is a
+    binomial draw with the observed fraction affected. Draws of each
+    curve come from its own generator, seeded by `seed` and its
+    endpoint ID, so results do not depend on how curves are batched.
+    All replicates of all curves are fit at once.
+
+    Returns
+    -------
+    np.ndarray
+        BOOTSTRAP_PERCENTILES of each curve's replicate BMD10s,
+        (curves, 2); NA if no replicate could be fit
+    """
+    n_curves, n_doses = dose.shape
+    with np.errstate(all="ignore"):
+        frac = np.nan_to_num(affected / total)
+    draws = np.stack(
+        [
+            np.random.default_rng([seed, zlib.crc32(str(i).encode())]).binomial(
+                total[k].astype(int), frac[k], size=(replicates, n_doses)
+            )
+            for k, i in enumerate(ids)
+        ]
+    ).reshape(-1, n_doses)
+    dose = np.repeat(dose, replicates, 0)
+    total = np.repeat(total, replicates, 0)
+
+    model = MODELS[name]
+    with np.errstate(all="ignore"):
+        start = model.start(dose, draws / total)
+    theta, _, _ = _maximize_likelihood(
+        model.prob,
+        start,
+        np.array(model.lower, dtype=float),
+        np.array(model.upper, dtype=float),
+        dose,
+        draws.astype(float),
+        total,
+    )
+    with np.errstate(all="ignore"):
+        bmd10 = model.bmd(theta, BMR)
+
+        # Replicates whose fit never reaches the benchmark response (e.g. a
+        # decreasing Log Logistic fit) have no BMD10 below infinity
+        probs = model.prob(np.stack([np.zeros_like(bmd10), bmd10], 1), theta)
+        extra_risk = (probs[:, 1] - probs[:, 0]) / (1 - probs[:, 0])
+        bmd10[np.isfinite(bmd10) & ~np.isclose(extra_risk, BMR, atol=1e-4)] = np.inf
+        bmd10 = bmd10.reshape(n_curves, replicates)
+
+    # Replicates that could not be fit are left out; order statistics
+    # are taken so that infinite BMDs (flat replicates) stay infinite
+    limits = np.full((n_curves, len(BOOTSTRAP_PERCENTILES)), np.nan)
+    fitted = ~np.isnan(bmd10).all(1)
+    if fitted.any():
+        limits[fitted] = np.nanpercentile(
+            bmd10[fitted], BOOTSTRAP_PERCENTILES, axis=1, method="inverted_cdf"
+        ).T
+    return limits
+
+
+def _bootstrap_task(task: tuple) -> np.ndarray:
+    return _bootstrap_batch(*task)
+
+
+def bootstrap_bmds(
+    obj,
+    replicates: int = BOOTSTRAP_REPLICATES,
+    seed: int = 0,
+    workers: int = 1,
+) -> pd.DataFrame:
+    """Bootstrap confidence limits of the BMD10 of each fitted curve.
+
+    The selected model of each curve (with either fitting engine) is
+    refit to `replicates` resamples of its data (see
+    `_bootstrap_batch`). Curves with the same model and number of
+    concentrations are fit together, in batches of about
+    BOOTSTRAP_BATCH_ROWS replicates, spread over `workers`
+    processes.
+
+    Parameters
+    ----------
+    obj : BmdrcDataClass
+        Fitted `bmdrc.BinaryClass.BinaryClass` or
+        `bmdrc.LPRClass.LPRClass`
+    replicates : int, optional
+        Resamples per curve, by default BOOTSTRAP_REPLICATES
+    seed : int, optional
+        Random seed, by default 0
+    workers : int, optional
+        Number of processes, by default 1
+
+    Returns
+    -------
+    pd.DataFrame
+        bmdrc.Endpoint.ID, BMDL10 and BMDU10 of each fitted curve
+
+    Raises
+    ------
+    ValueError
+        If `replicates` is not positive
+    """
+    if replicates < 1:
+        raise ValueError("Invalid replicates. Must be at least 1.")
+
+    plate_groups = obj.plate_groups
+    keep = plate_groups[plate_groups["bmdrc.filter"] == "Keep"]
+    fitted = getattr(obj, "model_fits", None) or dict()
+
+    ## 1. Batch curves by selected model and number of doses----------------------------------
+
+    per_batch = max(1, BOOTSTRAP_BATCH_ROWS // replicates)
+    tasks = list()
+    for n_doses, (ids, dose, affected, total) in _curve_arrays(
+        keep, obj.concentration, list(fitted)
+    ).items():
+        for name in MODELS:
+            rows = [k for k, i in enumerate(ids) if fitted[i][2] == name]
+            for start in range(0, len(rows), per_batch):
+                batch = rows[start : start + per_batch]
+                tasks.append(
+                    (
+                        name,
+                        [ids[k] for k in batch],
+                        dose[batch],
+                        affected[batch],
+                        total[batch],
+                        replicates,
+                        seed,
+                    )
+                )
+
+    ## 2. Fit replicates-----------------------------------------------------------------------
+
+    print(f"......bootstrapping {len(fitted)} curves with {replicates} replicates")
+    if workers > 1 and len(tasks) > 1:
+        with ProcessPoolExecutor(max_workers=min(workers, len(tasks))) as pool:
+            limits = list(pool.map(_bootstrap_task, tasks))
+    else:
+        limits = [_bootstrap_task(task) for task in tasks]
+
+    columns = ["bmdrc.Endpoint.ID", "BMDL10", "BMDU10"]
+    if not tasks:
+        return pd.DataFrame(columns=columns)
+    limits = pd.DataFrame(
+        {
+            "bmdrc.Endpoint.ID": [i for task in tasks for i in task[1]],
+            "BMDL10": np.concatenate([lim[:, 0] for lim in limits]),
+            "BMDU10": np.concatenate([lim[:, 1] for lim in limits]),
+        }
+    )
+    order = {endpoint_id: k for k, endpoint_id in enumerate(fitted)}
+    return limits.sort_values(
+        "bmdrc.Endpoint.ID", key=lambda ids: ids.map(order)
+    ).reset_index(drop=True)[columns]
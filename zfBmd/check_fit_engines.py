@@ -0,0 +1,152 @@
+#!/usr/bin/env python
+# coding: utf-8
+
+######################
+## IMPORT LIBRARIES ##
+######################
+import argparse
+import sys
+
+import numpy as np
+import pandas as pd
+
+from batched_fitting import BMD_RTOL
+from support_functions import (
+    LPR_COLUMNS,
+    MORPHO_COLUMNS,
+    combine_datasets,
+    run_lpr_pipeline,
+    run_morpho_pipeline,
+)
+
+# Fit the same files with the bmdrc and batched engines (see
+# `support_functions.fit_models`) and compare their BMD tables: models and
+# flags must be the same, and benchmark doses agree to within BMD_RTOL.
+# bmdrc's optimizer can stop short of the maximum likelihood, so curves
+# that differ pass if the batched fit of every model is at least as likely
+# (an AIC at most AIC_TOL higher) as bmdrc's
+
+## check the test files: python3 check_fit_engines.py
+## check other files: python3 check_fit_engines.py --morpho files/morphology.csv --lpr files/lpr.csv
+
+# Input columns and fitting function of each data type
+PIPELINES = {
+    "morpho": (MORPHO_COLUMNS, run_morpho_pipeline),
+    "lpr": (LPR_COLUMNS, run_lpr_pipeline),
+}
+
+# Columns compared exactly and to within BMD_RTOL (relative)
+EXACT_COLUMNS = ["Model", "BMD10_Flag", "BMD50_Flag", "DataQC_Flag"]
+DOSE_COLUMNS = ["BMD10", "BMDL", "BMD50"]
+
+# Largest AIC by which a batched fit may be worse than bmdrc's
+AIC_TOL = 1e-6
+
+
+def benchmark_doses(
+    thePaths: list[str], data_type: str, engine: str
+) -> tuple[pd.DataFrame, pd.DataFrame]:
+    """Fit files with one engine and return their BMD and AIC tables."""
+    columns, run_fit = PIPELINES[data_type]
+    obj = run_fit(combine_datasets(thePaths, columns), engine=engine)
+    obj.output_benchmark_dose()
+    return (
+        obj.output_res_benchmark_dose.set_index("bmdrc.Endpoint.ID"),
+        obj.aic_df.set_index("bmdrc.Endpoint.ID").astype(float),
+    )
+
+
+def compare(
+    reference: pd.DataFrame,
+    batched: pd.DataFrame,
+    reference_aic: pd.DataFrame,
+    batched_aic: pd.DataFrame,
+) -> tuple[list[str], list[str]]:
+    """List the curves whose BMD tables differ between two engines.
+
+    Returns the differences of curves where every batched fit is at
+    least as likely as bmdrc's (bmdrc's optimizer stopped short), and
+    the other differences.
+    """
+    if not reference.index.equals(batched.index):
+        return [], ["endpoints differ"]
+
+    differences = dict()
+    for col in EXACT_COLUMNS:
+        differ = reference[col].fillna("NA") != batched[col].fillna("NA")
+        for endpoint_id in reference.index[differ]:
+            differences.setdefault(endpoint_id, []).append(
+                f"{col} {reference.at[endpoint_id, col]} (bmdrc) "
+                f"!= {batched.at[endpoint_id, col]} (batched)"
+            )
+    for col in DOSE_COLUMNS:
+        close = np.isclose(
+            batched[col], reference[col], rtol=BMD_RTOL, atol=0, equal_nan=True
+        )
+        for endpoint_id in reference.index[~close]:
+            differences.setdefault(endpoint_id, []).append(
+                f"{col} {reference.at[endpoint_id, col]:.6g} (bmdrc) "
+                f"!= {batched.at[endpoint_id, col]:.6g} (batched)"
+            )
+
+    # Models that bmdrc fits with a finite AIC must fit as well in batches
+    ref_aic = reference_aic.reindex(batched_aic.index)[batched_aic.columns]
+    worse = (~(batched_aic <= ref_aic + AIC_TOL) & np.isfinite(ref_aic)).any(axis=1)
+
+    better, issues = list(), list()
+    for endpoint_id, diffs in differences.items():
+        issue = f"{endpoint_id}: {', '.join(diffs)}"
+        if endpoint_id in worse.index and not worse[endpoint_id]:
+            better.append(issue)
+        else:
+            issues.append(issue)
+    return better, issues
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(
+        "Check that the batched fitting engine agrees with bmdrc"
+    )
+    parser.add_argument(
+        "--morpho",
+        dest="morpho",
+        nargs="+",
+        help="Morphology files (default: test_files/test_morphology.csv)",
+    )
+    parser.add_argument(
+        "--lpr",
+        dest="lpr",
+        nargs="+",
+        help="LPR files (default: test_files/test_behavioral.csv)",
+    )
+    args = parser.parse_args()
+
+    ## check the test files unless files are given
+    if args.morpho is None and args.lpr is None:
+        args.morpho = ["test_files/test_morphology.csv"]
+        args.lpr = ["test_files/test_behavioral.csv"]
+
+    failed = False
+    for data_type, paths in [("morpho", args.morpho), ("lpr", args.lpr)]:
+        if paths is None:
+            continue
+        print(f"...Fitting {data_type} data with bmdrc")
+        reference, reference_aic = benchmark_doses(paths, data_type, "bmdrc")
+        print(f"...Fitting {data_type} data in batches")
+        batched, batched_aic = benchmark_doses(paths, data_type, "batched")
+
+        better, issues = compare(reference, batched, reference_aic, batched_aic)
+        print(
+            f"...{data_type}: {len(reference)} curves, {len(better)} with "
+            f"more likely batched fits, {len(issues)} with other differences"
+        )
+        for issue in better:
+            print(f"......{issue} (more likely in batches)")
+        for issue in issues:
+            print(f"......{issue}")
+        failed |= bool(issues)
+
+    if failed:
+        print("...Engines disagree")
+        sys.exit(1)
+    print(f"...Engines agree (benchmark doses to within {BMD_RTOL:g})")
@@ -7,20 +7,44 @@
 import argparse
 import os
 import sys
+from concurrent.futures import Future, ProcessPoolExecutor
 from glob import glob
-
-import pandas as pd
-from bmdrc.BinaryClass import BinaryClass
-from bmdrc.LPRClass import LPRClass
+from typing import Optional
 
 # Import specific support_functions for this main pipeline function
 from support_functions import (
+    LPR_COLUMNS,
+    MORPHO_COLUMNS,
+    LPR_ENDPOINTS,
+    FIT_ENGINES,
+    BOOTSTRAP_REPLICATES,
+    CHECKPOINT_CURVES,
+    Checkpoint,
+    FitCache,
+    checkpoint_signature,
     combine_datasets,
-    preprocess_morpho,
-    run_filters,
+    prepare_lpr,
+    prepare_morpho,
+    run_bootstrap,
+    run_lpr_pipeline,
+    run_morpho_pipeline,
+    run_sweep,
+    stream_lpr_files,
+    sweep_grid,
     write_outputs,
 )
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.schema import validate_files
+from src.telemetry import TELEMETRY, stage, write_telemetry
+
+# Input columns, fitting function, pre-processing function (for sweeps)
+# and output filename tag of each data type
+PIPELINES = {
+    "morpho": (MORPHO_COLUMNS, run_morpho_pipeline, prepare_morpho, "BC"),
+    "lpr": (LPR_COLUMNS, run_lpr_pipeline, prepare_lpr, "LPR"),
+}
+
 # Example commands
 
 ## morphology only: python3 main.py --morpho test_files/test_morphology.csv
@@ -31,6 +55,26 @@ from support_functions import (
 
 ## python3 main.py --lpr files/Tanguay_Phase_4_zf_104alkyl_PAH_LPR_data_PNNL_2023OCT05.csv
 
+## morphology & lpr in separate processes: python3 main.py --morpho test_files/test_morphology.csv --lpr test_files/test_behavioral.csv --concurrent
+
+## all LPR cycles: python3 main.py --lpr test_files/test_behavioral.csv --lpr_endpoints AUC1 AUC2 AUC3 AUC4 MOV1 MOV2 MOV3 MOV4
+
+## LPR with bounded memory: python3 main.py --lpr files/Tanguay_Phase_4_zf_104alkyl_PAH_LPR_data_PNNL_2023OCT05.csv --stream_lpr
+
+## tables only, without a report: python3 main.py --morpho test_files/test_morphology.csv --no-report
+
+## fit chemicals on 8 cores: python3 main.py --morpho files/Zfish_Morphology_Legacy_2011-2018.csv --workers 8
+
+## fit curves in batches: python3 main.py --morpho files/Zfish_Morphology_Legacy_2011-2018.csv --fit_engine batched
+
+## only refit curves that changed since the last run: python3 main.py --morpho test_files/test_morphology.csv --fit_cache fit_cache
+
+## bootstrap BMD10 confidence limits (BMDL10, BMDU10) on 8 cores: python3 main.py --morpho test_files/test_morphology.csv --bootstrap 1000 --workers 8
+
+## BMDs under other filter thresholds: python3 main.py --morpho test_files/test_morphology.csv --sweep negative_control=40,50 correlation_score=0.1,0.2,0.3
+
+## continue an interrupted run: python3 main.py --morpho files/Zfish_Morphology_Legacy_2011-2018.csv --checkpoint, then the same command with --resume
+
 ###########################
 ## COLLECT CLI ARGUMENTS ##
 ###########################
@@ -61,6 +105,102 @@ parser.add_argument(
     help="The output folder for files. Default is current directory.",
     default=".",
 )
+parser.add_argument(
+    "--workers",
+    dest="workers",
+    type=int,
+    help="Number of processes to fit models with; curves are sharded by chemical. Default is 1.",
+    default=1,
+)
+parser.add_argument(
+    "--fit_engine",
+    dest="fit_engine",
+    choices=FIT_ENGINES,
+    help="Fit curves one at a time with bmdrc, or all curves with the same number of concentrations at once with numpy ('batched'). Default is bmdrc.",
+    default="bmdrc",
+)
+parser.add_argument(
+    "--lpr_endpoints",
+    dest="lpr_endpoints",
+    nargs="+",
+    help=f"LPR cycle endpoints to compute, filter and fit (AUC or MOV and a cycle number). Default is {' '.join(LPR_ENDPOINTS)}.",
+    default=LPR_ENDPOINTS,
+)
+parser.add_argument(
+    "--stream_lpr",
+    dest="stream_lpr",
+    help="Read LPR files in chunks, reducing each well's time series to cycle sums as they are read, instead of loading them in full.",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--fit_cache",
+    dest="fit_cache",
+    help="Folder to save fitted curves in; curves whose data and settings are unchanged are not refit. Default is no cache.",
+    default=None,
+)
+parser.add_argument(
+    "--bootstrap",
+    dest="bootstrap",
+    type=int,
+    nargs="?",
+    const=BOOTSTRAP_REPLICATES,
+    metavar="REPLICATES",
+    help=f"Add BMDL10 and BMDU10 columns (5th and 95th percentiles of the BMD10) to the BMD tables, by refitting each curve's selected model to resampled wells. \
+                            Default is {BOOTSTRAP_REPLICATES} replicates when given without a number; replicates are fit on --workers processes.",
+    default=None,
+)
+parser.add_argument(
+    "--bootstrap_seed",
+    dest="bootstrap_seed",
+    type=int,
+    help="Random seed of the bootstrap. Default is 0.",
+    default=0,
+)
+parser.add_argument(
+    "--sweep",
+    dest="sweep",
+    nargs="+",
+    metavar="NAME=VALUES",
+    help="Filter and fit the data once per combination of filter thresholds, e.g. negative_control=40,50 min_concentration=3,4 correlation_score=0.1,0.2. \
+                            Unswept filters keep their default. Tables are written per combination, with all BMDs in sweep_BMDS_{BC,LPR}.csv; no report is written.",
+    default=None,
+)
+parser.add_argument(
+    "--checkpoint",
+    dest="checkpoint",
+    help="Save the data after pre-processing and filtering, and fitted curves as they are fit, in the output folder, so an interrupted run can be resumed.",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--checkpoint_every",
+    dest="checkpoint_every",
+    type=int,
+    help=f"Number of curves fit between checkpoints. Default is {CHECKPOINT_CURVES}.",
+    default=CHECKPOINT_CURVES,
+)
+parser.add_argument(
+    "--resume",
+    dest="resume",
+    help="Resume from the last checkpoint of a run with the same inputs and settings (implies --checkpoint).",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--concurrent",
+    dest="concurrent",
+    help="Run the morphology and LPR pipelines at the same time in separate processes.",
+    action="store_true",
+    default=False,
+)
+parser.add_argument(
+    "--prometheus",
+    dest="prometheus",
+    help="Also write stage telemetry as a Prometheus textfile in the output folder.",
+    action="store_true",
+    default=False,
+)
 parser.add_argument(
     "--report",
     dest="rep",
@@ -68,6 +208,12 @@ parser.add_argument(
     action="store_true",
     default=True,
 )
+parser.add_argument(
+    "--no-report",
+    dest="rep",
+    help="Do not generate a report; only the BMD, dose and fit tables are written.",
+    action="store_false",
+)
 
 ##############################
 ## DEFINE AND RUN FUNCTIONS ##
@@ -88,108 +234,182 @@ def main():
 
     # Parse inputted arguments from the command line
     args = parser.parse_args()
+    if args.sweep is not None:
+        try:
+            sweep_grid(args.sweep)
+        except ValueError as e:
+            parser.error(str(e))
+        if args.checkpoint or args.resume or args.bootstrap is not None:
+            parser.error(
+                "--sweep cannot be used with --checkpoint, --resume or --bootstrap"
+            )
+    if args.bootstrap is not None and args.bootstrap < 1:
+        parser.error("--bootstrap must be at least 1 replicate")
+
+    try:
+        run_pipeline(args)
+    finally:
+        write_telemetry(args.output, "zfBmd", prometheus=args.prometheus)
+
+
+def run_data_pipeline(
+    data_type: str, paths: list, args, report_pool=None
+) -> tuple[list, Optional[Future]]:
+    """Concatenate, fit and export one data type.
+
+    Parameters
+    ----------
+    data_type : str
+        One of ["morpho", "lpr"]
+    paths : list
+        Input files to concatenate
+    args : argparse.Namespace
+        Parsed command line arguments
+    report_pool : Optional[concurrent.futures.Executor], optional
+        Pool to write the report in after the tables, by default
+        None (write it here)
 
-    # Pull arguments
-    morpho_paths = args.morpho
-    lpr_paths = args.lpr
-
-    ### 0. Pre-launch combination-------------------------------------------------------------
-
-    if args.morpho is not None:
-        print("...Concatenating morpho datasets")
-        morpho_data = combine_datasets(morpho_paths)
-
-    if args.lpr is not None:
-        print("...Concatenating LPR datasets")
-        lpr_data = combine_datasets(lpr_paths)
-
-    ### 1. Input Data Modules--------------------------------------------------------------------
-
-    if args.morpho is not None:
-        print("...Formatting morphology data")
-        BC = BinaryClass(
-            df=morpho_data,
-            chemical="chemical.id",
-            concentration="conc",
-            plate="plate.id",
-            well="well",
-            endpoint="endpoint",
-            value="value",
-            format="long",
-        )
-
-    if args.lpr is not None:
-        print("...Formatting LPR data")
-        LPR = LPRClass(
-            df=lpr_data,
-            chemical="chemical.id",
-            concentration="conc",
-            plate="plate.id",
-            well="well",
-            time="variable",
-            value="value",
-            cycle_length=20.0,
-            cycle_cooldown=10.0,
-            starting_cycle="light",
-        )
-
-    ### 2. Pre-Processing modules-----------------------------------------------------------------
-
-    if args.morpho is not None:
-        print("...Pre-Processing morphology data")
-        preprocess_morpho(BC)
-
-    # LPR data has MORT and MO24 fish set to NA
-
-    ### 3. Filtering Modules----------------------------------------------------------------------
-
-    if args.morpho is not None:
-        print("...Filtering morphology data")
-        run_filters(BC)
-
-    if args.lpr is not None:
-        print("...Filtering LPR data")
-        run_filters(LPR)
-
-    ### 4. Model Fitting Modules------------------------------------------------------------------
-
-    if args.morpho is not None:
-        print("...Fitting models to morphology data")
-        BC.fit_models(diagnostic_mode=True)
-
-    if args.lpr is not None:
-        print("...Fitting models to LPR data")
-
-        # Subset down to AUC2 and MOV2 and rename them "AUC" and "MOV"
-        LPR.plate_groups = LPR.plate_groups[
-            LPR.plate_groups[LPR.endpoint].isin(["AUC2", "MOV2"])
-        ]
-        LPR.plate_groups[LPR.endpoint] = LPR.plate_groups[LPR.endpoint].str.replace(
-            "\d+", "", regex=True
-        )
-        LPR.plate_groups["bmdrc.Endpoint.ID"] = (
-            LPR.plate_groups[LPR.chemical].astype(str)
-            + " "
-            + LPR.plate_groups[LPR.endpoint].astype(str)
+    Returns
+    -------
+    tuple[list, Optional[Future]]
+        Telemetry records of the stages run (see `src.telemetry`),
+        to be collected when run in another process, and the report
+        being written in `report_pool`, if any
+    """
+    columns, run_fit, prepare, tag = PIPELINES[data_type]
+    name = "morpho" if data_type == "morpho" else "LPR"
+    first_record = len(TELEMETRY.records)
+
+    # Checkpoints are kept in the output folder until the tables are written
+    checkpoint = None
+    if args.checkpoint or args.resume:
+        settings = {"data_type": data_type}
+        if data_type == "lpr":
+            settings.update(endpoints=args.lpr_endpoints, stream=args.stream_lpr)
+        checkpoint = Checkpoint(
+            os.path.join(args.output, f".checkpoint_{tag}"),
+            checkpoint_signature(paths, **settings),
+            args.checkpoint_every,
+            resume=args.resume,
         )
-        LPR.fit_models(diagnostic_mode=True)
 
-    ### 5. Format and export outputs------------------------------------------------------------
-    print("...Exporting Results")
+    data = None
+    if checkpoint is not None and checkpoint.stage is not None:
+        print(f"...Resuming {name} pipeline after the {checkpoint.stage} checkpoint")
+    else:
+        print(f"...Concatenating {name} datasets")
+        with stage(f"concatenate:{data_type}") as rec:
+            if data_type == "lpr" and args.stream_lpr:
+                data = stream_lpr_files(paths, args.lpr_endpoints)
+            else:
+                data = combine_datasets(paths, columns)
+            rec.add_rows_out(data)
+            rec.extra["memory_bytes"] = int(data.memory_usage(deep=True).sum())
+
+    cache = FitCache(args.fit_cache) if args.fit_cache is not None else None
+    if args.sweep is not None:
+        grid = sweep_grid(args.sweep)
+        with stage(
+            f"sweep:{data_type}",
+            workers=args.workers,
+            engine=args.fit_engine,
+            points=len(grid),
+        ) as rec:
+            rec.add_rows_in(data)
+            options = {"endpoints": args.lpr_endpoints} if data_type == "lpr" else {}
+            obj = prepare(data, **options)
+            sweep_bmds = run_sweep(
+                obj, grid, tag, args.output, args.workers, cache, args.fit_engine
+            )
+            rec.add_rows_out(sweep_bmds)
+        return TELEMETRY.records[first_record:], None
+
+    with stage(f"fit:{data_type}", workers=args.workers, engine=args.fit_engine) as rec:
+        if data is not None:
+            rec.add_rows_in(data)
+        else:
+            rec.extra["resumed_from"] = checkpoint.stage
+        options = {"engine": args.fit_engine, "checkpoint": checkpoint}
+        if data_type == "lpr":
+            options["endpoints"] = args.lpr_endpoints
+        obj = run_fit(data, args.workers, cache, **options)
+        rec.add_rows_out(obj.plate_groups)
+        if cache is not None or checkpoint is not None:
+            fits = cache if cache is not None else checkpoint.fits
+            rec.extra["fit_cache_hits"] = fits.hits
+            rec.extra["fit_cache_misses"] = fits.misses
+
+    if args.bootstrap is not None:
+        with stage(
+            f"bootstrap:{data_type}", workers=args.workers, replicates=args.bootstrap
+        ) as rec:
+            run_bootstrap(obj, args.bootstrap, args.bootstrap_seed, args.workers)
+            rec.add_rows_out(obj.bootstrap_bmds)
+
+    print(f"...Exporting {name} results")
+    with stage(f"export:{data_type}"):
+        report = write_outputs(obj, tag, args.output, report=args.rep, pool=report_pool)
+    if checkpoint is not None:
+        checkpoint.clear()
+
+    return TELEMETRY.records[first_record:], report
+
+
+def run_pipeline(args):
+    """Run the zfBMD pipeline for the parsed command line arguments."""
 
-    if args.morpho is not None:
-        write_outputs(BC, "BC", args.output)
-
-    if args.lpr is not None:
-        write_outputs(LPR, "LPR", args.output)
+    # Pull arguments
+    jobs = [
+        (data_type, paths)
+        for data_type, paths in [("morpho", args.morpho), ("lpr", args.lpr)]
+        if paths is not None
+    ]
+
+    ### 0-5. Concatenate, format, pre-process, filter, fit and export--------------------------
+
+    report_pool, pending_reports = None, list()
+    if args.concurrent and len(jobs) > 1:
+
+        # The pipelines share no state, so each runs in its own process
+        # (writing its own report); stage records of each process are
+        # added to this one's
+        print("...Running morpho and LPR pipelines concurrently")
+        with ProcessPoolExecutor(max_workers=len(jobs)) as pool:
+            futures = [
+                pool.submit(run_data_pipeline, data_type, paths, args)
+                for data_type, paths in jobs
+            ]
+            for future in futures:
+                TELEMETRY.add_records(future.result()[0])
+
+    else:
+
+        # Reports are written in the background while the next data
+        # type is fit and outputs are checked (sweeps write none)
+        if args.rep and jobs and args.sweep is None:
+            report_pool = ProcessPoolExecutor(max_workers=len(jobs))
+        for data_type, paths in jobs:
+            pending_reports.append(
+                run_data_pipeline(data_type, paths, args, report_pool)[1]
+            )
 
     print("...Checking output")
+    output_files = dict()
     for fclass in ["BMDS", "Dose", "Fits"]:
-        output_files = glob(f"{args.output}/new_{fclass}_*.csv")
-        for of in output_files:
-            cmd = f"linkml-validate --schema srpAnalytics.yaml {of} --target-class zf{fclass}"
-            print(cmd)
-            os.system(cmd)
+        for of in sorted(glob(f"{args.output}/new_{fclass}_*.csv")):
+            output_files[of] = f"zf{fclass}"
+    with stage("validate") as rec:
+        reports = validate_files(output_files)
+        rec.add_rows_in(sum(report.rows for report in reports))
+    for report in reports:
+        print(report.summary())
+
+    if report_pool is not None:
+        print("...Waiting for reports")
+        with stage("report"):
+            for report in pending_reports:
+                report.result()
+        report_pool.shutdown()
 
 
 if __name__ == "__main__":
@@ -1,17 +1,57 @@
 #############
 ## IMPORTS ##
 #############
+import copy
+import hashlib
+import itertools
+import json
 import os
+import pickle
+import re
+import shutil
+import sys
+import tempfile
+from concurrent.futures import Executor, Future, ProcessPoolExecutor
+from importlib import metadata
 from typing import Optional, Union
 
 import numpy as np
 import pandas as pd
+from bmdrc import filtering
 from bmdrc.BinaryClass import BinaryClass
 from bmdrc.LPRClass import LPRClass
 
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from src.tableio import read_csv_files
+from zfBmd.batched_fitting import BOOTSTRAP_REPLICATES, bootstrap_bmds, fit_batched
+
+# Use the multi-threaded pyarrow CSV parser when available
+try:
+    import pyarrow  # noqa: F401
+
+    CSV_ENGINE = "pyarrow"
+except ImportError:
+    CSV_ENGINE = "c"
+
 # Define type for data classes
 BmdrcDataClass = Union[BinaryClass, LPRClass]
 
+# Columns used from each input file type
+MORPHO_COLUMNS = ["chemical.id", "conc", "plate.id", "well", "endpoint", "value"]
+LPR_COLUMNS = ["chemical.id", "conc", "plate.id", "well", "variable", "value"]
+
+# Identifier columns, stored as categoricals while data are loaded
+ID_COLUMNS = ["chemical.id", "plate.id", "well", "endpoint", "variable"]
+INPUT_DTYPES = {
+    "chemical.id": "string[pyarrow]" if CSV_ENGINE == "pyarrow" else str,
+    "plate.id": "category",
+    "well": "category",
+    "endpoint": "category",
+    "variable": "category",
+    "conc": float,
+    "value": float,
+}
+
 #########################
 ## COMBINE DATA.FRAMES ##
 #########################
@@ -19,29 +59,571 @@ BmdrcDataClass = Union[BinaryClass, LPRClass]
 ## TO FIX: log probit erroring out on some curves (how to fix infinity estimate)
 
 
+# Convert an ID column to a categorical with the values the default parser gives
+def _categorical_ids(theColumn: pd.Series, isChemical: bool) -> pd.Series:
+
+    theColumn = theColumn.astype("category")
+    theCategories = theColumn.cat.categories
+
+    if isChemical:
+
+        # Chemical IDs are strings without spaces
+        newCategories = theCategories.astype(str).str.replace(" ", "_")
+        newCategories = newCategories.astype(object)
+
+    else:
+
+        # Other IDs are numbers where possible (e.g. plate IDs)
+        try:
+            newCategories = pd.Index(pd.to_numeric(theCategories))
+        except (ValueError, TypeError):
+            newCategories = theCategories.astype(object)
+
+    # Only the categories are mapped; merged categories (e.g. "a b" and "a_b") are combined
+    return theColumn.map(dict(zip(theCategories, newCategories))).astype("category")
+
+
+# Store categorical ID columns with their plain types
+def uncategorize_ids(theData: pd.DataFrame) -> pd.DataFrame:
+    """Convert categorical ID columns back to plain columns.
+
+    bmdrc groups data by the ID columns, and grouping by categoricals
+    adds every unobserved combination of IDs (e.g. chemical and plate)
+    as an empty group, so the ID columns must be plain before
+    filtering and fitting.
+
+    Parameters
+    ----------
+    theData : pd.DataFrame
+        Data with categorical ID columns (see `combine_datasets`)
+
+    Returns
+    -------
+    pd.DataFrame
+        Data with ID columns as strings or numbers
+    """
+    theData = theData.copy(deep=False)
+    for col in theData.columns[theData.dtypes == "category"]:
+        theData[col] = np.asarray(theData[col])
+    return theData
+
+
 # A support function to concatenate datasets together
-def combine_datasets(thePaths):
+def combine_datasets(thePaths, theColumns=None):
+
+    # Read all files (only the needed columns, with declared types) and combine dataframes
+    theData = read_csv_files(
+        thePaths, usecols=theColumns, dtype=INPUT_DTYPES, engine=CSV_ENGINE
+    )
 
-    # Create a vector to hold data
-    theData = []
+    # Store IDs as categoricals and replace spaces in chemical IDs
+    for col in theData.columns.intersection(ID_COLUMNS):
+        theData[col] = _categorical_ids(theData[col], col == "chemical.id")
 
-    # Read all files
-    for thePath in thePaths:
-        theData.append(pd.read_csv(thePath))
+    # Report the memory footprint
+    theMemory = theData.memory_usage(deep=True).sum()
+    print(
+        f"......Read {len(theData)} rows ({theMemory / 2**20:.1f} MiB) with the {CSV_ENGINE} parser"
+    )
 
-    # Combine dataframes
-    theData = pd.concat(theData)
+    return theData
+
+
+######################################
+## LPR ENDPOINTS & STREAMING READER ##
+######################################
+
+# Cycle settings of the LPR assay, in 6-second measures
+LPR_CYCLES = {"cycle_length": 20.0, "cycle_cooldown": 10.0, "starting_cycle": "light"}
+
+# Cycle endpoints computed, filtered and fit by default
+LPR_ENDPOINTS = ["AUC2", "MOV2"]
+
+# Rows per chunk when streaming LPR files
+LPR_CHUNK_ROWS = 1_000_000
+
+
+# Time points as bmdrc parses them (the number in the time column)
+def _time_points(theTimes: pd.Series) -> pd.Series:
+    return theTimes.astype(str).str.extract("(\\d+)", expand=False).astype(float)
+
+
+# Split cycle endpoints (e.g. "AUC2") into their type and cycle number
+def _cycle_endpoints(theEndpoints: list[str]) -> list[tuple[str, int]]:
+    theParts = list()
+    for endpoint in theEndpoints:
+        match = re.fullmatch("(AUC|MOV)(\\d+)", endpoint)
+        if match is None or int(match.group(2)) < 1:
+            raise ValueError(
+                f"Invalid LPR endpoint {endpoint}. Must be AUC or MOV and a cycle number (e.g. AUC2)."
+            )
+        theParts.append((match.group(1), int(match.group(2))))
+    return theParts
+
+
+# Time points of light to dark transitions, as in bmdrc's calculate_movs
+def _transition_times(theCycle: int) -> list[float]:
+    cycleLength = LPR_CYCLES["cycle_length"]
+    fullCycle = (cycleLength + LPR_CYCLES["cycle_cooldown"]) * 2
+    offset = (theCycle - 1) * fullCycle
+    if LPR_CYCLES["starting_cycle"] == "light":
+        return [offset + cycleLength - 1, offset + fullCycle / 2]
+    return [offset + fullCycle - LPR_CYCLES["cycle_cooldown"] - 1, offset + fullCycle]
+
+
+# Light and dark periods (cycle labels) and transition time points used by cycle endpoints
+def _endpoint_cycles(theEndpoints: list[str]) -> tuple[list[str], list[float]]:
+    thePeriods, theTransitions = list(), list()
+    for kind, cycle in _cycle_endpoints(theEndpoints):
+        if kind == "AUC":
+            thePeriods += [f"light{cycle}", f"dark{cycle}"]
+        else:
+            theTransitions += _transition_times(cycle)
+    return thePeriods, theTransitions
+
+
+class SelectedLPRClass(LPRClass):
+    """`bmdrc.LPRClass.LPRClass` that only computes selected cycle
+    endpoints.
+
+    Only the time series rows of the selected cycles are summed
+    (AUC) or differenced (MOV) and converted to 0/1 values, and only
+    the selected endpoints are kept for filtering and fitting. When
+    one cycle of an endpoint is selected, the cycle number is dropped
+    from its name (e.g. "AUC2" is named "AUC").
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        LPR time series in long format
+    endpoints : list[str]
+        Cycle endpoints to compute (e.g. ["AUC2", "MOV2"])
+    **kwargs
+        Column names and cycle settings for `LPRClass`
+
+    Raises
+    ------
+    ValueError
+        If an endpoint is invalid, or its cycle is not in the data
+    """
 
-    # Replace spaces
-    theData["chemical.id"] = theData["chemical.id"].astype(str)
-    theData["chemical.id"] = theData["chemical.id"].str.replace(" ", "_")
+    def __init__(self, df: pd.DataFrame, endpoints: list[str], **kwargs):
+        self._endpoints = list(endpoints)
+        self._endpoint_parts = _cycle_endpoints(self._endpoints)
+        super().__init__(df=df, **kwargs)
 
+    # Keep only rows of selected cycles, and only loop to the last one
+    def _select_cycles(self, theCycles: pd.DataFrame) -> pd.DataFrame:
+        lastCycle = max(cycle for _, cycle in self._endpoint_parts)
+        if lastCycle > self._max_cycle:
+            raise ValueError(
+                f"LPR endpoints {self._endpoints} need {lastCycle} cycles, but the data have {self._max_cycle}."
+            )
+        self._max_cycle = lastCycle
+        thePeriods, theTransitions = _endpoint_cycles(self._endpoints)
+        return theCycles[
+            theCycles["cycle"].isin(thePeriods)
+            | theCycles[self._time].isin(theTransitions)
+        ]
+
+    def add_cycles(self):
+        return self._select_cycles(super().add_cycles())
+
+    # Cycles before the last selected one that were not computed
+    def to_dichotomous(self, the_df, the_value):
+        if the_value not in the_df.columns:
+            return np.zeros(len(the_df), dtype=int)
+        return super().to_dichotomous(the_df, the_value)
+
+    def convert_LPR(self):
+        id_vars = [self._chemical, self._concentration, self._plate, self._well]
+        theKinds = {kind for kind, _ in self._endpoint_parts}
+
+        CycleInfo = self.add_cycles()
+        theValues = list()
+        if "AUC" in theKinds:
+            theValues.append(self.calculate_aucs(CycleInfo).dropna(subset=id_vars))
+        if "MOV" in theKinds:
+            theValues.append(self.calculate_movs(CycleInfo).dropna(subset=id_vars))
+        NewValues = theValues[0]
+        for theValue in theValues[1:]:
+            NewValues = pd.merge(NewValues, theValue)
+
+        # Name endpoints without cycle numbers when unambiguous
+        theNames = [kind for kind, _ in self._endpoint_parts]
+        theNames = {
+            endpoint: name if theNames.count(name) == 1 else endpoint
+            for endpoint, name in zip(self._endpoints, theNames)
+        }
+        NewValues = NewValues[id_vars + self._endpoints].rename(columns=theNames)
+
+        self._df = NewValues.melt(id_vars=id_vars, var_name="endpoint")
+        self.endpoint = "endpoint"
+        self._endpoint = "endpoint"
+        self.value = "value"
+        self._value = "value"
+
+
+class StreamedLPRClass(SelectedLPRClass):
+    """`SelectedLPRClass` of LPR time series reduced while reading
+    (see `stream_lpr_files`).
+
+    Instead of every time point, `df` holds each well's sums of
+    values per light and dark period ("cycle" column), and its values
+    at the light to dark transitions. bmdrc sums the periods and
+    takes the transitions again, so AUC and MOV endpoints are the
+    same as from the full time series.
+
+    Parameters
+    ----------
+    df : pd.DataFrame
+        Reduced time series (see `stream_lpr_files`)
+    max_cycle : int
+        Number of light/dark cycles in the full time series
+    endpoints : list[str]
+        Cycle endpoints to compute (e.g. ["AUC2", "MOV2"])
+    **kwargs
+        Column names and cycle settings for `LPRClass`
+    """
+
+    def __init__(
+        self, df: pd.DataFrame, max_cycle: int, endpoints: list[str], **kwargs
+    ):
+        self._streamed_max_cycle = max_cycle
+        super().__init__(df=df, endpoints=endpoints, **kwargs)
+
+    # Cycles were assigned while reading
+    def add_cycles(self):
+        self._max_cycle = self._streamed_max_cycle
+        return self._select_cycles(self._df)
+
+
+def stream_lpr_files(
+    thePaths: list[str],
+    theEndpoints: list[str] = LPR_ENDPOINTS,
+    theChunkSize: int = LPR_CHUNK_ROWS,
+) -> pd.DataFrame:
+    """Read LPR files in chunks, reducing each well's time series to
+    the cycle sums and light to dark transitions of selected
+    endpoints.
+
+    Files are read twice: first only the time column, to assign time
+    points to cycles as bmdrc does, then in chunks of `theChunkSize`
+    rows that are reduced as they are read. Memory grows with the
+    number of wells and cycles, not with the number of time points.
+
+    Parameters
+    ----------
+    thePaths : list[str]
+        LPR files (or URLs), optionally compressed (e.g. .csv.gz)
+    theEndpoints : list[str], optional
+        Cycle endpoints to keep rows for, by default LPR_ENDPOINTS
+    theChunkSize : int, optional
+        Rows per chunk, by default LPR_CHUNK_ROWS
+
+    Returns
+    -------
+    pd.DataFrame
+        Reduced time series for `StreamedLPRClass`, with categorical
+        IDs as from `combine_datasets`; the number of cycles is
+        kept in `attrs["max_cycle"]`
+    """
+    theIDs = ["chemical.id", "conc", "plate.id", "well"]
+
+    ## 1. Assign time points to cycles------------------------------------------------------------
+
+    theTimes = list()
+    for path in thePaths:
+        for chunk in pd.read_csv(
+            path, usecols=["variable"], dtype="category", chunksize=theChunkSize
+        ):
+            theTimes.append(chunk["variable"].cat.categories.to_series())
+    theTimes = _time_points(pd.concat(theTimes).drop_duplicates())
+
+    # Use bmdrc's cycle assignment on the unique time points
+    theCycler = LPRClass.__new__(LPRClass)
+    theCycler.__dict__.update(
+        {
+            "_df": pd.DataFrame({"variable": theTimes.unique()}),
+            "_time": "variable",
+            **{f"_{k}": v for k, v in LPR_CYCLES.items()},
+        }
+    )
+    theCycles = theCycler.add_cycles()
+    theCycles = dict(zip(theCycles["variable"], theCycles["cycle"]))
+    maxCycle = theCycler._max_cycle
+
+    # Only periods and transitions of selected endpoints are kept
+    thePeriods, theTransitions = _endpoint_cycles(theEndpoints)
+
+    ## 2. Reduce chunks---------------------------------------------------------------------------
+
+    theSums, theValues = list(), list()
+    theRows = 0
+    for path in thePaths:
+        for chunk in pd.read_csv(
+            path,
+            usecols=LPR_COLUMNS,
+            dtype={
+                "chemical.id": str,
+                "plate.id": str,
+                "well": str,
+                "variable": "category",
+                "conc": float,
+                "value": float,
+            },
+            chunksize=theChunkSize,
+        ):
+            theRows += len(chunk)
+            times = chunk["variable"].cat.rename_categories(
+                _time_points(chunk["variable"].cat.categories.to_series())
+            )
+            cycles = times.map(theCycles).astype(object)
+
+            # Sums of light and dark periods, per well
+            inPeriod = cycles.isin(thePeriods).to_numpy()
+            theSums.append(
+                chunk[inPeriod]
+                .groupby(theIDs + [cycles[inPeriod].rename("cycle")], sort=False)[
+                    "value"
+                ]
+                .sum()
+                .reset_index()
+            )
+
+            # Values at transitions; these are kept out of the period sums
+            atTransition = times.astype(float).isin(theTransitions).to_numpy()
+            theValues.append(
+                chunk.loc[atTransition, theIDs + ["variable", "value"]]
+                .astype({"variable": str})
+                .assign(cycle="gap")
+            )
+
+    theData = pd.concat(theSums + theValues, ignore_index=True)
+
+    # Store IDs as categoricals as in combine_datasets
+    for col in ["chemical.id", "plate.id", "well"]:
+        theData[col] = _categorical_ids(theData[col], col == "chemical.id")
+    theData = theData[LPR_COLUMNS + ["cycle"]]
+    theData.attrs["max_cycle"] = maxCycle
+
+    print(f"......Streamed {theRows} rows of LPR time series into {len(theData)} rows")
     return theData
 
 
 ######################################
 ## PRE-PROCESSING SUPPORT FUNCTIONS ##
 ######################################
+
+# Number of masking rules that fit in a per-well bitmask
+MAX_MASKING_RULES = 64
+
+
+def _as_list(x):
+    return x if isinstance(x, list) else [x]
+
+
+def set_wells_to_na(BC: BinaryClass, rules: list[tuple]):
+    """Set wells to NA for several masking rules in one pass.
+
+    Each rule is `(endpoint, value, except_endpoint)`, as in bmdrc's
+    `set_well_to_na`: wells where an endpoint has the value are set
+    to NA, except for the listed endpoints. Rather than rescanning
+    the data for every rule, the rules each well triggers are stored
+    as a bitmask (one bit per rule), each endpoint gets a bitmask of
+    the rules that affect it, and values are set to NA where the two
+    overlap. Rules behave as if applied one after another: a value
+    set to NA by an earlier rule does not trigger a later one. Wells
+    are numbered from the chemical, concentration, plate and well
+    columns directly, so the "bmdrc.Well.ID" column that bmdrc adds
+    to `BC.df` (and only reads within `set_well_to_na`) is not made.
+
+    Parameters
+    ----------
+    BC : BinaryClass
+        Morphology data; `BC.df` is updated
+    rules : list[tuple]
+        (endpoint(s), value(s), except endpoint(s) or None) in the order
+        they apply
+
+    Raises
+    ------
+    ValueError
+        If there are more than MAX_MASKING_RULES rules, or a rule
+        names an endpoint that is not in the data
+    """
+    if not rules:
+        return
+    if len(rules) > MAX_MASKING_RULES:
+        raise ValueError(f"At most {MAX_MASKING_RULES} masking rules are supported.")
+
+    # Format rules with lists, like bmdrc
+    rules = [
+        (_as_list(name), _as_list(value), None if exc is None else _as_list(exc))
+        for name, value, exc in rules
+    ]
+
+    df = BC.df
+    endpoint_codes, endpoints = pd.factorize(df[BC.endpoint])
+    for name, _, exc in rules:
+        for endpoint in name + (exc or []):
+            if endpoint not in endpoints:
+                raise ValueError(
+                    endpoint + " is not an endpoint in the DataClass object."
+                )
+
+    # Number wells by chemical, concentration, plate and well
+    well_codes = (
+        df.groupby(
+            [BC.chemical, BC.concentration, BC.plate, BC.well], sort=False, dropna=False
+        )
+        .ngroup()
+        .to_numpy()
+    )
+    n_wells = well_codes.max() + 1
+
+    # Rows of endpoints that trigger any rule (one scan of the data)
+    trigger_endpoints = sorted({e for name, _, _ in rules for e in name})
+    is_trigger = df[BC.endpoint].isin(trigger_endpoints).to_numpy()
+    trigger_rows = df.loc[is_trigger, [BC.endpoint, BC.value]]
+    trigger_wells = well_codes[is_trigger]
+
+    # Wells triggering each rule; values set to NA by an earlier rule
+    # (i.e. endpoint not in its exceptions) do not trigger later rules
+    well_bits = np.zeros(n_wells, dtype=np.uint64)
+    triggered = list()
+    for i, (name, value, _) in enumerate(rules):
+        rule_wells = np.zeros(n_wells, dtype=bool)
+        for endpoint in name:
+            hit = (trigger_rows[BC.endpoint] == endpoint) & trigger_rows[BC.value].isin(
+                value
+            )
+            hit_wells = np.zeros(n_wells, dtype=bool)
+            hit_wells[trigger_wells[hit.to_numpy()]] = True
+            for j, (_, _, exc) in enumerate(rules[:i]):
+                if exc is None or endpoint not in exc:
+                    hit_wells &= ~triggered[j]
+            rule_wells |= hit_wells
+        triggered.append(rule_wells)
+        well_bits[rule_wells] |= np.uint64(1 << i)
+
+    # Rules affecting each endpoint
+    endpoint_bits = np.zeros(len(endpoints), dtype=np.uint64)
+    for i, (_, _, exc) in enumerate(rules):
+        affected = ~endpoints.isin(exc or [])
+        endpoint_bits[affected] |= np.uint64(1 << i)
+
+    # Set values to NA in one pass
+    to_na = (well_bits[well_codes] & endpoint_bits[endpoint_codes]) != 0
+    BC.df = df.assign(**{BC.value: df[BC.value].mask(to_na)})
+
+    # Add attributes for reports, like bmdrc
+    if not hasattr(BC, "report_well_na"):
+        BC.report_well_na = list()
+    BC.report_well_na.extend([list(rule) for rule in rules])
+
+
+def create_endpoints(BC: BinaryClass, endpoint_dict: dict):
+    """Create composite endpoints from a single well x endpoint matrix.
+
+    Like bmdrc's `combine_and_create_new_endpoints`, each new endpoint
+    is the sum of its endpoints' values in a well (NA counts as 0),
+    capped at 1, for every well with at least one of those endpoints.
+    Instead of a pass over the data per new endpoint, the values of
+    all combined endpoints are gathered into one matrix, new endpoints
+    are computed as columns in dependency order (e.g. ANY24 before
+    ANY120), and the new columns are melted back into rows.
+
+    Parameters
+    ----------
+    BC : BinaryClass
+        Morphology data; `BC.df` is updated
+    endpoint_dict : dict
+        New endpoint -> list of endpoints (existing or new) to combine
+
+    Raises
+    ------
+    Exception
+        If a new endpoint already exists, a combined endpoint does
+        not exist, or new endpoints depend on each other in a cycle
+    """
+    df = BC.df
+    keys = [BC.chemical, BC.concentration, BC.plate, BC.well]
+    combines = {name: _as_list(eps) for name, eps in endpoint_dict.items()}
+    existing = set(df[BC.endpoint].unique())
+
+    # Order new endpoints so that each comes after those it combines
+    order = list()
+
+    def visit(name, path):
+        if name in order:
+            return
+        if name in path:
+            raise Exception("Cyclic endpoint definitions: " + " -> ".join(path))
+        for endpoint in combines[name]:
+            if endpoint in combines:
+                visit(endpoint, path + [name])
+        order.append(name)
+
+    for name in combines:
+        if name in existing:
+            raise Exception(name + " is already an existing endpoint")
+        for endpoint in combines[name]:
+            if endpoint not in existing and endpoint not in combines:
+                raise Exception(
+                    endpoint + " is not an endpoint in the DataClass object."
+                )
+        visit(name, [])
+
+    ## Gather values of combined endpoints into a well x endpoint matrix-----------------------------------
+
+    columns = sorted({e for eps in combines.values() for e in eps} - set(combines))
+    columns += order
+    column_index = {name: i for i, name in enumerate(columns)}
+
+    sub = df[df[BC.endpoint].isin(columns)]
+    well_codes = sub.groupby(keys, sort=True).ngroup().to_numpy()
+    has_keys = well_codes >= 0
+    well_codes = well_codes[has_keys]
+    _, first_rows = np.unique(well_codes, return_index=True)
+    wells = sub.loc[has_keys, keys].iloc[first_rows].reset_index(drop=True)
+
+    n_wells, n_columns = len(wells), len(columns)
+    cells = (
+        well_codes * n_columns
+        + sub.loc[has_keys, BC.endpoint].map(column_index).to_numpy()
+    )
+    values = np.nan_to_num(sub.loc[has_keys, BC.value].to_numpy(dtype=float))
+    total = np.bincount(cells, weights=values, minlength=n_wells * n_columns)
+    total = total.reshape(n_wells, n_columns)
+    present = np.bincount(cells, minlength=n_wells * n_columns) > 0
+    present = present.reshape(n_wells, n_columns)
+
+    ## Compute new endpoints as columns and melt them back--------------------------------------------------
+
+    new_rows = list()
+    for name in order:
+        i = column_index[name]
+        combined = [column_index[e] for e in combines[name]]
+        value = total[:, combined].sum(axis=1)
+        total[:, i] = np.where(value > 1, 1, value)
+        present[:, i] = present[:, combined].any(axis=1)
+
+        new_rows.append(
+            wells[present[:, i]]
+            .reset_index(drop=True)
+            .assign(**{BC.endpoint: name, BC.value: total[present[:, i], i]})
+        )
+
+    BC.df = pd.concat([df] + new_rows)
+
+    # Add attributes for reports, like bmdrc
+    if hasattr(BC, "report_combination"):
+        BC.report_combination = BC.report_combination | endpoint_dict
+    else:
+        BC.report_combination = endpoint_dict
+
+
 # All pre-processing required for morphology data
 def preprocess_morpho(BC):
 
@@ -113,10 +695,28 @@ def preprocess_morpho(BC):
             unexpected,
         )
 
-    # Subset down to the relevant endpoints
-    BC.df = BC.df[BC.df[BC.endpoint].isin(relevant_endpoints)]
+    # Endpoints to remove besides unexpected ones: the do not count category and,
+    # for BRAIN samples, any endpoints that are calculated by us
+    removed_endpoints = ["DNC_"] if "DNC_" in theEndpoints else []
+    if "BRAI" in theEndpoints:
+        removed_endpoints += [
+            "ANY24",
+            "ANY120",
+            "TOT_MORT",
+            "ALL_BUT_MORT",
+            "BRN_",
+            "CRAN",
+            "EDEM",
+            "LTRK",
+            "MUSC",
+            "SKIN",
+            "TCHR",
+        ]
 
-    ## Convert do not counts to NA-------------------------------------------------------------------------
+    ## Convert do not counts and mortality to NA------------------------------------------------------------
+
+    # Rules of (endpoint, value, except endpoints), applied together in one pass
+    masking_rules = []
 
     # If there's a do not count category, remove data
     if "DNC_" in theEndpoints:
@@ -127,12 +727,7 @@ def preprocess_morpho(BC):
         )
 
         # Set wells with a "do not count" to NA
-        BC.set_well_to_na(endpoint_name="DNC_", endpoint_value=1)
-
-        # Remove the DNC category
-        BC.remove_endpoints("DNC_")
-
-    ## Convert Mortality to NA------------------------------------------------------------------------------
+        masking_rules.append(("DNC_", 1, None))
 
     # Convert wells affected by mortality at 5 days to NA
     if "MORT" in theEndpoints:
@@ -143,11 +738,7 @@ def preprocess_morpho(BC):
         )
 
         # Set wells with mortality at 5 days to NA, with the exception of the 24 hour timepoints
-        BC.set_well_to_na(
-            endpoint_name="MORT",
-            endpoint_value=1,
-            except_endpoint=["DP24", "MO24", "SM24", "MORT"],
-        )
+        masking_rules.append(("MORT", 1, ["DP24", "MO24", "SM24", "MORT"]))
 
     # Convert wells affected by mortality at 24 hours to NA
     if "MO24" in theEndpoints:
@@ -158,9 +749,32 @@ def preprocess_morpho(BC):
         )
 
         # Set wells at mortality at 24 hours to NA
-        BC.set_well_to_na(
-            endpoint_name="MO24", endpoint_value=1, except_endpoint="MO24"
-        )
+        masking_rules.append(("MO24", 1, "MO24"))
+
+    # bmdrc masks after subsetting to the relevant endpoints and removing
+    # DNC_; masking first gives the same values, since (1) the trigger
+    # endpoints (DNC_, MORT, MO24) and exceptions are all relevant
+    # endpoints, so the same wells trigger each rule, (2) DNC_ is neither
+    # a trigger nor an exception of the later rules, so removing it
+    # between rules changes nothing, and (3) values of endpoints that are
+    # then dropped are never read. The rule order, and so which wells
+    # trigger later rules, is bmdrc's.
+    set_wells_to_na(BC, masking_rules)
+
+    ## Remove endpoints--------------------------------------------------------------------------------------
+
+    # Subset down to the relevant endpoints, without removed ones, in one pass
+    theEndpoint = BC.df[BC.endpoint]
+    BC.df = BC.df[
+        theEndpoint.isin(relevant_endpoints) & ~theEndpoint.isin(removed_endpoints)
+    ]
+
+    # Report the removed DNC category like bmdrc's remove_endpoints
+    if "DNC_" in theEndpoints:
+        if hasattr(BC, "report_endpoint_removal"):
+            BC.report_endpoint_removal.append("DNC_")
+        else:
+            BC.report_endpoint_removal = ["DNC_"]
 
     ## Make new endpoints------------------------------------------------------------------------------------
 
@@ -169,27 +783,6 @@ def preprocess_morpho(BC):
 
     if "BRAI" in theEndpoints:
 
-        # Remove any endpoints taht are calculated by us
-        BC.df = BC.df[
-            np.logical_not(
-                BC.df[BC.endpoint].isin(
-                    [
-                        "ANY24",
-                        "ANY120",
-                        "TOT_MORT",
-                        "ALL_BUT_MORT",
-                        "BRN_",
-                        "CRAN",
-                        "EDEM",
-                        "LTRK",
-                        "MUSC",
-                        "SKIN",
-                        "TCHR",
-                    ]
-                )
-            )
-        ]
-
         # Define new endpoints in a dictionary
         EndpointDictionary = {
             "ANY24": ["MO24", "DP24", "SM24", "NC24"],
@@ -247,7 +840,7 @@ def preprocess_morpho(BC):
         }
 
         # Add new endpoints
-        BC.combine_and_create_new_endpoints(EndpointDictionary)
+        create_endpoints(BC, EndpointDictionary)
 
         # Remove renamed endpoints
         # BC.remove_endpoints(["PIG_", "TR__"])
@@ -287,7 +880,7 @@ def preprocess_morpho(BC):
         }
 
         # Add new endpoints
-        BC.combine_and_create_new_endpoints(EndpointDictionary)
+        create_endpoints(BC, EndpointDictionary)
 
 
 #################################
@@ -295,25 +888,1045 @@ def preprocess_morpho(BC):
 #################################
 
 
+# Filter thresholds (bmdrc defaults) and their short names in sweep labels
+FILTER_SETTINGS = {
+    "negative_control": 50,
+    "min_concentration": 3,
+    "correlation_score": 0.2,
+}
+FILTER_LABELS = {
+    "negative_control": "nc",
+    "min_concentration": "mc",
+    "correlation_score": "cs",
+}
+
+
 # Run filters on either the BC or LPR object
-def run_filters(obj):
+def run_filters(
+    obj,
+    negative_control: float = FILTER_SETTINGS["negative_control"],
+    min_concentration: int = FILTER_SETTINGS["min_concentration"],
+    correlation_score: float = FILTER_SETTINGS["correlation_score"],
+):
 
     # Negative control filter, default 50%
-    obj.filter_negative_control(apply=True, diagnostic_plot=False)
+    obj.filter_negative_control(
+        percentage=negative_control, apply=True, diagnostic_plot=False
+    )
 
     # Minimum concentration filter, default is 3
-    obj.filter_min_concentration(apply=True, diagnostic_plot=False)
+    obj.filter_min_concentration(
+        count=min_concentration, apply=True, diagnostic_plot=False
+    )
+
+    # Correlation score filter, default 0.2
+    obj.filter_correlation_score(
+        score=correlation_score, apply=True, diagnostic_plot=False
+    )
+
+
+def sweep_grid(theSettings: list[str]) -> list[dict]:
+    """Get the filter settings of each point of a parameter sweep.
+
+    Parameters
+    ----------
+    theSettings : list[str]
+        Values of each swept filter, as "name=value,value,...", with
+        names from FILTER_SETTINGS; other filters keep their default
+
+    Returns
+    -------
+    list[dict]
+        Filter settings (see `run_filters`) of every combination of
+        values, in the order given
+
+    Raises
+    ------
+    ValueError
+        If a filter name or value is invalid
+    """
+    values = {name: [value] for name, value in FILTER_SETTINGS.items()}
+    for setting in theSettings:
+        name, _, theValues = setting.partition("=")
+        if name not in FILTER_SETTINGS or not theValues:
+            raise ValueError(
+                f"Invalid sweep setting '{setting}'. Must be name=value,value,... "
+                f"with a name in {list(FILTER_SETTINGS)}."
+            )
+        cast = int if name == "min_concentration" else float
+        try:
+            values[name] = [cast(value) for value in theValues.split(",")]
+        except ValueError:
+            raise ValueError(
+                f"Invalid sweep values '{theValues}' for {name}. Must be {cast.__name__}s."
+            )
+    return [dict(zip(values, point)) for point in itertools.product(*values.values())]
+
+
+def sweep_label(settings: dict) -> str:
+    """Get the filename label of a sweep point, e.g. "nc50_mc3_cs0.2"."""
+    return "_".join(
+        f"{FILTER_LABELS[name]}{settings[name]:g}" for name in FILTER_LABELS
+    )
+
+
+###############################
+## SHARDED FITTING FUNCTIONS ##
+###############################
+
+# Attributes set by bmdrc's fit_models
+FIT_ATTRIBUTES = [
+    "plate_groups",
+    "bmds_filtered",
+    "model_fits",
+    "failed_pvalue_test",
+    "p_value_df",
+    "aic_df",
+    "bmdls_df",
+    "bmds",
+    "model_fitting_gof_threshold",
+    "model_fitting_aic_threshold",
+    "model_fitting_model_selection",
+]
+
+# Model fitting settings (bmdrc defaults)
+FIT_SETTINGS = {
+    "gof_threshold": 0.1,
+    "aic_threshold": 2,
+    "model_selection": "lowest BMDL",
+}
+
+# Model fitting engines: bmdrc fits curves one at a time; "batched" fits
+# curves with the same number of concentrations together (see
+# batched_fitting.fit_batched)
+FIT_ENGINES = ["bmdrc", "batched"]
+
+# Number of shards per worker; more shards even out chemicals
+# that take longer to fit
+SHARDS_PER_WORKER = 4
+
+
+def _fit(obj: BmdrcDataClass, engine: str = "bmdrc"):
+    if engine == "batched":
+        fit_batched(obj, **FIT_SETTINGS)
+    else:
+        obj.fit_models(**FIT_SETTINGS, diagnostic_mode=True)
+
+
+def _bmdrc_class(obj: BmdrcDataClass) -> type:
+    # bmdrc class of the data (e.g. LPRClass for SelectedLPRClass)
+    return next(c for c in type(obj).__mro__ if c.__module__.startswith("bmdrc."))
+
+
+def _fit_shard(shard: BmdrcDataClass, engine: str = "bmdrc") -> dict:
+    _fit(shard, engine)
+    return {attr: getattr(shard, attr, None) for attr in FIT_ATTRIBUTES}
+
+
+def _make_shard(obj: BmdrcDataClass, positions: np.ndarray) -> BmdrcDataClass:
+    # Only keep the column settings and a subset of plate groups
+    shard = copy.copy(obj)
+    shard.__dict__ = {
+        k: v for k, v in vars(obj).items() if isinstance(v, (str, int, float))
+    }
+    shard.plate_groups = obj.plate_groups.iloc[positions].copy()
+    return shard
+
+
+def _in_order(df: Optional[pd.DataFrame], ids: list) -> Optional[pd.DataFrame]:
+    # Sort a table of per-endpoint results into the serial fitting order
+    if df is None or df.empty:
+        return df
+    rank = {endpoint_id: i for i, endpoint_id in enumerate(ids)}
+    order = df["bmdrc.Endpoint.ID"].map(rank).argsort(kind="stable")
+    return df.iloc[order].reset_index(drop=True)
+
+
+def _rows_by_id(df: Optional[pd.DataFrame]) -> dict:
+    if df is None or df.empty:
+        return dict()
+    return {row["bmdrc.Endpoint.ID"]: row for row in df.to_dict("records")}
 
-    # Correlation score filter
-    obj.filter_correlation_score(apply=True, diagnostic_plot=False)
+
+def fit_models(
+    obj: BmdrcDataClass,
+    workers: int = 1,
+    cache: Optional["FitCache"] = None,
+    engine: str = "bmdrc",
+    save_every: Optional[int] = None,
+):
+    """Fit models to filtered data, sharded by chemical over processes.
+
+    Curves of different chemicals are independent, so the plate
+    groups are split by chemical into shards that are fit in a
+    process pool. Curves found in `cache` are not refit. Results are
+    merged back into `obj` in the same order as fitting all chemicals
+    at once, so outputs (and reports) are identical to
+    `obj.fit_models(diagnostic_mode=True)`.
+
+    Parameters
+    ----------
+    obj : BmdrcDataClass
+        Pre-processed and filtered `bmdrc.BinaryClass.BinaryClass`
+        or `bmdrc.LPRClass.LPRClass`
+    workers : int, optional
+        Number of processes; 1 fits in this process, by default 1
+    cache : Optional[FitCache], optional
+        Fitted curves of previous runs; newly fit curves are added
+        to it, by default None
+    engine : str, optional
+        One of FIT_ENGINES; "batched" fits each shard's curves in
+        batches (see `batched_fitting.fit_batched`), by default "bmdrc"
+    save_every : Optional[int], optional
+        If given with `cache`, chemicals are fit in rounds of at least
+        this many curves, and each round is saved to `cache` before
+        the next, so an interrupted run only loses the curves of one
+        round; by default None (all curves are saved at the end)
+
+    Raises
+    ------
+    ValueError
+        If `engine` is invalid
+    """
+    if engine not in FIT_ENGINES:
+        raise ValueError(f"Invalid engine. Must be one of {FIT_ENGINES}.")
+
+    groups = obj.plate_groups.groupby(obj.chemical, sort=False).indices
+    if obj.plate_groups.empty or (cache is None and (workers <= 1 or len(groups) < 2)):
+        _fit(obj, engine)
+        return
+
+    shard_positions, results = list(), list()
+    to_fit = np.ones(len(obj.plate_groups), dtype=bool)
+
+    ## Reuse cached curves----------------------------------------------------------------------
+
+    if cache is not None:
+        keys = cache.keys(obj, engine)
+        cached = cache.load(keys)
+        print(f"......Reusing {len(cached)} of {len(keys)} curves from the fit cache")
+        if cached:
+            to_fit = (
+                ~obj.plate_groups["bmdrc.Endpoint.ID"].isin(list(cached)).to_numpy()
+            )
+            shard_positions.append(np.flatnonzero(~to_fit))
+            results.append(cache.result(obj, shard_positions[-1], cached))
+
+    ## Fit the remaining curves-----------------------------------------------------------------
+
+    # Chemicals (in order of appearance) are fit in rounds of at least
+    # `save_every` curves, each saved to the cache before the next
+    positions = [pos[to_fit[pos]] for pos in groups.values()]
+    positions = [pos for pos in positions if len(pos)]
+    endpoint_ids = obj.plate_groups["bmdrc.Endpoint.ID"].to_numpy()
+    n_curves = [len(pd.unique(endpoint_ids[pos])) for pos in positions]
+    rounds, current, round_curves = list(), list(), 0
+    for pos, n in zip(positions, n_curves):
+        current.append(pos)
+        round_curves += n
+        if cache is not None and save_every and round_curves >= save_every:
+            rounds.append(current)
+            current, round_curves = list(), 0
+    if current:
+        rounds.append(current)
+
+    pool = None
+    if workers > 1 and len(positions) > 1:
+        pool = ProcessPoolExecutor(max_workers=min(workers, len(positions)))
+    try:
+        saved = 0
+        for chemical_positions in rounds:
+
+            # Split the round's chemicals into contiguous shards
+            n_shards = (
+                min(len(chemical_positions), workers * SHARDS_PER_WORKER)
+                if pool is not None
+                else 1
+            )
+            chemicals = np.array_split(np.arange(len(chemical_positions)), n_shards)
+            fit_positions = [
+                np.sort(np.concatenate([chemical_positions[i] for i in c]))
+                for c in chemicals
+            ]
+            shards = [_make_shard(obj, pos) for pos in fit_positions]
+
+            if n_shards > 1:
+                fitted = list(pool.map(_fit_shard, shards, [engine] * len(shards)))
+            else:
+                fitted = [_fit_shard(shards[0], engine)]
+
+            if cache is not None:
+                cache.save(keys, fitted)
+                saved += sum(len(pd.unique(endpoint_ids[pos])) for pos in fit_positions)
+                if len(rounds) > 1:
+                    print(f"......Saved {saved} of {sum(n_curves)} fitted curves")
+            shard_positions += fit_positions
+            results += fitted
+    finally:
+        if pool is not None:
+            pool.shutdown()
+
+    ## Merge shards in the order of a single fit------------------------------------------------
+
+    # Plate groups keep their original row order
+    order = np.argsort(np.concatenate(shard_positions))
+    obj.plate_groups = pd.concat([res["plate_groups"] for res in results]).iloc[order]
+
+    # Models are fit in order of endpoint IDs that passed filtering
+    keep = obj.plate_groups[obj.plate_groups["bmdrc.filter"] == "Keep"]
+    fit_ids = keep["bmdrc.Endpoint.ID"].unique().tolist()
+    model_fits = dict()
+    for res in results:
+        model_fits.update(res["model_fits"])
+    obj.model_fits = {i: model_fits[i] for i in fit_ids if i in model_fits}
+
+    for attr in ["p_value_df", "aic_df", "bmdls_df", "bmds"]:
+        setattr(
+            obj,
+            attr,
+            _in_order(pd.concat([res[attr] for res in results]), fit_ids),
+        )
+
+    # Filtered endpoints are summarized in sorted order
+    filtered = [res["bmds_filtered"] for res in results]
+    filtered = [df for df in filtered if df is not None]
+    obj.bmds_filtered = (
+        pd.concat(filtered).sort_values("bmdrc.Endpoint.ID").reset_index(drop=True)
+        if filtered
+        else None
+    )
+
+    failed = [res["failed_pvalue_test"] for res in results]
+    failed = [endpoint_id for f in failed if f is not None for endpoint_id in f]
+    if failed:
+        obj.failed_pvalue_test = failed
+
+    for attr in FIT_ATTRIBUTES:
+        if attr.startswith("model_fitting_"):
+            setattr(obj, attr, results[0][attr])
+    obj.report_model_fits = True
+
+
+###############
+## FIT CACHE ##
+###############
+
+# Bump to invalidate fit caches written by older versions of this module
+FIT_CACHE_VERSION = 2
+
+# Plate group columns that fits and curve statistics are computed from
+FIT_CACHE_COLUMNS = ["bmdrc.num.tot", "bmdrc.num.affected", "bmdrc.num.nonna"]
+
+
+class FitCache:
+    """Fitted curves saved between runs, keyed by their data.
+
+    Each endpoint ID (curve) is keyed by a hash of its plate groups
+    (concentrations, counts and filter result), the model fitting
+    engine and settings, and the bmdrc version. Fits only depend on
+    filter thresholds through the filter results, so curves that
+    different thresholds keep or remove alike share entries. Its
+    model fits, selected model, BMDs and curve statistics are saved to
+    `{cache_dir}/{key[:2]}/{key}.pkl`, so a later run only refits
+    curves whose data or settings changed. Entries are never
+    removed; delete the directory to clear the cache.
+
+    Parameters
+    ----------
+    cache_dir : str
+        Directory to save fitted curves in
+    """
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.pkl")
+
+    def keys(self, obj: BmdrcDataClass, engine: str = "bmdrc") -> dict[str, str]:
+        """Get the cache key of each endpoint ID of filtered data.
+
+        Parameters
+        ----------
+        obj : BmdrcDataClass
+            Filtered `bmdrc.BinaryClass.BinaryClass` or
+            `bmdrc.LPRClass.LPRClass`
+        engine : str, optional
+            Model fitting engine (see `fit_models`), by default "bmdrc"
+
+        Returns
+        -------
+        dict[str, str]
+            Endpoint ID -> key
+        """
+        settings = json.dumps(
+            [
+                FIT_CACHE_VERSION,
+                _bmdrc_class(obj).__name__,
+                metadata.version("bmdrc"),
+                engine,
+                FIT_SETTINGS,
+            ],
+            sort_keys=True,
+        ).encode()
+
+        plate_groups = obj.plate_groups
+        values = plate_groups[[obj.concentration] + FIT_CACHE_COLUMNS].to_numpy(
+            dtype=float
+        )
+        keep = (plate_groups["bmdrc.filter"] == "Keep").to_numpy()
+
+        keys = dict()
+        groups = plate_groups.groupby("bmdrc.Endpoint.ID", sort=False).indices
+        for endpoint_id, pos in groups.items():
+            digest = hashlib.sha256(settings)
+            digest.update(str(endpoint_id).encode())
+            digest.update(values[pos].tobytes())
+            digest.update(keep[pos].tobytes())
+            keys[endpoint_id] = digest.hexdigest()
+        return keys
+
+    def load(self, keys: dict[str, str]) -> dict[str, dict]:
+        """Load cached curves.
+
+        Parameters
+        ----------
+        keys : dict[str, str]
+            Endpoint ID -> key (see `keys`)
+
+        Returns
+        -------
+        dict[str, dict]
+            Endpoint ID -> saved results, for IDs in the cache
+        """
+        entries = dict()
+        for endpoint_id, key in keys.items():
+            path = self._path(key)
+            if not os.path.exists(path):
+                continue
+            try:
+                with open(path, "rb") as f:
+                    entries[endpoint_id] = pickle.load(f)
+            except Exception:
+                # Unreadable entries are refit and overwritten
+                continue
+        self.hits += len(entries)
+        self.misses += len(keys) - len(entries)
+        return entries
+
+    def save(self, keys: dict[str, str], results: list[dict]):
+        """Save the curves of fitted shards.
+
+        Parameters
+        ----------
+        keys : dict[str, str]
+            Endpoint ID -> key (see `keys`)
+        results : list[dict]
+            Fitted attributes of each shard (see `FIT_ATTRIBUTES`)
+        """
+        for res in results:
+            bmds = _rows_by_id(res["bmds"])
+            bmds_filtered = _rows_by_id(res["bmds_filtered"])
+            failed = set(res["failed_pvalue_test"] or [])
+            for endpoint_id in res["plate_groups"]["bmdrc.Endpoint.ID"].unique():
+                entry = {
+                    "model_fit": res["model_fits"].get(endpoint_id),
+                    "bmds": bmds.get(endpoint_id),
+                    "bmds_filtered": bmds_filtered.get(endpoint_id),
+                    "failed": endpoint_id in failed,
+                }
+                path = self._path(keys[endpoint_id])
+                os.makedirs(os.path.dirname(path), exist_ok=True)
+                with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+                    pickle.dump(entry, f)
+                os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def result(
+        self, obj: BmdrcDataClass, positions: np.ndarray, entries: dict[str, dict]
+    ) -> dict:
+        """Rebuild the fitted attributes of a shard from cached curves.
+
+        Parameters
+        ----------
+        obj : BmdrcDataClass
+            Filtered `bmdrc.BinaryClass.BinaryClass` or
+            `bmdrc.LPRClass.LPRClass`
+        positions : np.ndarray
+            Positions of the cached curves' rows in `obj.plate_groups`
+        entries : dict[str, dict]
+            Endpoint ID -> saved results (see `load`)
+
+        Returns
+        -------
+        dict
+            Fitted attributes, as returned for a fitted shard
+        """
+        # As added to plate groups by bmdrc when fitting
+        plate_groups = obj.plate_groups.iloc[positions].copy()
+        plate_groups["bmdrc.frac.affected"] = (
+            plate_groups["bmdrc.num.affected"] / plate_groups["bmdrc.num.nonna"]
+        )
+
+        model_fits = {
+            endpoint_id: entry["model_fit"]
+            for endpoint_id, entry in entries.items()
+            if entry["model_fit"] is not None
+        }
+        filtered = [e["bmds_filtered"] for e in entries.values() if e["bmds_filtered"]]
+        failed = [endpoint_id for endpoint_id, e in entries.items() if e["failed"]]
+
+        # P-values, AICs and BMDLs of each model are kept in the fits
+        return {
+            "plate_groups": plate_groups,
+            "bmds_filtered": pd.DataFrame(filtered) if filtered else None,
+            "model_fits": model_fits,
+            "failed_pvalue_test": failed or None,
+            "p_value_df": pd.DataFrame([fit[0] for fit in model_fits.values()]),
+            "aic_df": pd.DataFrame([fit[3] for fit in model_fits.values()]),
+            "bmdls_df": pd.DataFrame([fit[5] for fit in model_fits.values()]),
+            "bmds": pd.DataFrame(
+                [e["bmds"] for e in entries.values() if e["bmds"] is not None]
+            ),
+            **{f"model_fitting_{k}": v for k, v in FIT_SETTINGS.items()},
+        }
+
+
+#################
+## CHECKPOINTS ##
+#################
+
+# Curves fit between checkpoints (see fit_models)
+CHECKPOINT_CURVES = 500
+
+# Pipeline stages saved to checkpoints, in order
+CHECKPOINT_STAGES = ["preprocessed", "filtered"]
+
+
+def checkpoint_signature(thePaths: list[str], **settings) -> str:
+    """Get a signature of pipeline inputs, to check checkpoints against.
+
+    Parameters
+    ----------
+    thePaths : list[str]
+        Input files (or URLs); the size and modification time of
+        local files are included
+    **settings
+        JSON-serializable settings that change the saved data
+
+    Returns
+    -------
+    str
+        sha256 hex digest
+    """
+    inputs = list()
+    for path in thePaths:
+        if os.path.exists(path):
+            stat = os.stat(path)
+            inputs.append([os.path.abspath(path), stat.st_size, stat.st_mtime_ns])
+        else:
+            inputs.append([path])
+    blob = json.dumps(
+        [inputs, metadata.version("bmdrc"), settings], sort_keys=True
+    ).encode()
+    return hashlib.sha256(blob).hexdigest()
+
+
+class Checkpoint:
+    """Saved state of a pipeline run, to resume it if interrupted.
+
+    The data are pickled to `{checkpoint_dir}/{stage}.pkl` after
+    each of CHECKPOINT_STAGES, and fitted curves are saved to a
+    FitCache in `{checkpoint_dir}/fits` every `curves` curves (see
+    `fit_models`). The last saved stage is recorded with the
+    signature of the run's inputs in `checkpoint.json`; a run
+    started with `resume` continues after that stage if the
+    signature matches, and only fits curves that are not saved.
+    Otherwise previous checkpoints are removed.
+
+    Parameters
+    ----------
+    checkpoint_dir : str
+        Directory to save the checkpoints of one pipeline in
+    signature : str
+        Signature of the run's inputs (see `checkpoint_signature`)
+    curves : int, optional
+        Curves fit between checkpoints, by default CHECKPOINT_CURVES
+    resume : bool, optional
+        Continue from previous checkpoints, by default False
+    """
+
+    def __init__(
+        self,
+        checkpoint_dir: str,
+        signature: str,
+        curves: int = CHECKPOINT_CURVES,
+        resume: bool = False,
+    ):
+        self.checkpoint_dir = checkpoint_dir
+        self.signature = signature
+        self.curves = curves
+        self._index_file = os.path.join(checkpoint_dir, "checkpoint.json")
+
+        self.stage = None
+        if resume and os.path.exists(self._index_file):
+            with open(self._index_file) as f:
+                index = json.load(f)
+            if index["signature"] == signature:
+                self.stage = index["stage"]
+        if self.stage is None:
+            self.clear()
+        self.fits = FitCache(os.path.join(checkpoint_dir, "fits"))
+
+    def _path(self, stage: str) -> str:
+        return os.path.join(self.checkpoint_dir, f"{stage}.pkl")
+
+    def _write(self, path: str, write):
+        # Replace files in one step, so an interrupted write is never loaded
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        with open(f"{path}.{os.getpid()}.tmp", "wb") as f:
+            write(f)
+        os.replace(f"{path}.{os.getpid()}.tmp", path)
+
+    def load(self) -> Optional[BmdrcDataClass]:
+        """Load the data saved after the last completed stage.
+
+        Returns
+        -------
+        Optional[BmdrcDataClass]
+            Saved `bmdrc.BinaryClass.BinaryClass` or
+            `bmdrc.LPRClass.LPRClass`, None if there is none
+        """
+        if self.stage is None:
+            return None
+        with open(self._path(self.stage), "rb") as f:
+            return pickle.load(f)
+
+    def save(self, stage: str, obj: BmdrcDataClass):
+        """Save the data after a completed stage.
+
+        Parameters
+        ----------
+        stage : str
+            One of CHECKPOINT_STAGES
+        obj : BmdrcDataClass
+            `bmdrc.BinaryClass.BinaryClass` or `bmdrc.LPRClass.LPRClass`
+        """
+        self._write(
+            self._path(stage),
+            lambda f: pickle.dump(obj, f, protocol=pickle.HIGHEST_PROTOCOL),
+        )
+        self._write(
+            self._index_file,
+            lambda f: f.write(
+                json.dumps({"stage": stage, "signature": self.signature}).encode()
+            ),
+        )
+
+        # Earlier stages are no longer needed
+        for previous in CHECKPOINT_STAGES[: CHECKPOINT_STAGES.index(stage)]:
+            if os.path.exists(self._path(previous)):
+                os.remove(self._path(previous))
+        self.stage = stage
+
+    def clear(self):
+        """Remove all checkpoints (e.g. once outputs are written)."""
+        shutil.rmtree(self.checkpoint_dir, ignore_errors=True)
+        self.stage = None
+
+
+########################
+## PIPELINE FUNCTIONS ##
+########################
+
+
+def _fit_checkpointed(
+    obj: BmdrcDataClass,
+    workers: int,
+    cache: Optional[FitCache],
+    engine: str,
+    checkpoint: Optional[Checkpoint],
+):
+    # Filter (unless resumed after filtering) and fit, saving checkpoints
+    name = "morphology" if isinstance(obj, BinaryClass) else "LPR"
+    if checkpoint is None or checkpoint.stage != "filtered":
+        print(f"...Filtering {name} data")
+        run_filters(obj)
+        if checkpoint is not None:
+            checkpoint.save("filtered", obj)
+
+    print(f"...Fitting models to {name} data")
+    if checkpoint is None:
+        fit_models(obj, workers, cache, engine)
+    else:
+        fit_cache = checkpoint.fits if cache is None else cache
+        fit_models(obj, workers, fit_cache, engine, checkpoint.curves)
+
+
+# Format, pre-process, filter and fit morphology data
+def run_morpho_pipeline(
+    morpho_data: Optional[pd.DataFrame],
+    workers: int = 1,
+    cache: Optional[FitCache] = None,
+    engine: str = "bmdrc",
+    checkpoint: Optional[Checkpoint] = None,
+) -> BinaryClass:
+
+    # Data are not needed when resuming from a checkpoint
+    BC = checkpoint.load() if checkpoint is not None else None
+    if BC is None:
+        BC = prepare_morpho(morpho_data)
+        if checkpoint is not None:
+            checkpoint.save("preprocessed", BC)
+
+    _fit_checkpointed(BC, workers, cache, engine, checkpoint)
+
+    return BC
+
+
+# Format and pre-process morphology data
+def prepare_morpho(morpho_data: pd.DataFrame) -> BinaryClass:
+
+    print("...Formatting morphology data")
+    BC = BinaryClass(
+        df=morpho_data,
+        chemical="chemical.id",
+        concentration="conc",
+        plate="plate.id",
+        well="well",
+        endpoint="endpoint",
+        value="value",
+        format="long",
+    )
+    BC.df = uncategorize_ids(BC.df)
+
+    print("...Pre-Processing morphology data")
+    preprocess_morpho(BC)
+
+    return BC
+
+
+# Format, filter and fit LPR data
+def run_lpr_pipeline(
+    lpr_data: Optional[pd.DataFrame],
+    workers: int = 1,
+    cache: Optional[FitCache] = None,
+    endpoints: list[str] = LPR_ENDPOINTS,
+    engine: str = "bmdrc",
+    checkpoint: Optional[Checkpoint] = None,
+) -> LPRClass:
+
+    # Data are not needed when resuming from a checkpoint
+    LPR = checkpoint.load() if checkpoint is not None else None
+    if LPR is None:
+        LPR = prepare_lpr(lpr_data, endpoints)
+        if checkpoint is not None:
+            checkpoint.save("preprocessed", LPR)
+
+    _fit_checkpointed(LPR, workers, cache, engine, checkpoint)
+
+    return LPR
+
+
+# Format LPR data into the selected cycle endpoints
+def prepare_lpr(
+    lpr_data: pd.DataFrame, endpoints: list[str] = LPR_ENDPOINTS
+) -> LPRClass:
+
+    print("...Formatting LPR data")
+    theColumns = {
+        "chemical": "chemical.id",
+        "concentration": "conc",
+        "plate": "plate.id",
+        "well": "well",
+        "time": "variable",
+        "value": "value",
+        **LPR_CYCLES,
+    }
+    if "max_cycle" in lpr_data.attrs:
+        # Time series reduced while reading (see stream_lpr_files)
+        LPR = StreamedLPRClass(
+            df=lpr_data,
+            max_cycle=lpr_data.attrs["max_cycle"],
+            endpoints=endpoints,
+            **theColumns,
+        )
+    else:
+        LPR = SelectedLPRClass(df=lpr_data, endpoints=endpoints, **theColumns)
+    LPR.df = uncategorize_ids(LPR.df)
+
+    # LPR data has MORT and MO24 fish set to NA
+
+    return LPR
+
+
+# Filter and fit pre-processed data for each filter setting of a sweep
+def run_sweep(
+    obj: BmdrcDataClass,
+    grid: list[dict],
+    tag: str,
+    outname: Optional[str],
+    workers: int = 1,
+    cache: Optional[FitCache] = None,
+    engine: str = "bmdrc",
+) -> pd.DataFrame:
+    """Filter and fit pre-processed data for each point of a sweep.
+
+    Plate groups are made once; each point filters a shallow copy of
+    `obj` (sharing its data) with its own copy of the plate groups.
+    Points are fit in turn, each sharded over `workers` processes,
+    with a fit cache so that curves that points filter alike are only
+    fit once. The tables of each point are written as with
+    `write_outputs` (without a report), tagged with `sweep_label`,
+    before the next point is fit.
+
+    Parameters
+    ----------
+    obj : BmdrcDataClass
+        Pre-processed `bmdrc.BinaryClass.BinaryClass` or
+        `bmdrc.LPRClass.LPRClass`
+    grid : list[dict]
+        Filter settings of each point (see `sweep_grid`)
+    tag : str
+        Filename tag
+    outname : Optional[str]
+        Name of output directory
+    workers : int, optional
+        Number of processes to fit chemicals with (see `fit_models`),
+        by default 1
+    cache : Optional[FitCache], optional
+        Fit cache, by default None (a temporary one)
+    engine : str, optional
+        Model fitting engine (see `fit_models`), by default "bmdrc"
+
+    Returns
+    -------
+    pd.DataFrame
+        BMDs of every point, with a column per filter setting
+    """
+    name = "morphology" if isinstance(obj, BinaryClass) else "LPR"
+    if not hasattr(obj, "plate_groups"):
+        filtering.make_plate_groups(obj)
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        if cache is None:
+            cache = FitCache(temp_dir)
+
+        sweep_bmds = list()
+        for i, settings in enumerate(grid):
+            label = sweep_label(settings)
+            print(f"...Sweep point {i + 1} of {len(grid)} ({label})")
+
+            point = copy.copy(obj)
+            point.plate_groups = obj.plate_groups.copy()
+
+            print(f"...Filtering {name} data")
+            run_filters(point, **settings)
+
+            print(f"...Fitting models to {name} data")
+            fit_models(point, workers, cache, engine)
+
+            write_outputs(point, f"{tag}_{label}", outname, report=False)
+            bmds = point.output_res_benchmark_dose.copy()
+            for j, (setting, value) in enumerate(settings.items()):
+                bmds.insert(j, setting, value)
+            sweep_bmds.append(bmds)
+
+    sweep_bmds = pd.concat(sweep_bmds, ignore_index=True)
+    out = "." if outname is None else str(outname)
+    sweep_bmds.to_csv(f"{out}/sweep_BMDS_{tag}.csv", index=False)
+    return sweep_bmds
+
+
+# Bootstrap confidence limits of the BMD10s of fitted data
+def run_bootstrap(
+    obj: BmdrcDataClass,
+    replicates: int = BOOTSTRAP_REPLICATES,
+    seed: int = 0,
+    workers: int = 1,
+):
+    """Add bootstrap BMDL10 and BMDU10 estimates to fitted data.
+
+    Sets `obj.bootstrap_bmds` (see `batched_fitting.bootstrap_bmds`),
+    which adds BMDL10 and BMDU10 columns to the BMD table.
+
+    Parameters
+    ----------
+    obj : BmdrcDataClass
+        Fitted `bmdrc.BinaryClass.BinaryClass` or `bmdrc.LPRClass.LPRClass`
+    replicates : int, optional
+        Resamples per curve, by default BOOTSTRAP_REPLICATES
+    seed : int, optional
+        Random seed, by default 0
+    workers : int, optional
+        Number of processes, by default 1
+    """
+    name = "morphology" if isinstance(obj, BinaryClass) else "LPR"
+    print(f"...Bootstrapping BMD10 confidence limits of {name} data")
+    obj.bootstrap_bmds = bootstrap_bmds(obj, replicates, seed, workers)
+
+
+def _benchmark_dose(obj: BmdrcDataClass) -> pd.DataFrame:
+    # bmdrc's BMD table, with bootstrap limits after the BMDL (if any)
+    obj.output_benchmark_dose()
+    limits = getattr(obj, "bootstrap_bmds", None)
+    if limits is not None:
+        bmds = obj.output_res_benchmark_dose.drop(
+            columns=["BMDL10", "BMDU10"], errors="ignore"
+        ).merge(limits, on="bmdrc.Endpoint.ID", how="left")
+        columns = [c for c in bmds.columns if c not in ["BMDL10", "BMDU10"]]
+        at = columns.index("BMDL") + 1
+        obj.output_res_benchmark_dose = bmds[
+            columns[:at] + ["BMDL10", "BMDU10"] + columns[at:]
+        ]
+    return obj.output_res_benchmark_dose
+
+
+##############################
+## LEGACY (COMBINE) OUTPUTS ##
+##############################
+
+# Numeric codes of the bmdrc data quality flags in the legacy BMD
+# tables (0/1: Poor, 2/3: Good, 4/5: Moderate)
+LEGACY_QC_CODES = {"Not Fit": 0, "Poor": 0, "Good": 2, "Moderate": 4}
+
+
+def legacy_tables(obj: BmdrcDataClass) -> dict[str, pd.DataFrame]:
+    """Format fitted results like the BMD, fit and dose files in
+    srp_build_files.csv, so they can be combined with them.
+
+    Parameters
+    ----------
+    obj : BmdrcDataClass
+        Fitted `bmdrc.BinaryClass.BinaryClass` or `bmdrc.LPRClass.LPRClass`
+
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        Tables keyed by type, one of ["bmd", "fit", "dose"]
+    """
+    bmds = _benchmark_dose(obj).copy()
+    obj.output_dose_table()
+    obj.output_fits_table()
+
+    # Bootstrap limits are NA unless `run_bootstrap` was called
+    for col in ["BMDL10", "BMDU10"]:
+        if col not in bmds.columns:
+            bmds[col] = np.nan
+
+    # Older bmdrc versions already write the legacy flags
+    if "BMD_Analysis_Flag" not in bmds.columns:
+
+        # Number of BMD10/BMD50 estimates within range; NA if not modeled
+        passed = (bmds["BMD10_Flag"] == "Pass").astype(int) + (
+            bmds["BMD50_Flag"] == "Pass"
+        ).astype(int)
+        bmds["BMD_Analysis_Flag"] = passed.where(bmds["Modeled_Flag"] == "Pass")
+        bmds["DataQC_Flag"] = bmds["DataQC_Flag"].map(LEGACY_QC_CODES)
+
+    return {
+        "bmd": bmds,
+        "fit": obj.output_res_fits_table.copy(),
+        "dose": obj.output_res_dose_table.copy(),
+    }
+
+
+# Run a full pipeline on a set of files (e.g. from a process pool)
+def fit_curve_files(
+    paths: list[str],
+    data_type: str,
+    workers: int = 1,
+    bootstrap: Optional[int] = None,
+) -> dict[str, pd.DataFrame]:
+    """Fit curves to morphology or LPR files.
+
+    Parameters
+    ----------
+    paths : list[str]
+        List of input files (or URLs) to concatenate
+    data_type : str
+        One of ["morphology", "behavior"]
+    workers : int, optional
+        Number of processes to fit chemicals with (see `fit_models`),
+            by default 1
+    bootstrap : Optional[int], optional
+        If given, BMD10 confidence limits are estimated from this
+        many bootstrap resamples per curve (see `run_bootstrap`),
+        by default None
+
+    Returns
+    -------
+    dict[str, pd.DataFrame]
+        Legacy-formatted tables (see `legacy_tables`)
+
+    Raises
+    ------
+    ValueError
+        If `data_type` is invalid
+    """
+    if data_type == "morphology":
+        obj = run_morpho_pipeline(combine_datasets(paths, MORPHO_COLUMNS), workers)
+    elif data_type == "behavior":
+        obj = run_lpr_pipeline(combine_datasets(paths, LPR_COLUMNS), workers)
+    else:
+        raise ValueError("Invalid data_type. Must be 'morphology' or 'behavior'.")
+    if bootstrap is not None:
+        run_bootstrap(obj, bootstrap, workers=workers)
+    return legacy_tables(obj)
 
 
 ###################
 ## WRITE OUTPUTS ##
 ###################
-def write_outputs(obj: BmdrcDataClass, tag: str, outname: Optional[str]):
+
+# Attributes not used in reports (input data and fitted model objects),
+# left out when reports are written in another process. bmdrc's markdown
+# report (bmdrc.output_modules.report_binary) only reads the column
+# names, report_* attributes, filter tables and plots, plate_groups,
+# bmds, failed_pvalue_test, model_fitting_* settings and the BMD table;
+# its JSON report deletes model_fits itself
+REPORT_EXCLUDE = ["df", "_df", "_ori_df", "model_fits"]
+
+
+def write_report(obj: BmdrcDataClass, tag: str, outname: Optional[str]):
+    """Write the report markdown and filter plots.
+
+    Parameters
+    ----------
+    obj : BmdrcDataClass
+        Fitted `bmdrc.BinaryClass.BinaryClass` or `bmdrc.LPRClass.LPRClass`
+    tag : str
+        Filename tag
+    outname : Optional[str]
+        Name of output directory
+    """
+    # bmdrc's report looks up the data class by name, so subclasses
+    # (e.g. SelectedLPRClass) are reported as their bmdrc class
+    if type(obj) is not _bmdrc_class(obj):
+        obj = copy.copy(obj)
+        obj.__class__ = _bmdrc_class(obj)
+
+    out = "." if outname is None else str(outname)
+    obj.report(f"{out}/new_report_{tag}/")
+
+
+def write_outputs(
+    obj: BmdrcDataClass,
+    tag: str,
+    outname: Optional[str],
+    report: bool = True,
+    pool: Optional[Executor] = None,
+) -> Optional[Future]:
     """Write all output files: BMDs, Dose, Fits, and Report markdown.
 
+    Tables are written first. The report is then written here, or
+    submitted to `pool` so that the caller can carry on while plots
+    are saved. bmdrc's report is a single summary of all chemicals
+    (a markdown file and the three filter plots, with no plots per
+    curve), so it is written as one task per data type rather than
+    split by chemical.
+
     Parameters
     ----------
     obj : BmdrcDataClass
@@ -322,15 +1935,24 @@ def write_outputs(obj: BmdrcDataClass, tag: str, outname: Optional[str]):
         Filename tag
     outname : Optional[str]
         Name of output directory
+    report : bool, optional
+        Whether to write the report, by default True
+    pool : Optional[Executor], optional
+        Pool to write the report in, by default None (write it here)
+
+    Returns
+    -------
+    Optional[Future]
+        The report being written in `pool`, if any
     """
     if outname is None:
         out = "."
     else:
         out = str(outname)
 
-    # Output bmds: Chemical_ID, End_Point, Model, BMD10, BMDL, BMD50, AUC, Min_Dose, Max_Dose, AUC_Norm,
-    # DataQC_Flag, BMD_Analysis_Flag, BMD10_Flag, BMD50_Flag, ids
-    obj.output_benchmark_dose(f"{out}/new_BMDS_{tag}.csv")
+    # Output bmds: Chemical_ID, End_Point, Model, BMD10, BMDL, (BMDL10, BMDU10,) BMD50, AUC, Min_Dose,
+    # Max_Dose, AUC_Norm, DataQC_Flag, BMD_Analysis_Flag, BMD10_Flag, BMD50_Flag, ids
+    _benchmark_dose(obj).to_csv(f"{out}/new_BMDS_{tag}.csv", header=True, index=False)
 
     # Output dose: Chemical_ID, End_Point, Dose, num.affected, num.nonna, ids, CI_Lo, CI_Hi
     obj.output_dose_table(f"{out}/new_Dose_{tag}.csv")
@@ -339,4 +1961,13 @@ def write_outputs(obj: BmdrcDataClass, tag: str, outname: Optional[str]):
     obj.output_fits_table(f"{out}/new_Fits_{tag}.csv")
 
     # Output reports
-    obj.report(f"{out}/new_report_{tag}/")
+    if not report:
+        return None
+    if pool is None:
+        write_report(obj, tag, out)
+        return None
+
+    # Only ship what the report uses to the pool
+    view = copy.copy(obj)
+    view.__dict__ = {k: v for k, v in vars(obj).items() if k not in REPORT_EXCLUDE}
+    return pool.submit(write_report, view, tag, out)